@@ -0,0 +1,89 @@
+# alergens.py
+import re
+
+from cerca import normalitzar
+
+
+# Els 14 al·lèrgens de declaració obligatòria (Reglament UE 1169/2011, annex II).
+# L'ordre fixa el bit de cadascun: no s'ha de canviar sense recalcular les màscares.
+ALERGENS = [
+    ("gluten", "Gluten", [
+        "gluten", "cereals", "cereals amb gluten", "blat", "ordi", "segol", "civada", "espelta",
+        "kamut", "trigo", "cebada", "centeno", "avena", "wheat", "barley", "rye", "oats",
+    ]),
+    ("crustacis", "Crustacis", ["crustacis", "crustaci", "crustaceos", "crustaceans", "gamba", "llagosti"]),
+    ("ous", "Ous", ["ou", "ous", "huevo", "huevos", "egg", "eggs"]),
+    ("peix", "Peix", ["peix", "pescado", "pescados", "fish"]),
+    ("cacauets", "Cacauets", ["cacauet", "cacauets", "cacahuete", "cacahuetes", "mani", "peanut", "peanuts"]),
+    ("soja", "Soja", ["soja", "soia", "soy", "soya"]),
+    ("llet", "Llet", ["llet", "lactosa", "lactics", "leche", "lacteos", "milk", "lactose"]),
+    ("fruits_closca", "Fruits de closca", [
+        "fruits de closca", "fruita seca", "fruits secs", "frutos de cascara", "frutos secos",
+        "ametlla", "ametlles", "avellana", "avellanes", "nou", "nous", "anacard", "anacards",
+        "pistatxo", "pistatxos", "almendra", "almendras", "nuez", "nueces", "nuts",
+    ]),
+    ("api", "Api", ["api", "apio", "celery"]),
+    ("mostassa", "Mostassa", ["mostassa", "mostaza", "mustard"]),
+    ("sesam", "Sèsam", ["sesam", "sesamo", "sesame"]),
+    ("sulfits", "Sulfits", [
+        "sulfits", "sulfit", "sulfitos", "dioxid de sofre", "anhidrid sulfuros", "so2",
+        "sulphites", "sulfites",
+    ]),
+    ("tramussos", "Tramussos", ["tramussos", "tramus", "altramuces", "altramuz", "lupin", "lupins"]),
+    ("molluscs", "Mol·luscs", ["mol luscs", "molluscs", "moluscos"]),
+]
+
+CLAUS = [clau for clau, _, _ in ALERGENS]
+ETIQUETES = {clau: etiqueta for clau, etiqueta, _ in ALERGENS}
+BIT = {clau: 1 << i for i, clau in enumerate(CLAUS)}
+
+# Sinònim normalitzat -> màscara; també acceptem la clau i l'etiqueta
+_SINONIMS: dict[str, int] = {}
+for _clau, _etiqueta, _sinonims in ALERGENS:
+    for _s in [_clau, _etiqueta, *_sinonims]:
+        _SINONIMS[normalitzar(_s)] = BIT[_clau]
+
+_SEPARADORS = re.compile(r"[,;/+\n]|\s+i\s+|\s+y\s+|\s+and\s+", re.IGNORECASE)
+_NEGACIONS = ("sense ", "sin ", "no ", "lliure de ", "free ")
+
+
+def bits_alergens(text) -> int:
+    # "FRUITS DE CLOSCA, OU" -> màscara amb els bits de fruits de closca i ous.
+    # Els trossos que comencen amb una negació ("sense gluten") no compten.
+    if text is None:
+        return 0
+    bits = 0
+    for tros in _SEPARADORS.split(str(text)):
+        tros = normalitzar(tros)
+        if not tros or tros in ("no", "cap", "sense") or tros.startswith(_NEGACIONS):
+            continue
+        paraules = tros.split()
+        # Busquem els sinònims com a paraules senceres (fins a 3 paraules seguides)
+        for llargada in (3, 2, 1):
+            for i in range(len(paraules) - llargada + 1):
+                bits |= _SINONIMS.get(" ".join(paraules[i:i + llargada]), 0)
+    return bits
+
+
+def claus_alergens(bits: int) -> list[str]:
+    return [clau for clau in CLAUS if bits & BIT[clau]]
+
+
+def etiquetes_alergens(bits: int) -> list[str]:
+    return [ETIQUETES[clau] for clau in claus_alergens(bits)]
+
+
+def mascara(claus) -> int:
+    # ["llet", "ous"] o "llet,ous" -> màscara; ValueError si algun no és un al·lergen conegut
+    if isinstance(claus, str):
+        claus = claus.split(",")
+    bits = 0
+    for c in claus:
+        c = str(c).strip()
+        if not c:
+            continue
+        b = BIT.get(c) or _SINONIMS.get(normalitzar(c))
+        if not b:
+            raise ValueError(f"Al·lergen desconegut: '{c}'. Valors possibles: {', '.join(CLAUS)}")
+        bits |= b
+    return bits
@@ -1,37 +1,87 @@
 # app.py
+import math
 import os
-import qrcode
 import sqlite3
 from pathlib import Path
-from flask import Flask, render_template, request, session, redirect, url_for, send_file
+from flask import Flask, Response, render_template, request, session, redirect, url_for, send_file, jsonify
+from flask.json.provider import DefaultJSONProvider
 from io import BytesIO
-from fpdf import FPDF
 from datetime import datetime
 
+import esborranys
+import llistat_ingredients
+import llistat_receptes
+import metriques
+import reformulacio
+import treballs
+import versions_receptes
+from alergens import ETIQUETES as ETIQUETES_ALERGENS, claus_alergens, mascara as mascara_alergens
+from bd import (
+    DB_PATH,
+    assegurar_esquema,
+    get_db_connection,
+    recepta_linies_ingredient_col,
+    tancar_connexions,
+    versio_ingredients,
+)
+from cataleg import obtenir_llista
+from cerca import cercar as cercar_ingredients, obtenir_index
+from codis_qr import etag_qr, FORMATS, generar_full_qr, generar_qr, MIDES
+from etiquetes_pdf import (
+    clau_lot,
+    generar_pdf_receptes,
+    nom_fitxer,
+    pdf_recepta,
+    pdf_receptes_en_pool,
+    zip_etiquetes,
+)
+from nutricio import (
+    calcular_nutricio_lot,
+    calcular_nutricio_per_100g,
+    calcular_nutricio_per_racio,
+    desar_nutricio_recepta,
+    id_subrecepta,
+    linies_recepta,
+    nutricio_recepta,
+    nutricio_recepta_original,
+    obtenir_matriu,
+    recalcular_receptes,
+    receptes_sense_alergens,
+    PREFIX_SUBRECEPTA,
+)
+from panell import Panell
+from versions_ingredients import llistar_versions
 
 
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "dades" / "nutricio.db"
-LOGO_PATH = BASE_DIR / "static" / "img" / "logo_masgrau.png"
-
-app = Flask(__name__)
-app.secret_key = "masgrau_valor_nutricional_secret_key"
 
+# Receptes que es poden demanar d'un cop a l'exportació d'etiquetes en bloc
+MAX_RECEPTES_LOT = 500
+# Segons que el navegador pot reutilitzar un QR sense tornar-lo a demanar
+QR_MAX_AGE = 24 * 3600
+# En segon pla sí que acceptem lots d'etiquetes molt més grans
+MAX_RECEPTES_TREBALL = 20_000
+# Mida màxima de l'Excel mestre que es pot pujar
+MAX_PUJADA_BYTES = 32 * 1024 * 1024
+# Les API JSON esperen un objecte; una llista o un escalar al cos és un 400
+ERROR_COS_JSON = "El cos de la petició ha de ser un objecte JSON."
+
+class ProveidorJSON(DefaultJSONProvider):
+    # Els panells de nutrició surten com el dict arrodonit de sempre
+    @staticmethod
+    def default(o):
+        if isinstance(o, Panell):
+            return o.a_dict()
+        return DefaultJSONProvider.default(o)
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
 
+app = Flask(__name__)
+app.json = ProveidorJSON(app)
+app.secret_key = "masgrau_valor_nutricional_secret_key"
+app.config["MAX_CONTENT_LENGTH"] = MAX_PUJADA_BYTES
+metriques.instal_lar(app)
+app.jinja_env.globals["ETIQUETES_ALERGENS"] = ETIQUETES_ALERGENS
 
-def _recepta_linies_ingredient_col(conn: sqlite3.Connection) -> str:
-    cols = [r["name"] for r in conn.execute("PRAGMA table_info(recepta_linies);").fetchall()]
-    if "ingredient_codi" in cols:
-        return "ingredient_codi"
-    if "codi" in cols:
-        return "codi"
-    raise RuntimeError("La taula 'recepta_linies' no té columna 'ingredient_codi' ni 'codi'.")
 
 
 def guardar_recepta_a_db(nom_recepta: str, linies: list[dict]) -> int:
@@ -41,17 +91,23 @@ def guardar_recepta_a_db(nom_recepta: str, linies: list[dict]) -> int:
     if not linies:
         raise ValueError("No hi ha ingredients per guardar.")
 
+    # La recepta queda lligada a la versió d'ingredients amb què es calcula
+    matriu = obtenir_matriu()
     conn = get_db_connection()
     try:
         cur = conn.cursor()
 
-        cur.execute("INSERT INTO receptes (nom) VALUES (?)", (nom_recepta,))
+        cur.execute(
+            "INSERT INTO receptes (nom, versio_ingredients) VALUES (?, ?)",
+            (nom_recepta, matriu.versio),
+        )
         recepta_id = cur.lastrowid
 
-        ing_col = _recepta_linies_ingredient_col(conn)
+        ing_col = recepta_linies_ingredient_col(conn)
         sql = f"INSERT INTO recepta_linies (recepta_id, {ing_col}, grams) VALUES (?, ?, ?)"
+        sql_sub = "INSERT INTO recepta_subreceptes (recepta_id, subrecepta_id, grams) VALUES (?, ?, ?)"
 
-        inserts = 0
+        desades = []
         for linia in linies:
             codi = (linia.get("codi") or "").strip()
             try:
@@ -62,12 +118,20 @@ def guardar_recepta_a_db(nom_recepta: str, linies: list[dict]) -> int:
             if not codi or grams <= 0:
                 continue
 
-            cur.execute(sql, (recepta_id, codi, grams))
-            inserts += 1
+            sub_id = id_subrecepta(codi)
+            if sub_id is not None:
+                cur.execute(sql_sub, (recepta_id, sub_id, grams))
+            else:
+                cur.execute(sql, (recepta_id, codi, grams))
+            desades.append({"codi": codi, "grams": grams})
 
-        if inserts == 0:
+        if not desades:
             raise ValueError("No hi ha línies vàlides (grams > 0) per guardar.")
 
+        # La nutrició es materialitza en el mateix commit que les línies
+        desar_nutricio_recepta(conn, recepta_id, desades, matriu=matriu)
+        versions_receptes.registrar_inicial(conn, recepta_id)
+
         conn.commit()
         return recepta_id
     except Exception:
@@ -77,248 +141,94 @@ def guardar_recepta_a_db(nom_recepta: str, linies: list[dict]) -> int:
         conn.close()
 
 
-def generar_pdf_recepta(
-    nom_recepta: str,
-    linies: list[dict],
-    resultat_100g: dict | None,
-    resultat_racio: dict | None
-) -> BytesIO:
-    nom_recepta = (nom_recepta or "").strip() or "Recepta sense nom"
+def preparar_bd():
+    # Esquema auxiliar, matriu de nutrients, llista d'ingredients, índex de cerca
+    # i columna d'ingredient de recepta_linies (es recarreguen soles quan canvia
+    # la versió d'ingredients)
+    if not DB_PATH.exists():
+        return
+    conn = get_db_connection()
+    try:
+        assegurar_esquema(conn)
+        obtenir_matriu()
+        obtenir_llista()
+        obtenir_index()
+        recepta_linies_ingredient_col(conn)
+        treballs.marcar_interromputs(conn)
+    except RuntimeError:
+        pass  # es tornarà a provar (i avisar) en guardar una recepta
+    finally:
+        conn.close()
 
-    pdf = FPDF(orientation="P", unit="mm", format="A4")
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-    # --- LOGO (debug + inserció) ---
-    print("LOGO_PATH:", LOGO_PATH)
-    print("EXISTE LOGO?:", LOGO_PATH.exists())
 
-    try:
-        if LOGO_PATH.exists():
-            # Logo a dalt-esquerra (marges 15mm)
-            pdf.image(str(LOGO_PATH), x=15, y=12, w=35)
-        else:
-            print("⚠️ No trobo el logo en aquesta ruta.")
-    except Exception as e:
-        print("❌ Error carregant logo:", e)
+def crear_app() -> Flask:
+    # Punt d'entrada WSGI (vegeu wsgi.py i gunicorn.conf.py). Amb preload el
+    # procés pare importa l'app una vegada i els workers hereten les caches; les
+    # connexions SQLite no es poden heretar, així que les tanquem abans del fork
+    tancar_connexions()
+    return app
 
-    # baixem el cursor perquè el títol no es solapi
-    pdf.set_y(32)
 
-    # --- LOGO (a dalt a l'esquerra) ---
-    try:
-        if LOGO_PATH.exists():
-            pdf.image(str(LOGO_PATH), x=15, y=12, w=35)  # ajusta w si el vols més gran/petit
-    except Exception:
-        # Si el logo falla, no trenquem el PDF
-        pass
-
-    # Deixem espai perquè el títol no es solapi amb el logo
-    pdf.set_y(32)
-
-    pdf.set_font("Helvetica", "B", 16)
-    pdf.cell(0, 10, f"Recepta: {nom_recepta}", ln=True)
-
-    pdf.set_font("Helvetica", "", 10)
-    pdf.cell(0, 6, f"Generat: {datetime.now().strftime('%Y-%m-%d %H:%M')}", ln=True)
-    pdf.ln(3)
-
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 8, "Ingredients", ln=True)
-
-    pdf.set_font("Helvetica", "B", 10)
-    pdf.cell(120, 7, "Ingredient", border=1)
-    pdf.cell(30, 7, "Codi", border=1)
-    pdf.cell(30, 7, "Grams", border=1, ln=True)
-
-    pdf.set_font("Helvetica", "", 10)
-
-    total_grams = 0.0
-    for l in linies or []:
-        ingredient = str(l.get("ingredient", "") or "")
-        codi = str(l.get("codi", "") or "")
-        grams = float(l.get("grams", 0) or 0)
-
-        total_grams += grams
-
-        if len(ingredient) > 60:
-            ingredient = ingredient[:57] + "..."
-
-        pdf.cell(120, 7, ingredient, border=1)
-        pdf.cell(30, 7, codi, border=1)
-        pdf.cell(30, 7, f"{grams:.2f}", border=1, ln=True)
-
-    pdf.set_font("Helvetica", "B", 10)
-    pdf.cell(150, 7, "Pes total (g)", border=1)
-    pdf.cell(30, 7, f"{total_grams:.2f}", border=1, ln=True)
-    pdf.ln(6)
-
-    if resultat_100g:
-        pdf.set_font("Helvetica", "B", 12)
-        pdf.cell(0, 8, "Informacio nutricional (per 100 g)", ln=True)
-
-        pdf.set_font("Helvetica", "", 10)
-
-        def fila(label, key):
-            pdf.cell(90, 7, label, border=1)
-            pdf.cell(0, 7, str(resultat_100g.get(key, "")), border=1, ln=True)
-
-        fila("Energia (kcal)", "energia_kcal_100g")
-        fila("Energia (kJ)", "energia_kj_100g")
-        fila("Greixos (g)", "greixos_100g")
-        fila("Greixos saturats (g)", "greixos_saturats_100g")
-        fila("Hidrats de carboni (g)", "hidrats_carboni_100g")
-        fila("Sucres (g)", "sucres_100g")
-        fila("Proteines (g)", "proteines_100g")
-        fila("Fibra (g)", "fibra_100g")
-        fila("Sal (g)", "sal_100g")
-        pdf.ln(6)
-
-    if resultat_racio:
-        pdf.set_font("Helvetica", "B", 12)
-        pdf.cell(0, 8, f"Informacio nutricional (per racio: {resultat_racio.get('racio_g', '')} g)", ln=True)
-
-        pdf.set_font("Helvetica", "", 10)
-
-        def fila_r(label, key):
-            pdf.cell(90, 7, label, border=1)
-            pdf.cell(0, 7, str(resultat_racio.get(key, "")), border=1, ln=True)
-
-        fila_r("Energia (kcal)", "energia_kcal")
-        fila_r("Energia (kJ)", "energia_kj")
-        fila_r("Greixos (g)", "greixos")
-        fila_r("Greixos saturats (g)", "greixos_saturats")
-        fila_r("Hidrats de carboni (g)", "hidrats_carboni")
-        fila_r("Sucres (g)", "sucres")
-        fila_r("Proteines (g)", "proteines")
-        fila_r("Fibra (g)", "fibra")
-        fila_r("Sal (g)", "sal")
-
-    # --- COPYRIGHT (peu de pàgina) ---
-    auto = pdf.auto_page_break
-    margin = pdf.b_margin
-
-    pdf.set_auto_page_break(auto=False)  # evita que creï una pàgina nova pel footer
-    pdf.set_y(-15)
-    pdf.set_font("Helvetica", "", 8)
-    pdf.set_text_color(120, 120, 120)
-    pdf.cell(0, 5, "by Lyu La Cruz", align="C")
-
-    pdf.set_auto_page_break(auto=auto, margin=margin)  # restaura
-
-    output = BytesIO()
-    pdf_data = pdf.output(dest="S")  # puede ser str o bytearray según versión
-    if isinstance(pdf_data, str):
-        pdf_bytes = pdf_data.encode("latin1")
-    else:
-        pdf_bytes = bytes(pdf_data)  # bytearray -> bytes
-    output.write(pdf_bytes)
-    output.seek(0)
-    return output
-
-def generar_qr(url: str) -> BytesIO:
-    qr = qrcode.QRCode(
-        version=2,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
+preparar_bd()
 
-    img = qr.make_image(fill_color="black", back_color="white")
 
-    output = BytesIO()
-    img.save(output, format="PNG")
-    output.seek(0)
-    return output
+def _esborrany_id() -> str:
+    # La sessió (cookie) només guarda l'identificador; les línies viuen a la BD
+    esborrany_id = session.get("esborrany_id")
+    if not esborrany_id:
+        esborrany_id = esborranys.nou_id()
+        session["esborrany_id"] = esborrany_id
+    return esborrany_id
 
 
-def calcular_nutricio_per_100g(linies):
-    if not linies:
-        return None
+def _nom_linia(conn, llista, codi: str) -> str | None:
+    # Nom a mostrar d'un codi d'ingredient o d'una subrecepta ("R:<id>"); None si no existeix
+    sub_id = id_subrecepta(codi)
+    if sub_id is None:
+        return llista.noms.get(codi)
 
-    try:
-        total_grams = sum(float(l["grams"]) for l in linies)
-    except Exception:
-        return None
-
-    if total_grams <= 0:
-        return None
-
-    totals = {
-        "energia_kcal": 0.0,
-        "energia_kj": 0.0,
-        "greixos": 0.0,
-        "greixos_saturats": 0.0,
-        "hidrats_carboni": 0.0,
-        "sucres": 0.0,
-        "proteines": 0.0,
-        "fibra": 0.0,
-        "sal": 0.0,
-    }
+    row = conn.execute("SELECT nom FROM receptes WHERE id = ?", (sub_id,)).fetchone()
+    return f"{row['nom']} (recepta)" if row else None
 
-    def v(x):
-        return float(x) if x is not None else 0.0
 
+def _llegir_esborrany() -> dict:
     conn = get_db_connection()
     try:
-        for l in linies:
-            codi = (l.get("codi") or "").strip()
-            try:
-                grams = float(l.get("grams", 0) or 0)
-            except ValueError:
-                grams = 0.0
+        return esborranys.obtenir(conn, _esborrany_id())
+    finally:
+        conn.close()
 
-            if not codi or grams <= 0:
-                continue
 
-            row = conn.execute(
-                """
-                SELECT
-                    energia_kcal_100g,
-                    energia_kj_100g,
-                    greixos_100g,
-                    greixos_saturats_100g,
-                    hidrats_carboni_100g,
-                    sucres_100g,
-                    proteines_100g,
-                    fibra_100g,
-                    sal_100g
-                FROM ingredients
-                WHERE codi = ?
-                """,
-                (codi,),
-            ).fetchone()
+def _enviar_pdf(pdf_bytes: bytes, clau: str, filename: str):
+    # L'ETag és la clau del contingut: una reimpressió idèntica respon 304
+    # (send_file fa el make_conditional amb la petició)
+    return send_file(
+        BytesIO(pdf_bytes),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=filename,
+        etag=clau,
+        max_age=0,
+        conditional=True,
+    )
 
-            if row is None:
-                continue
 
-            factor = grams / 100.0
-            totals["energia_kcal"] += v(row["energia_kcal_100g"]) * factor
-            totals["energia_kj"] += v(row["energia_kj_100g"]) * factor
-            totals["greixos"] += v(row["greixos_100g"]) * factor
-            totals["greixos_saturats"] += v(row["greixos_saturats_100g"]) * factor
-            totals["hidrats_carboni"] += v(row["hidrats_carboni_100g"]) * factor
-            totals["sucres"] += v(row["sucres_100g"]) * factor
-            totals["proteines"] += v(row["proteines_100g"]) * factor
-            totals["fibra"] += v(row["fibra_100g"]) * factor
-            totals["sal"] += v(row["sal_100g"]) * factor
+@app.route("/salut", methods=["GET"])
+def salut():
+    # Comprovació de disponibilitat per al balancejador
+    conn = get_db_connection()
+    try:
+        versio = versio_ingredients(conn)
+    except sqlite3.Error as e:
+        return jsonify({"estat": "error", "error": str(e)}), 503
     finally:
         conn.close()
+    return jsonify({"estat": "ok", "pid": os.getpid(), "versio_ingredients": versio})
 
-    escala = 100.0 / total_grams
-    return {
-        "pes_total_g": round(total_grams, 2),
-        "energia_kcal_100g": round(totals["energia_kcal"] * escala, 2),
-        "energia_kj_100g": round(totals["energia_kj"] * escala, 2),
-        "greixos_100g": round(totals["greixos"] * escala, 2),
-        "greixos_saturats_100g": round(totals["greixos_saturats"] * escala, 2),
-        "hidrats_carboni_100g": round(totals["hidrats_carboni"] * escala, 2),
-        "sucres_100g": round(totals["sucres"] * escala, 2),
-        "proteines_100g": round(totals["proteines"] * escala, 2),
-        "fibra_100g": round(totals["fibra"] * escala, 2),
-        "sal_100g": round(totals["sal"] * escala, 2),
-    }
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metriques.text_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/")
@@ -329,7 +239,8 @@ def inici():
 @app.route("/receptes/pdf", methods=["POST"])
 def descarregar_pdf_recepta():
     nom_recepta = (request.form.get("nom_recepta", "") or "").strip()
-    linies = session.get("linies", [])
+    esborrany = _llegir_esborrany()
+    linies = esborrany["linies"]
 
     if not linies:
         session["missatge"] = "❌ No hi ha ingredients a la recepta."
@@ -337,181 +248,1017 @@ def descarregar_pdf_recepta():
 
     resultat_100g = calcular_nutricio_per_100g(linies)
 
-    resultat_racio = None
+    resultat_racio = calcular_nutricio_per_racio(resultat_100g, esborrany["racio_g"])
+
+    pdf_bytes, clau = pdf_recepta(nom_recepta, linies, resultat_100g, resultat_racio)
+
+    return _enviar_pdf(pdf_bytes, clau, f"{nom_fitxer(nom_recepta)}.pdf")
+
+
+def _ids_receptes(valors) -> list[int]:
+    # Accepta [1, 2], ["1,2", "3"] o "1, 2 3"; sense repetits i en l'ordre donat
+    if isinstance(valors, (str, int)):
+        valors = [valors]
+    ids = []
+    for v in valors or []:
+        for tros in str(v).replace(",", " ").split():
+            recepta_id = int(tros)
+            if recepta_id not in ids:
+                ids.append(recepta_id)
+    return ids
+
+
+def _etiquetes_receptes(
+    recepta_ids: list[int], racio_g, original: bool = False
+) -> tuple[list[dict], list[int]]:
+    # Dades de les etiquetes de receptes guardades (i els ids que no existeixen).
+    # Amb `original`, amb les fitxes d'ingredient de quan es va guardar cada recepta.
+    llista = obtenir_llista()
+    etiquetes, absents = [], []
+    conn = get_db_connection()
+    try:
+        for recepta_id in recepta_ids:
+            row = conn.execute("SELECT nom FROM receptes WHERE id = ?", (recepta_id,)).fetchone()
+            if row is None:
+                absents.append(recepta_id)
+                continue
+
+            linies = [
+                {**l, "ingredient": _nom_linia(conn, llista, l["codi"]) or ""}
+                for l in linies_recepta(conn, recepta_id)
+            ]
+            if original:
+                resultat_100g, _ = nutricio_recepta_original(conn, recepta_id)
+            else:
+                resultat_100g = nutricio_recepta(conn, recepta_id)
+            etiquetes.append({
+                "id": recepta_id,
+                "nom": row["nom"],
+                "linies": linies,
+                "resultat_100g": resultat_100g,
+                "resultat_racio": calcular_nutricio_per_racio(resultat_100g, racio_g),
+            })
+    finally:
+        conn.close()
+    return etiquetes, absents
+
+
+@app.route("/receptes/<int:recepta_id>/pdf", methods=["GET"])
+def descarregar_pdf_recepta_guardada(recepta_id):
+    # Destí dels QR de recepta: l'etiqueta d'una recepta guardada, sense passar per la sessió
     try:
-        racio_g = float(session.get("racio_g", 0) or 0)
+        etiquetes, _ = _etiquetes_receptes(
+            [recepta_id], request.args.get("racio_g", ""), request.args.get("versio") == "original"
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if not etiquetes:
+        return jsonify({"error": "No existeix la recepta."}), 404
+
+    e = etiquetes[0]
+    pdf_bytes, clau = pdf_recepta(e["nom"], e["linies"], e["resultat_100g"], e["resultat_racio"])
+    return _enviar_pdf(pdf_bytes, clau, f"{nom_fitxer(e['nom'])}.pdf")
+
+
+@app.route("/receptes/pdf/lot", methods=["POST"])
+def descarregar_pdf_lot():
+    # Etiquetes de moltes receptes guardades: un PDF de diverses pàgines o un ZIP amb un PDF per recepta
+    dades = request.get_json(silent=True) or request.form
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    valors = dades.getlist("ids") if hasattr(dades, "getlist") else dades.get("ids")
+    format_sortida = str(dades.get("format") or "pdf").strip().lower()
+    racio_g = dades.get("racio_g") or ""
+
+    try:
+        recepta_ids = _ids_receptes(valors)
+    except ValueError:
+        return jsonify({"error": "Els ids de recepta han de ser enters."}), 400
+    if not recepta_ids:
+        return jsonify({"error": "Cal indicar almenys un id de recepta a 'ids'."}), 400
+    if len(recepta_ids) > MAX_RECEPTES_LOT:
+        return jsonify({"error": f"Com a molt {MAX_RECEPTES_LOT} receptes per lot."}), 400
+    if format_sortida not in ("pdf", "zip"):
+        return jsonify({"error": "El format ha de ser 'pdf' o 'zip'."}), 400
+
+    try:
+        etiquetes, absents = _etiquetes_receptes(recepta_ids, racio_g)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if absents:
+        return jsonify({"error": "No existeixen algunes receptes.", "absents": absents}), 404
+
+    nom = f"etiquetes_{datetime.now().strftime('%Y%m%d')}"
+    if format_sortida == "zip":
+        # Cada PDF s'envia al client tan bon punt surt del pool
+        return Response(
+            zip_etiquetes(etiquetes),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f"attachment; filename={nom}.zip"},
+        )
+
+    return _enviar_pdf(generar_pdf_receptes(etiquetes), clau_lot(etiquetes), f"{nom}.pdf")
+
+
+# Treballs en segon pla: la petició només encua i torna l'id; l'estat es consulta a /api/treballs/<id>
+@treballs.registrar("importacio")
+def _treball_importacio(treball_id: str, parametres: dict, progres) -> dict:
+    import importar_excel  # pandas + openpyxl: només cal si s'importa
+
+    path = Path(parametres["fitxer"])
+    try:
+        df = importar_excel.carregar_excel(path)
+        resultat = importar_excel.importar_a_sqlite(
+            df,
+            progres=progres,
+            eliminar_absents=bool(parametres.get("eliminar_absents")),
+            origen=parametres.get("nom") or path.name,
+        )
+    finally:
+        path.unlink(missing_ok=True)
+    return {
+        "inserits": resultat.inserits,
+        "actualitzats": resultat.actualitzats,
+        "sense_canvis": resultat.sense_canvis,
+        "eliminats": resultat.eliminats,
+        "receptes_invalidades": resultat.receptes_invalidades,
+        "versio": resultat.versio,
+        "conservats": sorted(resultat.conservats),
+    }
+
+
+@treballs.registrar("etiquetes")
+def _treball_etiquetes(treball_id: str, parametres: dict, progres) -> dict:
+    etiquetes, absents = _etiquetes_receptes(parametres["ids"], parametres.get("racio_g") or "")
+    format_sortida = parametres.get("format") or "pdf"
+    desti = treballs.fitxer(treball_id, format_sortida)
+    total = len(etiquetes)
+
+    # Fins a MAX_RECEPTES_TREBALL etiquetes: es pinten als processos del pool de
+    # PDFs, no en aquest fil del worker web
+    if format_sortida == "zip":
+        with open(desti, "wb") as f:
+            for i, tros in enumerate(zip_etiquetes(etiquetes, sempre_pool=True)):
+                f.write(tros)
+                progres(min(i, total), total)
+    else:
+        progres(0, total)
+        desti.write_bytes(pdf_receptes_en_pool(etiquetes))
+    progres(total, total)
+    return {"fitxer": desti.name, "receptes": total, "absents": absents}
+
+
+@treballs.registrar("recalcul")
+def _treball_recalcul(treball_id: str, parametres: dict, progres) -> dict:
+    return recalcular_receptes(progres=progres)
+
+
+def _treball_encuat(treball_id: str):
+    resposta = jsonify({
+        "id": treball_id,
+        "estat": "pendent",
+        "url_estat": url_for("api_treball", treball_id=treball_id),
+    })
+    resposta.status_code = 202
+    resposta.headers["Location"] = url_for("api_treball", treball_id=treball_id)
+    return resposta
+
+
+@app.route("/treballs/importacio", methods=["POST"])
+def treball_importacio():
+    # Formulari multipart amb 'fitxer' (.xlsx) i 'eliminar_absents' opcional
+    fitxer = request.files.get("fitxer")
+    if fitxer is None or not fitxer.filename:
+        return jsonify({"error": "Cal pujar l'Excel mestre al camp 'fitxer'."}), 400
+    if not fitxer.filename.lower().endswith((".xlsx", ".xlsm")):
+        return jsonify({"error": "L'Excel ha de ser .xlsx."}), 400
+
+    treball_id = treballs.nou_id()
+    path = treballs.fitxer(treball_id, "xlsx")
+    fitxer.save(path)
+    treballs.encuar("importacio", {
+        "fitxer": str(path),
+        "nom": fitxer.filename,
+        "eliminar_absents": request.form.get("eliminar_absents") in ("1", "true", "on"),
+    }, treball_id)
+    return _treball_encuat(treball_id)
+
+
+@app.route("/treballs/etiquetes", methods=["POST"])
+def treball_etiquetes():
+    dades = request.get_json(silent=True) or request.form
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    valors = dades.getlist("ids") if hasattr(dades, "getlist") else dades.get("ids")
+    format_sortida = str(dades.get("format") or "pdf").strip().lower()
+
+    try:
+        recepta_ids = _ids_receptes(valors)
     except ValueError:
-        racio_g = 0.0
-
-    if resultat_100g and racio_g > 0:
-        factor = racio_g / 100.0
-        resultat_racio = {
-            "racio_g": round(racio_g, 2),
-            "energia_kcal": round(resultat_100g["energia_kcal_100g"] * factor, 2),
-            "energia_kj": round(resultat_100g["energia_kj_100g"] * factor, 2),
-            "greixos": round(resultat_100g["greixos_100g"] * factor, 2),
-            "greixos_saturats": round(resultat_100g["greixos_saturats_100g"] * factor, 2),
-            "hidrats_carboni": round(resultat_100g["hidrats_carboni_100g"] * factor, 2),
-            "sucres": round(resultat_100g["sucres_100g"] * factor, 2),
-            "proteines": round(resultat_100g["proteines_100g"] * factor, 2),
-            "fibra": round(resultat_100g["fibra_100g"] * factor, 2),
-            "sal": round(resultat_100g["sal_100g"] * factor, 2),
-        }
-
-    pdf_io = generar_pdf_recepta(nom_recepta, linies, resultat_100g, resultat_racio)
-
-    safe_name = "".join(
-        c for c in (nom_recepta or "recepta")
-        if c.isalnum() or c in (" ", "_", "-")
-    ).strip().replace(" ", "_")
-    filename = f"{safe_name or 'recepta'}.pdf"
+        return jsonify({"error": "Els ids de recepta han de ser enters."}), 400
+    if not recepta_ids:
+        return jsonify({"error": "Cal indicar almenys un id de recepta a 'ids'."}), 400
+    if len(recepta_ids) > MAX_RECEPTES_TREBALL:
+        return jsonify({"error": f"Com a molt {MAX_RECEPTES_TREBALL} receptes per treball."}), 400
+    if format_sortida not in ("pdf", "zip"):
+        return jsonify({"error": "El format ha de ser 'pdf' o 'zip'."}), 400
+
+    treball_id = treballs.encuar("etiquetes", {
+        "ids": recepta_ids,
+        "format": format_sortida,
+        "racio_g": dades.get("racio_g") or "",
+    })
+    return _treball_encuat(treball_id)
+
+
+@app.route("/treballs/recalcul", methods=["POST"])
+def treball_recalcul():
+    return _treball_encuat(treballs.encuar("recalcul", {}))
+
 
+@app.route("/api/treballs", methods=["GET"])
+def api_treballs():
+    conn = get_db_connection()
+    try:
+        return jsonify({"treballs": treballs.llistar(conn)})
+    finally:
+        conn.close()
+
+
+@app.route("/api/treballs/<treball_id>", methods=["GET"])
+def api_treball(treball_id):
+    conn = get_db_connection()
+    try:
+        treball = treballs.obtenir(conn, treball_id)
+    finally:
+        conn.close()
+    if treball is None:
+        return jsonify({"error": "No existeix el treball."}), 404
+
+    if treball["estat"] == "fet" and (treball["resultat"] or {}).get("fitxer"):
+        treball["url_fitxer"] = url_for("descarregar_fitxer_treball", treball_id=treball_id)
+    return jsonify(treball)
+
+
+@app.route("/treballs/<treball_id>/fitxer", methods=["GET"])
+def descarregar_fitxer_treball(treball_id):
+    conn = get_db_connection()
+    try:
+        treball = treballs.obtenir(conn, treball_id)
+    finally:
+        conn.close()
+    nom = ((treball or {}).get("resultat") or {}).get("fitxer")
+    if not nom or not (treballs.DIR_TREBALLS / nom).exists():
+        return jsonify({"error": "El treball no té cap fitxer disponible."}), 404
+
+    extensio = nom.rsplit(".", 1)[-1]
     return send_file(
-        pdf_io,
-        mimetype="application/pdf",
+        treballs.DIR_TREBALLS / nom,
+        mimetype="application/zip" if extensio == "zip" else "application/pdf",
         as_attachment=True,
-        download_name=filename
+        download_name=f"etiquetes_{treball['creat_el'][:10].replace('-', '')}.{extensio}",
     )
 
 
-@app.route("/ingredients")
-def ingredients():
+def _linies_valides(linies) -> bool:
+    # Llista d'objectes {codi: text, grams: número finit >= 0}; "inf" o "nan"
+    # acabarien com a Infinity/NaN al JSON
+    if not isinstance(linies, list):
+        return False
+    for l in linies:
+        if not isinstance(l, dict) or not isinstance(l.get("codi"), str):
+            return False
+        try:
+            grams = float(l.get("grams"))
+        except (TypeError, ValueError):
+            return False
+        if not math.isfinite(grams) or grams < 0:
+            return False
+    return True
+
+
+@app.route("/api/nutricio", methods=["POST"])
+def api_nutricio():
+    # Càlcul sense estat: {"linies": [{"codi", "grams"}, ...], "racio_g": opcional}
+    dades = request.get_json(silent=True) or {}
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    linies = dades.get("linies")
+    if not _linies_valides(linies):
+        return jsonify({"error": "Cal una llista 'linies' amb objectes {codi, grams}."}), 400
+
+    try:
+        resultat = calcular_nutricio_per_100g(linies)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({
+        "resultat": resultat,
+        "resultat_racio": calcular_nutricio_per_racio(resultat, dades.get("racio_g")),
+    })
+
+
+# Esborrany de la calculadora: cada operació torna només el panell actualitzat
+@app.route("/api/esborrany", methods=["GET"])
+def api_esborrany():
+    return jsonify(_panell_esborrany())
+
+
+@app.route("/api/esborrany", methods=["DELETE"])
+def api_netejar_esborrany():
+    session.pop("recepta_carregada", None)
     conn = get_db_connection()
     try:
-        rows = conn.execute(
-            """
-            SELECT
-                codi, ingredient, proveidor,
-                energia_kcal_100g, energia_kj_100g
-            FROM ingredients
-            ORDER BY codi
-            """
-        ).fetchall()
+        esborranys.netejar(conn, _esborrany_id())
     finally:
         conn.close()
-    return render_template("ingredients.html", ingredients=rows)
+    return jsonify(_panell_esborrany())
+
+
+@app.route("/api/esborrany/linies", methods=["POST"])
+def api_afegir_linia():
+    dades = request.get_json(silent=True) or {}
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    error, estat = _afegir_a_esborrany(
+        _esborrany_id(),
+        dades.get("codi"),
+        dades.get("quantitat"),
+        dades.get("unitat", "g"),
+        dades.get("racio_g"),
+    )
+    if error:
+        return jsonify({"error": error}), estat
+    return jsonify(_panell_esborrany())
 
 
-@app.route("/calculadora", methods=["GET", "POST"])
-def calculadora():
-    if "linies" not in session:
-        session["linies"] = []
+@app.route("/api/esborrany/linies/<int:index>", methods=["DELETE"])
+def api_eliminar_linia(index):
+    conn = get_db_connection()
+    try:
+        esborranys.eliminar_linia(conn, _esborrany_id(), index)
+    finally:
+        conn.close()
+    return jsonify(_panell_esborrany())
 
-    linies = session.get("linies", [])
-    racio_str = session.get("racio_g", "")
-    missatge = session.pop("missatge", "")
 
+@app.route("/api/esborrany/racio", methods=["PUT"])
+def api_desar_racio():
+    dades = request.get_json(silent=True) or {}
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
     conn = get_db_connection()
     try:
-        ingredients = conn.execute(
-            """
-            SELECT codi, ingredient
-            FROM ingredients
-            ORDER BY ingredient
-            """
-        ).fetchall()
+        esborranys.desar_racio(conn, _esborrany_id(), str(dades.get("racio_g") or "").strip())
     finally:
         conn.close()
+    return jsonify(_panell_esborrany())
+
+
+@app.route("/api/nutricio/lot", methods=["POST"])
+def api_nutricio_lot():
+    dades = request.get_json(silent=True) or {}
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    receptes = dades.get("receptes")
+    if not isinstance(receptes, list) or not all(isinstance(r, dict) for r in receptes):
+        return jsonify({"error": "Cal una llista 'receptes' amb objectes {linies, racio_g}."}), 400
+    for i, recepta in enumerate(receptes):
+        if not _linies_valides(recepta.get("linies")):
+            return jsonify({
+                "error": f"La recepta {i} ha de tenir una llista 'linies' amb objectes {{codi, grams}}.",
+                "recepta": i,
+            }), 400
+
+    resultats = calcular_nutricio_lot(receptes)
+    for recepta, resultat in zip(receptes, resultats):
+        if "id" in recepta:
+            resultat["id"] = recepta["id"]
+
+    return jsonify({"resultats": resultats})
+
+
+@app.route("/api/reformulacio", methods=["POST"])
+def api_reformulacio():
+    # {"linies": [{"codi", "grams", "min", "max", "fixe"}, ...],
+    #  "objectius": {"sucres": {"max": 5}, ...}, "pes_total": opcional}
+    dades = request.get_json(silent=True) or {}
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    linies = dades.get("linies")
+    if not isinstance(linies, list) or not all(
+        isinstance(l, dict) and isinstance(l.get("codi"), str) for l in linies
+    ):
+        return jsonify({"error": "Cal una llista 'linies' amb objectes {codi, grams, min, max}."}), 400
 
-    if request.method == "POST":
-        codi = (request.form.get("codi", "") or "").strip()
-        unitat = (request.form.get("unitat", "g") or "g").strip()
+    try:
+        resultat = reformulacio.reformular(linies, dades.get("objectius") or {}, dades.get("pes_total"))
+    except KeyError as e:
+        return jsonify({"error": f"Codi desconegut: {e.args[0]}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    resultat["resultat_racio"] = calcular_nutricio_per_racio(resultat["resultat"], dades.get("racio_g"))
+    return jsonify(resultat)
+
+
+@app.route("/api/reformulacio/candidats", methods=["POST"])
+def api_reformulacio_candidats():
+    # {"codis": [...], "candidats": [[grams per codi], ...], "objectius": opcional}
+    dades = request.get_json(silent=True) or {}
+    if not isinstance(dades, dict):
+        return jsonify({"error": ERROR_COS_JSON}), 400
+    codis = dades.get("codis")
+    candidats = dades.get("candidats")
+    if not isinstance(codis, list) or not all(isinstance(c, str) for c in codis) or not isinstance(candidats, list):
+        return jsonify({"error": "Cal una llista 'codis' i una llista 'candidats' de grams."}), 400
 
-        try:
-            quantitat = float(request.form.get("quantitat", "0") or 0)
-        except ValueError:
-            quantitat = 0.0
+    try:
+        resultats = reformulacio.avaluar_candidats([c.strip() for c in codis], candidats, dades.get("objectius"))
+    except KeyError as e:
+        return jsonify({"error": f"Codi desconegut: {e.args[0]}"}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
-        racio_form = (request.form.get("racio_g", "") or "").strip()
-        session["racio_g"] = racio_form
-        racio_str = racio_form
+    return jsonify({"resultats": resultats, "compleixen": sum(r["compleix"] for r in resultats)})
 
-        grams = quantitat * 1000 if unitat == "kg" else quantitat
 
-        nom = ""
-        for it in ingredients:
-            if it["codi"] == codi:
-                nom = it["ingredient"]
-                break
+@app.route("/api/receptes/<int:recepta_id>/nutricio", methods=["GET"])
+def api_nutricio_recepta(recepta_id):
+    # ?versio=original: amb les fitxes d'ingredient de quan es va guardar
+    original = request.args.get("versio") == "original"
+    conn = get_db_connection()
+    try:
+        if original:
+            resultat, versio = nutricio_recepta_original(conn, recepta_id)
+        else:
+            resultat, versio = nutricio_recepta(conn, recepta_id), versio_ingredients(conn)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    finally:
+        conn.close()
 
-        trobat = False
-        for item in linies:
-            if item.get("codi") == codi:
-                item["grams"] = round(float(item.get("grams", 0) or 0) + grams, 2)
-                trobat = True
-                break
+    if resultat is None:
+        return jsonify({"error": "No existeix la recepta o no té línies calculables."}), 404
+    return jsonify({"recepta_id": recepta_id, "versio_ingredients": versio, "resultat": resultat})
 
-        if not trobat:
-            linies.append({"codi": codi, "ingredient": nom, "grams": round(grams, 2)})
 
-        session["linies"] = linies
+@app.route("/api/ingredients/versions", methods=["GET"])
+def api_versions_ingredients():
+    conn = get_db_connection()
+    try:
+        return jsonify({
+            "versio_actual": versio_ingredients(conn),
+            "versions": llistar_versions(conn),
+        })
+    finally:
+        conn.close()
 
-    resultat = calcular_nutricio_per_100g(session.get("linies", []))
 
+@app.route("/api/receptes/sense-alergens", methods=["GET"])
+def api_receptes_sense_alergens():
+    # ?alergens=llet,ous -> receptes guardades que no en contenen cap
     try:
-        racio_g = float(racio_str or 0)
+        mascara = mascara_alergens(request.args.get("alergens", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not mascara:
+        return jsonify({"error": "Cal indicar almenys un al·lergen a 'alergens'."}), 400
+
+    conn = get_db_connection()
+    try:
+        rows = receptes_sense_alergens(conn, mascara)
+    finally:
+        conn.close()
+
+    return jsonify({"receptes": [
+        {"id": r["id"], "nom": r["nom"], "alergens": claus_alergens(r["alergens_bits"])}
+        for r in rows
+    ]})
+
+
+@app.route("/api/ingredients", methods=["GET"])
+def api_cerca_ingredients():
+    q = request.args.get("q", "")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    resultats = cercar_ingredients(q, limit)
+
+    # Les receptes guardades també es poden afegir com a línia (subreceptes)
+    q = q.strip()
+    if len(q) >= 2:
+        conn = get_db_connection()
+        try:
+            receptes = conn.execute(
+                "SELECT id, nom FROM receptes WHERE nom LIKE ? ORDER BY nom LIMIT 5",
+                (f"%{q}%",),
+            ).fetchall()
+        finally:
+            conn.close()
+        resultats.extend(
+            {"codi": f"{PREFIX_SUBRECEPTA}{r['id']}", "ingredient": f"{r['nom']} (recepta)", "proveidor": None}
+            for r in receptes
+        )
+
+    return jsonify({"resultats": resultats})
+
+
+def _filtres_llistat() -> dict:
+    ordre = request.args.get("ordre", "codi")
+    return {
+        "ordre": ordre if ordre in llistat_ingredients.ORDRES else "codi",
+        "proveidor": (request.args.get("proveidor", "") or "").strip(),
+        "alergen": (request.args.get("alergen", "") or "").strip(),
+    }
+
+
+@app.route("/ingredients")
+def ingredients():
+    q = (request.args.get("q", "") or "").strip()
+    filtres = _filtres_llistat()
+    try:
+        per_pagina = min(max(int(request.args.get("per_pagina", llistat_ingredients.PER_PAGINA)), 1),
+                         llistat_ingredients.MAX_PER_PAGINA)
     except ValueError:
-        racio_g = 0.0
-
-    resultat_racio = None
-    if resultat and racio_g > 0:
-        factor = racio_g / 100.0
-        resultat_racio = {
-            "racio_g": round(racio_g, 2),
-            "energia_kcal": round(resultat["energia_kcal_100g"] * factor, 2),
-            "energia_kj": round(resultat["energia_kj_100g"] * factor, 2),
-            "greixos": round(resultat["greixos_100g"] * factor, 2),
-            "greixos_saturats": round(resultat["greixos_saturats_100g"] * factor, 2),
-            "hidrats_carboni": round(resultat["hidrats_carboni_100g"] * factor, 2),
-            "sucres": round(resultat["sucres_100g"] * factor, 2),
-            "proteines": round(resultat["proteines_100g"] * factor, 2),
-            "fibra": round(resultat["fibra_100g"] * factor, 2),
-            "sal": round(resultat["sal_100g"] * factor, 2),
-        }
+        per_pagina = llistat_ingredients.PER_PAGINA
+
+    seguent = None
+    conn = get_db_connection()
+    try:
+        if q:
+            codis = [r["codi"] for r in cercar_ingredients(q, limit=100)]
+            marques = ", ".join("?" * len(codis))
+            rows = conn.execute(
+                f"""
+                SELECT
+                    codi, ingredient, proveidor,
+                    energia_kcal_100g, energia_kj_100g
+                FROM ingredients
+                WHERE codi IN ({marques})
+                """,
+                codis,
+            ).fetchall()
+            # Mantenim l'ordre de rellevància de la cerca
+            ordre = {codi: i for i, codi in enumerate(codis)}
+            rows.sort(key=lambda r: ordre[r["codi"]])
+        else:
+            rows, seguent = llistat_ingredients.pagina(
+                conn,
+                despres=request.args.get("despres", ""),
+                despres_valor=request.args.get("despres_valor", ""),
+                per_pagina=per_pagina,
+                **filtres,
+            )
+        proveidors = llistat_ingredients.proveidors(conn)
+    finally:
+        conn.close()
+
+    return render_template(
+        "ingredients.html",
+        ingredients=rows,
+        q=q,
+        filtres=filtres,
+        per_pagina=per_pagina,
+        url_seguent=url_for("ingredients", per_pagina=per_pagina, **filtres, **seguent) if seguent else None,
+        url_primera=url_for("ingredients", per_pagina=per_pagina, **filtres) if request.args.get("despres") else None,
+        proveidors=proveidors,
+        ordres=list(llistat_ingredients.ORDRES),
+    )
+
+
+@app.route("/ingredients/export.<format_sortida>")
+def exportar_ingredients(format_sortida):
+    # Es genera a mesura que es llegeix de la BD, sense carregar la taula sencera
+    filtres = _filtres_llistat()
+    if format_sortida == "csv":
+        return Response(
+            llistat_ingredients.exportar_csv(**filtres),
+            mimetype="text/csv",
+            headers={"Content-Disposition": "attachment; filename=ingredients.csv"},
+        )
+    if format_sortida == "json":
+        return Response(llistat_ingredients.exportar_json(**filtres), mimetype="application/json")
+    return jsonify({"error": "El format ha de ser 'csv' o 'json'."}), 404
+
+
+def _afegir_a_esborrany(esborrany_id: str, codi, quantitat, unitat, racio_g=None) -> tuple[str, int]:
+    # Afegeix una línia a l'esborrany (i la ració, si n'hi ha); torna (missatge d'error
+    # o "", estat HTTP per a l'API)
+    codi = str(codi or "").strip().upper()
+    unitat = str(unitat or "g").strip()
+    try:
+        quantitat = float(quantitat or 0)
+    except (TypeError, ValueError):
+        quantitat = 0.0
+
+    grams = quantitat * 1000 if unitat == "kg" else quantitat
+
+    llista = obtenir_llista()
+    conn = get_db_connection()
+    try:
+        if racio_g is not None:
+            esborranys.desar_racio(conn, esborrany_id, str(racio_g).strip())
+        nom = _nom_linia(conn, llista, codi)
+        if nom is None:
+            return f"❌ No hi ha cap ingredient ni recepta amb codi '{codi}'.", 404
+        # NaN quedaria NULL a la BD i inf faria l'esborrany il·legible (JSON invàlid)
+        if not math.isfinite(grams) or grams <= 0:
+            return "❌ La quantitat ha de ser un número positiu.", 400
+        esborranys.afegir_grams(conn, esborrany_id, codi, nom, grams)
+    finally:
+        conn.close()
+    return "", 200
+
+
+def _panell_esborrany() -> dict:
+    # Línies i panells nutricionals de l'esborrany actual: el que pinta la calculadora
+    esborrany = _llegir_esborrany()
+    resultat = calcular_nutricio_per_100g(esborrany["linies"])
+    return {
+        "linies": esborrany["linies"],
+        "racio_g": esborrany["racio_g"],
+        "resultat": resultat,
+        "resultat_racio": calcular_nutricio_per_racio(resultat, esborrany["racio_g"]),
+    }
+
+
+@app.route("/calculadora", methods=["GET", "POST"])
+def calculadora():
+    esborrany_id = _esborrany_id()
+    missatge = session.pop("missatge", "")
+
+    if request.method == "POST":
+        missatge = _afegir_a_esborrany(
+            esborrany_id,
+            request.form.get("codi", ""),
+            request.form.get("quantitat", "0"),
+            request.form.get("unitat", "g"),
+            request.form.get("racio_g", ""),
+        )[0] or missatge
 
     return render_template(
         "calculadora.html",
-        ingredients=ingredients,
-        linies=session.get("linies", []),
-        resultat=resultat,
-        resultat_racio=resultat_racio,
-        racio_g=racio_str,
         missatge=missatge,
+        recepta_carregada=session.get("recepta_carregada"),
+        **_panell_esborrany(),
     )
 
 
 @app.route("/calculadora/netejar", methods=["POST"])
 def netejar_calculadora():
-    session["linies"] = []
-    session["racio_g"] = ""
+    session.pop("recepta_carregada", None)
+    conn = get_db_connection()
+    try:
+        esborranys.netejar(conn, _esborrany_id())
+    finally:
+        conn.close()
     return redirect(url_for("calculadora"))
 
+def _enviar_qr(url: str, download_name: str):
+    mida = request.args.get("mida", "m")
+    format_imatge = request.args.get("format", "png")
+    if mida not in MIDES or format_imatge not in FORMATS:
+        return jsonify({"error": f"mida: {', '.join(MIDES)}; format: {', '.join(FORMATS)}"}), 400
+
+    # El QR només depèn de la URL: el navegador el pot guardar un dia sencer
+    return send_file(
+        BytesIO(generar_qr(url, mida, format_imatge)),
+        mimetype=FORMATS[format_imatge],
+        as_attachment=True,
+        download_name=f"{download_name}.{format_imatge}",
+        etag=etag_qr(url, mida, format_imatge),
+        max_age=QR_MAX_AGE,
+    )
+
+
 @app.route("/qr", methods=["GET"])
 def descarregar_qr():
     url = request.host_url.rstrip("/") + url_for("calculadora")
-    qr_io = generar_qr(url)
+    return _enviar_qr(url, "qr_calculadora_masgrau")
 
+
+@app.route("/receptes/<int:recepta_id>/qr", methods=["GET"])
+def descarregar_qr_recepta(recepta_id):
+    conn = get_db_connection()
+    try:
+        existeix = conn.execute("SELECT 1 FROM receptes WHERE id = ?", (recepta_id,)).fetchone()
+    finally:
+        conn.close()
+    if not existeix:
+        return jsonify({"error": "No existeix la recepta."}), 404
+
+    url = url_for("descarregar_pdf_recepta_guardada", recepta_id=recepta_id, _external=True)
+    return _enviar_qr(url, f"qr_recepta_{recepta_id}")
+
+
+@app.route("/receptes/qr/full", methods=["GET"])
+def descarregar_full_qr():
+    # Full A4 amb el QR de cada recepta demanada, per imprimir i penjar a l'obrador
+    try:
+        recepta_ids = _ids_receptes(request.args.getlist("ids"))
+    except ValueError:
+        return jsonify({"error": "Els ids de recepta han de ser enters."}), 400
+    if not recepta_ids or len(recepta_ids) > MAX_RECEPTES_LOT:
+        return jsonify({"error": f"Cal entre 1 i {MAX_RECEPTES_LOT} ids de recepta."}), 400
+
+    conn = get_db_connection()
+    try:
+        noms = {}
+        for recepta_id in recepta_ids:
+            row = conn.execute("SELECT nom FROM receptes WHERE id = ?", (recepta_id,)).fetchone()
+            if row is not None:
+                noms[recepta_id] = row["nom"]
+    finally:
+        conn.close()
+
+    absents = [i for i in recepta_ids if i not in noms]
+    if absents:
+        return jsonify({"error": "No existeixen algunes receptes.", "absents": absents}), 404
+
+    entrades = [
+        (f"{recepta_id} - {noms[recepta_id]}",
+         url_for("descarregar_pdf_recepta_guardada", recepta_id=recepta_id, _external=True))
+        for recepta_id in recepta_ids
+    ]
     return send_file(
-        qr_io,
-        mimetype="image/png",
+        BytesIO(generar_full_qr(entrades)),
+        mimetype="application/pdf",
         as_attachment=True,
-        download_name="qr_calculadora_masgrau.png"
+        download_name="qr_receptes.pdf",
     )
 
 
 @app.route("/calculadora/eliminar/<int:index>", methods=["POST"])
 def eliminar_linia(index):
-    linies = session.get("linies", [])
-    if 0 <= index < len(linies):
-        linies.pop(index)
-        session["linies"] = linies
+    conn = get_db_connection()
+    try:
+        esborranys.eliminar_linia(conn, _esborrany_id(), index)
+    finally:
+        conn.close()
     return redirect(url_for("calculadora"))
 
 
+def _pagina_receptes():
+    # Paràmetres comuns de /receptes i /api/receptes; None si el cursor 'despres' no és vàlid
+    despres = request.args.get("despres", "")
+    if despres:
+        try:
+            int(despres)
+        except ValueError:
+            return None
+    ordre = request.args.get("ordre", "recents")
+    q = (request.args.get("q", "") or "").strip()
+    try:
+        per_pagina = min(max(int(request.args.get("per_pagina", llistat_receptes.PER_PAGINA)), 1),
+                         llistat_receptes.MAX_PER_PAGINA)
+    except ValueError:
+        per_pagina = llistat_receptes.PER_PAGINA
+
+    conn = get_db_connection()
+    try:
+        receptes, seguent = llistat_receptes.pagina(
+            conn,
+            ordre=ordre,
+            q=q,
+            despres=despres,
+            despres_valor=request.args.get("despres_valor", ""),
+            per_pagina=per_pagina,
+        )
+        # Les receptes invalidades per una importació es recalculen aquí (i queden desades);
+        # si una no es pot calcular (p. ex. un cicle de subreceptes) surt sense valors
+        for recepta in receptes:
+            if not recepta["calculada"]:
+                try:
+                    resultat = nutricio_recepta(conn, recepta["id"])
+                except ValueError:
+                    continue
+                if resultat is not None:
+                    recepta["energia_kcal_100g"] = resultat["energia_kcal_100g"]
+                    recepta["alergens"] = resultat["alergens"]
+    finally:
+        conn.close()
+
+    filtres = {"ordre": ordre, "q": q, "per_pagina": per_pagina}
+    return receptes, seguent, filtres
+
+
+@app.route("/receptes", methods=["GET"])
+def receptes():
+    pagina = _pagina_receptes()
+    if pagina is None:
+        return redirect(url_for("receptes"))
+    llista, seguent, filtres = pagina
+    return render_template(
+        "receptes.html",
+        receptes=llista,
+        filtres=filtres,
+        ordres=list(llistat_receptes.ORDRES),
+        url_seguent=url_for("receptes", **filtres, **seguent) if seguent else None,
+        url_primera=url_for("receptes", **filtres) if request.args.get("despres") else None,
+    )
+
+
+@app.route("/api/receptes", methods=["GET"])
+def api_receptes():
+    pagina = _pagina_receptes()
+    if pagina is None:
+        return jsonify({"error": "'despres' ha de ser un id de recepta."}), 400
+    llista, seguent, filtres = pagina
+    return jsonify({
+        "receptes": llista,
+        "seguent": url_for("api_receptes", **filtres, **seguent) if seguent else None,
+    })
+
+
+def _recepta_amb_nutricio(recepta_id: int) -> dict | None:
+    conn = get_db_connection()
+    try:
+        recepta = llistat_receptes.recepta_amb_linies(conn, recepta_id)
+        if recepta is not None:
+            recepta["resultat"] = nutricio_recepta(conn, recepta_id)
+    finally:
+        conn.close()
+    return recepta
+
+
+@app.route("/receptes/<int:recepta_id>", methods=["GET"])
+def veure_recepta(recepta_id):
+    try:
+        recepta = _recepta_amb_nutricio(recepta_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if recepta is None:
+        return jsonify({"error": "No existeix la recepta."}), 404
+
+    conn = get_db_connection()
+    try:
+        versions = versions_receptes.llistar(conn, recepta_id)
+    finally:
+        conn.close()
+
+    racio_g = request.args.get("racio_g", "")
+    return render_template(
+        "recepta.html",
+        recepta=recepta,
+        versions=versions,
+        racio_g=racio_g,
+        resultat_racio=calcular_nutricio_per_racio(recepta["resultat"], racio_g),
+    )
+
+
+@app.route("/api/receptes/<int:recepta_id>", methods=["GET"])
+def api_recepta(recepta_id):
+    try:
+        recepta = _recepta_amb_nutricio(recepta_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if recepta is None:
+        return jsonify({"error": "No existeix la recepta."}), 404
+    recepta["resultat_racio"] = calcular_nutricio_per_racio(recepta["resultat"], request.args.get("racio_g"))
+    return jsonify(recepta)
+
+
+@app.route("/receptes/<int:recepta_id>/carregar", methods=["POST"])
+def carregar_recepta(recepta_id):
+    # Substitueix l'esborrany de la calculadora per les línies de la recepta guardada
+    conn = get_db_connection()
+    try:
+        recepta = llistat_receptes.recepta_amb_linies(conn, recepta_id)
+        if recepta is None:
+            return jsonify({"error": "No existeix la recepta."}), 404
+        esborranys.substituir_linies(conn, _esborrany_id(), recepta["linies"])
+    finally:
+        conn.close()
+
+    # Des de la calculadora es podrà guardar com a nova versió d'aquesta recepta
+    session["recepta_carregada"] = {"id": recepta_id, "nom": recepta["nom"]}
+    session["missatge"] = f"✅ Recepta carregada a la calculadora: {recepta['nom']}"
+    return redirect(url_for("calculadora"))
+
+
+@app.route("/receptes/<int:recepta_id>/versions", methods=["POST"])
+def desar_versio_recepta(recepta_id):
+    # JSON {"linies": [...], "nota"} o, des de la calculadora, les línies de l'esborrany
+    dades = request.get_json(silent=True)
+    if dades is not None:
+        if not isinstance(dades, dict):
+            return jsonify({"error": ERROR_COS_JSON}), 400
+        linies = dades.get("linies")
+        if not isinstance(linies, list) or not all(
+            isinstance(l, dict) and isinstance(l.get("codi"), str) for l in linies
+        ):
+            return jsonify({"error": "Cal una llista 'linies' amb objectes {codi, grams}."}), 400
+        nota = str(dades.get("nota") or "")
+    else:
+        linies = _llegir_esborrany()["linies"]
+        nota = request.form.get("nota", "")
+
+    conn = get_db_connection()
+    try:
+        if conn.execute("SELECT 1 FROM receptes WHERE id = ?", (recepta_id,)).fetchone() is None:
+            return jsonify({"error": "No existeix la recepta."}), 404
+        versio = versions_receptes.desar_versio(conn, recepta_id, linies, nota.strip())
+        conn.commit()
+    except versions_receptes.CodisDesconeguts as e:
+        conn.rollback()
+        if dades is not None:
+            return jsonify({"error": str(e), "codis": e.codis}), 400
+        session["missatge"] = f"❌ No s'ha pogut guardar la versió: {e}"
+        return redirect(url_for("calculadora"))
+    except ValueError as e:
+        conn.rollback()
+        if dades is not None:
+            return jsonify({"error": str(e)}), 409
+        session["missatge"] = f"❌ No s'ha pogut guardar la versió: {e}"
+        return redirect(url_for("calculadora"))
+    finally:
+        conn.close()
+
+    if dades is not None:
+        return jsonify({"recepta_id": recepta_id, **versio})
+    if versio["canvis"]:
+        session["missatge"] = f"✅ Guardada la versió {versio['numero']} de la recepta {recepta_id}."
+    else:
+        session["missatge"] = f"ℹ️ Cap canvi respecte de la versió {versio['numero']}."
+    return redirect(url_for("calculadora"))
+
+
+@app.route("/api/receptes/<int:recepta_id>/versions", methods=["GET"])
+def api_versions_recepta(recepta_id):
+    conn = get_db_connection()
+    try:
+        if conn.execute("SELECT 1 FROM receptes WHERE id = ?", (recepta_id,)).fetchone() is None:
+            return jsonify({"error": "No existeix la recepta."}), 404
+        versions = versions_receptes.llistar(conn, recepta_id)
+    finally:
+        conn.close()
+    return jsonify({"recepta_id": recepta_id, "versions": versions})
+
+
+@app.route("/api/receptes/<int:recepta_id>/versions/<int:numero>", methods=["GET"])
+def api_versio_recepta(recepta_id, numero):
+    conn = get_db_connection()
+    try:
+        linies = versions_receptes.linies_versio(conn, recepta_id, numero)
+    finally:
+        conn.close()
+    if linies is None:
+        return jsonify({"error": "No existeix aquesta versió de la recepta."}), 404
+
+    try:
+        resultat = calcular_nutricio_per_100g(linies)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"recepta_id": recepta_id, "numero": numero, "linies": linies, "resultat": resultat})
+
+
+def _diferencia_versions(recepta_id: int):
+    try:
+        de = int(request.args.get("de", ""))
+        a = int(request.args.get("a", ""))
+    except ValueError:
+        return None, (jsonify({"error": "Cal indicar les versions 'de' i 'a' (enters)."}), 400)
+
+    llista = obtenir_llista()
+    conn = get_db_connection()
+    try:
+        diferencia = versions_receptes.diferencia(conn, recepta_id, de, a)
+        if diferencia is not None:
+            for l in diferencia["linies"]:
+                l["ingredient"] = _nom_linia(conn, llista, l["codi"]) or ""
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 409)
+    finally:
+        conn.close()
+    if diferencia is None:
+        return None, (jsonify({"error": "No existeix alguna de les versions."}), 404)
+    return diferencia, None
+
+
+@app.route("/api/receptes/<int:recepta_id>/versions/diferencia", methods=["GET"])
+def api_diferencia_versions(recepta_id):
+    diferencia, error = _diferencia_versions(recepta_id)
+    return error or jsonify({"recepta_id": recepta_id, **diferencia})
+
+
+@app.route("/receptes/<int:recepta_id>/versions/diferencia", methods=["GET"])
+def diferencia_versions(recepta_id):
+    diferencia, error = _diferencia_versions(recepta_id)
+    if error:
+        return error
+    return render_template(
+        "recepta_diferencia.html",
+        recepta_id=recepta_id,
+        diferencia=diferencia,
+    )
+
+
 @app.route("/receptes/guardar", methods=["POST"])
 def guardar_recepta_post():
     nom_recepta = (request.form.get("nom_recepta", "") or "").strip()
-    linies = session.get("linies", [])
+    linies = _llegir_esborrany()["linies"]
 
     try:
         recepta_id = guardar_recepta_a_db(nom_recepta, linies)
@@ -523,6 +1270,7 @@ def guardar_recepta_post():
 
 
 if __name__ == "__main__":
+    # Servidor de desenvolupament; en producció: gunicorn -c gunicorn.conf.py wsgi:app
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+    crear_app().run(host="0.0.0.0", port=port)
 
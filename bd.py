@@ -0,0 +1,263 @@
+# bd.py
+import os
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = BASE_DIR / "dades" / "nutricio.db"
+
+# Connexions inactives que guardem per procés (la resta es tanquen en tornar)
+MIDA_POOL = 8
+# Sentències preparades que sqlite3 manté per connexió
+CACHE_SENTENCIES = 256
+MMAP_BYTES = 256 * 1024 * 1024
+
+
+# Funció que rep la durada (s) de cada consulta; la registra metriques.py
+_observador_sql = None
+
+
+def registrar_observador_sql(observador):
+    global _observador_sql
+    _observador_sql = observador
+
+
+class CursorMesurat(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        observador = _observador_sql
+        if observador is None:
+            return super().execute(sql, params)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            observador(time.perf_counter() - t0)
+
+    def executemany(self, sql, params):
+        observador = _observador_sql
+        if observador is None:
+            return super().executemany(sql, params)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            observador(time.perf_counter() - t0)
+
+
+class ConnexioReutilitzable(sqlite3.Connection):
+    # close() no tanca la connexió: desfà el que hagi quedat pendent i la torna al pool
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.al_pool = False
+
+    def close(self):
+        if self.al_pool:
+            return
+        try:
+            if self.in_transaction:
+                self.rollback()
+        except sqlite3.Error:
+            super().close()
+            return
+        _retornar_al_pool(self)
+
+    def tancar(self):
+        super().close()
+
+    # Totes les consultes passen per CursorMesurat perquè es puguin comptar
+    def cursor(self, factory=CursorMesurat):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+
+_pool: queue.LifoQueue = queue.LifoQueue(maxsize=MIDA_POOL)
+_pool_pid = os.getpid()
+
+
+def _pool_del_proces() -> queue.LifoQueue:
+    # Després d'un fork no reutilitzem mai les connexions heretades del pare
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        _pool = queue.LifoQueue(maxsize=MIDA_POOL)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _retornar_al_pool(conn: ConnexioReutilitzable):
+    try:
+        _pool_del_proces().put_nowait(conn)
+        conn.al_pool = True
+    except queue.Full:
+        conn.tancar()
+
+
+def _obrir_connexio() -> ConnexioReutilitzable:
+    conn = sqlite3.connect(
+        DB_PATH,
+        factory=ConnexioReutilitzable,
+        cached_statements=CACHE_SENTENCIES,
+        check_same_thread=False,
+        timeout=10,
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL: els lectors no es bloquegen mentre algú escriu
+    conn.execute("PRAGMA journal_mode = WAL;")
+    # Amb WAL, NORMAL és segur davant caigudes de l'aplicació i evita un fsync per commit
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_BYTES};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+def get_db_connection() -> ConnexioReutilitzable:
+    pool = _pool_del_proces()
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        return _obrir_connexio()
+
+    conn.al_pool = False
+    return conn
+
+
+def tancar_connexions():
+    pool = _pool_del_proces()
+    while True:
+        try:
+            pool.get_nowait().tancar()
+        except queue.Empty:
+            break
+
+
+# L'esquema no canvia mentre l'app corre: la introspecció es fa un sol cop
+_recepta_linies_col: str | None = None
+
+
+def recepta_linies_ingredient_col(conn: sqlite3.Connection) -> str:
+    global _recepta_linies_col
+    if _recepta_linies_col is not None:
+        return _recepta_linies_col
+
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(recepta_linies);").fetchall()]
+    # migrar_receptes_db.py crea 'codi_ingredient'; esquemes antics fan servir els altres noms
+    for col in ("ingredient_codi", "codi_ingredient", "codi"):
+        if col in cols:
+            _recepta_linies_col = col
+            return col
+    raise RuntimeError(
+        "La taula 'recepta_linies' no té columna 'ingredient_codi', 'codi_ingredient' ni 'codi'."
+    )
+
+
+def existeix_taula(conn: sqlite3.Connection, nom: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", (nom,)
+    ).fetchone() is not None
+
+
+def assegurar_esquema(conn: sqlite3.Connection):
+    # Taules auxiliars que l'app necessita a més de les d'ingredients i receptes
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS metadades (
+            clau TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL
+        );
+    """)
+    conn.execute(
+        "INSERT OR IGNORE INTO metadades (clau, valor) VALUES ('versio_ingredients', 1);"
+    )
+
+    # Empremta de la fitxa de cada ingredient (importació incremental)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(ingredients);").fetchall()]
+    if cols and "hash_fitxa" not in cols:
+        conn.execute("ALTER TABLE ingredients ADD COLUMN hash_fitxa TEXT;")
+
+    # Al·lèrgens de la fitxa com a màscara de bits (vegeu alergens.py)
+    if cols and "alergens_bits" not in cols:
+        conn.execute("ALTER TABLE ingredients ADD COLUMN alergens_bits INTEGER;")
+    if cols:
+        from alergens import bits_alergens
+        pendents = conn.execute(
+            "SELECT codi, alergens FROM ingredients WHERE alergens_bits IS NULL;"
+        ).fetchall()
+        if pendents:
+            conn.executemany(
+                "UPDATE ingredients SET alergens_bits = ? WHERE codi = ?;",
+                [(bits_alergens(r[1]), r[0]) for r in pendents],
+            )
+            incrementar_versio_ingredients(conn)
+
+    # Índexs per a la paginació per clau de /ingredients (vegeu llistat_ingredients.ORDRES)
+    if cols:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingredients_nom ON ingredients(ingredient, codi);"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingredients_proveidor "
+            "ON ingredients(COALESCE(proveidor, ''), codi);"
+        )
+    conn.commit()
+
+    # Índex de cerca d'ingredients (es construeix el primer cop si està buit)
+    from cerca import assegurar_index
+    assegurar_index(conn)
+
+    # Historial de versions d'ingredients (vegeu versions_ingredients.py)
+    from versions_ingredients import assegurar_taules as assegurar_taules_versions
+    assegurar_taules_versions(conn)
+
+    # Cua de treballs en segon pla (importacions, etiquetes en bloc, recàlculs)
+    from treballs import assegurar_taules as assegurar_taules_treballs
+    assegurar_taules_treballs(conn)
+
+    # Esborranys de la calculadora
+    from esborranys import assegurar_taules
+    assegurar_taules(conn)
+
+    # Nutrició materialitzada de les receptes guardades
+    from nutricio import assegurar_taules as assegurar_taules_nutricio
+    assegurar_taules_nutricio(conn)
+
+    # Historial de versions de cada recepta (vegeu versions_receptes.py)
+    from versions_receptes import assegurar_taules as assegurar_taules_versions_receptes
+    assegurar_taules_versions_receptes(conn)
+
+    # Navegador de receptes guardades
+    from llistat_receptes import assegurar_index as assegurar_index_receptes
+    assegurar_index_receptes(conn)
+
+
+def versio_ingredients(conn: sqlite3.Connection) -> int:
+    row = conn.execute(
+        "SELECT valor FROM metadades WHERE clau = 'versio_ingredients';"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+@contextmanager
+def instantania(conn: sqlite3.Connection):
+    # Totes les lectures del bloc van dins una mateixa transacció: amb WAL veuen la
+    # mateixa versió d'ingredients encara que entremig es publiqui una importació
+    conn.execute("BEGIN")
+    try:
+        yield versio_ingredients(conn)
+    finally:
+        conn.rollback()
+
+
+def incrementar_versio_ingredients(conn: sqlite3.Connection) -> int:
+    # S'ha de cridar dins la mateixa transacció que modifica la taula ingredients
+    conn.execute(
+        "UPDATE metadades SET valor = valor + 1 WHERE clau = 'versio_ingredients';"
+    )
+    return versio_ingredients(conn)
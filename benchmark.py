@@ -0,0 +1,232 @@
+# benchmark.py
+#
+# Mesura els camins calents amb dades sintètiques:
+#   python benchmark.py                                  (1k, 10k i 100k ingredients)
+#   python benchmark.py --escales 1000 --repeticions 5   (ràpid)
+#   python benchmark.py --comparar bench_anterior.json   (ràtio respecte d'una execució anterior)
+#
+# Cada escala corre en un procés nou amb la seva BD temporal, perquè les caches
+# en memòria (matriu, llista, índex) no passin d'una escala a l'altra.
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+ESCALES = [1_000, 10_000, 100_000]
+LINIES_RECEPTA = [5, 50, 500]
+REPETICIONS = 20
+# Generar un PDF és molt més lent que la resta: en fem menys
+REPETICIONS_PDF = 5
+LLAVOR = 1234
+
+PARAULES = [
+    "farina", "llet", "sucre", "mantega", "ou", "nata", "cacau", "xocolata", "ametlla",
+    "avellana", "sal", "llevat", "vainilla", "maduixa", "poma", "pera", "taronja", "llimona",
+    "mel", "formatge", "iogurt", "blat", "segol", "civada", "pistatxo", "nou", "canyella",
+]
+
+
+def _mesurar(funcio, repeticions: int) -> dict:
+    funcio()  # escalfament: caches, imports i primera reserva de memòria fora de la mesura
+    temps = []
+    for _ in range(repeticions):
+        t0 = time.perf_counter()
+        funcio()
+        temps.append((time.perf_counter() - t0) * 1000)
+    temps.sort()
+    return {
+        "repeticions": repeticions,
+        "mediana_ms": round(statistics.median(temps), 4),
+        "p95_ms": round(temps[min(len(temps) - 1, int(len(temps) * 0.95))], 4),
+        "min_ms": round(temps[0], 4),
+    }
+
+
+def _ingredients_sintetics(n: int, rng: np.random.Generator):
+    import pandas as pd
+    from importar_excel import COLS_OBLIGATORIES, NUMERIC_COLS
+
+    noms = rng.choice(PARAULES, size=(n, 3))
+    df = pd.DataFrame({
+        "codi": [f"B{i:06d}" for i in range(n)],
+        "ingredient": [" ".join(p) for p in noms],
+        "proveidor": [f"Proveidor {i % 50}" for i in range(n)],
+        "unitat_base": "g",
+        "data_fitxa": "2024-01-01",
+        "font": "sintetic",
+        "ingredient_compost": None,
+        "alergens": None,
+        "observacions": None,
+    })
+    valors = rng.uniform(0, 100, size=(n, len(NUMERIC_COLS))).round(2)
+    for j, col in enumerate(NUMERIC_COLS):
+        df[col] = valors[:, j]
+    return df[COLS_OBLIGATORIES]
+
+
+def _preparar_bd(db_path: Path):
+    # Mateix esquema que crear_db.py + migrar_receptes_db.py, però sobre una BD temporal
+    import bd
+    import crear_db
+    import importar_excel
+    import migrar_receptes_db
+
+    bd.DB_PATH = crear_db.DB_PATH = migrar_receptes_db.DB_PATH = importar_excel.DB_PATH = db_path
+    migrar_receptes_db.main()
+    crear_db.crear_base_dades()
+
+
+def _escala(n: int, linies_recepta: list[int], repeticions: int) -> list[dict]:
+    resultats = []
+
+    def afegir(cas: str, mesura: dict, **params):
+        resultats.append({"cas": cas, "ingredients": n, **params, **mesura})
+        print(f"   {cas:<28} n={n:<7} {params or ''} mediana={mesura['mediana_ms']:.3f} ms")
+
+    rng = np.random.default_rng(LLAVOR)
+    with tempfile.TemporaryDirectory() as tmp:
+        _preparar_bd(Path(tmp) / "nutricio.db")
+
+        import importar_excel
+        df = _ingredients_sintetics(n, rng)
+
+        # Importació: primer cop (tot són insercions), sense canvis i amb un 1% de fitxes noves
+        t0 = time.perf_counter()
+        importar_excel.importar_a_sqlite(df, progres=None)
+        afegir("importar_inicial", {"repeticions": 1, "mediana_ms": round((time.perf_counter() - t0) * 1000, 4)})
+
+        afegir("importar_sense_canvis", _mesurar(
+            lambda: importar_excel.importar_a_sqlite(df, progres=None), max(1, repeticions // 4)
+        ))
+
+        def importar_1pc():
+            df2 = df.copy()
+            files = rng.choice(n, size=max(1, n // 100), replace=False)
+            df2.loc[df2.index[files], "sucres_100g"] = rng.uniform(0, 100, size=len(files)).round(2)
+            importar_excel.importar_a_sqlite(df2, progres=None)
+
+        afegir("importar_1pc_canviat", _mesurar(importar_1pc, max(1, repeticions // 4)))
+
+        # L'app s'importa després de crear la BD: preparar_bd() l'escalfa a l'arrencada
+        import app as app_mod
+        import esborranys
+        from etiquetes_pdf import generar_pdf_recepta
+        from nutricio import calcular_nutricio_per_100g, calcular_nutricio_per_racio
+
+        codis = df["codi"].tolist()
+        noms = dict(zip(df["codi"], df["ingredient"]))
+        client = app_mod.app.test_client()
+
+        for n_linies in linies_recepta:
+            triats = rng.choice(len(codis), size=min(n_linies, len(codis)), replace=False)
+            linies = [
+                {"codi": codis[i], "ingredient": noms[codis[i]], "grams": round(float(rng.uniform(1, 500)), 2)}
+                for i in triats
+            ]
+
+            afegir("calcular_nutricio_per_100g", _mesurar(
+                lambda: calcular_nutricio_per_100g(linies), repeticions
+            ), linies=n_linies)
+
+            resultat = calcular_nutricio_per_100g(linies)
+            resultat_racio = calcular_nutricio_per_racio(resultat, "30")
+            afegir("generar_pdf_recepta", _mesurar(
+                lambda: generar_pdf_recepta("Recepta de prova", linies, resultat, resultat_racio),
+                REPETICIONS_PDF,
+            ), linies=n_linies)
+
+            # Ruta sencera: esborrany a la BD + GET /calculadora amb el client de proves
+            esborrany_id = f"bench-{n_linies}"
+            conn = app_mod.get_db_connection()
+            try:
+                for l in linies:
+                    esborranys.afegir_grams(conn, esborrany_id, l["codi"], l["ingredient"], l["grams"])
+                esborranys.desar_racio(conn, esborrany_id, "30")
+            finally:
+                conn.close()
+            with client.session_transaction() as sessio:
+                sessio["esborrany_id"] = esborrany_id
+
+            def get_calculadora():
+                resposta = client.get("/calculadora")
+                assert resposta.status_code == 200
+
+            afegir("GET /calculadora", _mesurar(get_calculadora, repeticions), linies=n_linies)
+
+        app_mod.tancar_connexions()
+    return resultats
+
+
+def _commit_git() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _clau(r: dict) -> tuple:
+    return (r["cas"], r["ingredients"], r.get("linies"))
+
+
+def comparar(actuals: list[dict], anterior_path: Path):
+    anteriors = {_clau(r): r for r in json.loads(anterior_path.read_text(encoding="utf-8"))["resultats"]}
+    print(f"\n📊 Comparació amb {anterior_path} (ràtio > 1: ara és més lent)")
+    for r in actuals:
+        a = anteriors.get(_clau(r))
+        if a and a["mediana_ms"]:
+            ratio = r["mediana_ms"] / a["mediana_ms"]
+            marca = "⚠️" if ratio > 1.2 else "  "
+            print(f"{marca} {r['cas']:<28} n={r['ingredients']:<7} linies={r.get('linies', '-')!s:<4} x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dels camins calents de la calculadora")
+    parser.add_argument("--escales", default=",".join(map(str, ESCALES)))
+    parser.add_argument("--linies", default=",".join(map(str, LINIES_RECEPTA)))
+    parser.add_argument("--repeticions", type=int, default=REPETICIONS)
+    parser.add_argument("--sortida", default="bench_output.json")
+    parser.add_argument("--comparar", default=None)
+    args = parser.parse_args()
+
+    escales = [int(x) for x in args.escales.split(",")]
+    linies = [int(x) for x in args.linies.split(",")]
+
+    resultats = []
+    for n in escales:
+        print(f"⏱️  Escala: {n} ingredients")
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            resultats.extend(pool.submit(_escala, n, linies, args.repeticions).result())
+
+    sortida = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_git(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "numpy": np.__version__,
+        "llavor": LLAVOR,
+        "resultats": resultats,
+    }
+    Path(args.sortida).write_text(json.dumps(sortida, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"✅ Resultats a {args.sortida}")
+
+    if args.comparar:
+        comparar(resultats, Path(args.comparar))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# cataleg.py
+import threading
+
+from bd import get_db_connection, instantania, versio_ingredients
+
+
+# Noms d'ingredient per codi en memòria, lligats a una versió de la taula (la
+# calculadora cerca per /api/ingredients; aquí només cal posar nom a les línies)
+class LlistaIngredients:
+    def __init__(self, noms: dict[str, str], versio: int = 0):
+        self.noms = noms
+        self.versio = versio
+
+    @classmethod
+    def des_de_bd(cls) -> "LlistaIngredients":
+        # La versió es llegeix a la mateixa instantània que les files
+        conn = get_db_connection()
+        try:
+            with instantania(conn) as versio:
+                noms = dict(conn.execute("SELECT codi, ingredient FROM ingredients").fetchall())
+        finally:
+            conn.close()
+
+        return cls(noms, versio)
+
+
+_llista: LlistaIngredients | None = None
+_llista_lock = threading.Lock()
+
+
+def obtenir_llista() -> LlistaIngredients:
+    global _llista
+
+    conn = get_db_connection()
+    try:
+        versio = versio_ingredients(conn)
+    finally:
+        conn.close()
+
+    llista = _llista
+    if llista is not None and llista.versio == versio:
+        return llista
+
+    with _llista_lock:
+        if _llista is None or _llista.versio != versio:
+            _llista = LlistaIngredients.des_de_bd()
+        return _llista
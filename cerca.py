@@ -0,0 +1,212 @@
+# cerca.py
+import bisect
+import re
+import sqlite3
+import threading
+import unicodedata
+
+import numpy as np
+
+from bd import get_db_connection, instantania, versio_ingredients
+
+
+# Proporció mínima de trigrames de la consulta que ha de tenir un resultat
+MIN_SIMILITUD = 0.3
+
+_NO_ALFANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalitzar(text) -> str:
+    # "Llet crua (Pasteuritzada)" -> "llet crua pasteuritzada"; treu accents, dièresis i l·l
+    if text is None:
+        return ""
+    s = unicodedata.normalize("NFKD", str(text))
+    s = "".join(c for c in s if not unicodedata.combining(c))
+    s = _NO_ALFANUMERIC.sub(" ", s.casefold())
+    return " ".join(s.split())
+
+
+def _trigrames(text: str) -> set[str]:
+    trigrames = set()
+    for paraula in text.split():
+        for i in range(len(paraula) - 2):
+            trigrames.add(paraula[i:i + 3])
+    return trigrames
+
+
+def assegurar_index(conn: sqlite3.Connection):
+    # Text normalitzat de cada ingredient; l'importador el manté al dia fila a fila
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingredients_cerca (
+            codi TEXT PRIMARY KEY,
+            ingredient TEXT NOT NULL,
+            proveidor TEXT,
+            codi_n TEXT NOT NULL,
+            nom_n TEXT NOT NULL,
+            proveidor_n TEXT NOT NULL
+        );
+    """)
+
+    buit = conn.execute("SELECT 1 FROM ingredients_cerca LIMIT 1;").fetchone() is None
+    if buit:
+        actualitzar_index(conn)
+    conn.commit()
+
+
+def actualitzar_index(conn: sqlite3.Connection, codis=None):
+    # Sense codis: reconstrueix tot l'índex. Amb codis: només aquests (els que ja
+    # no existeixen a ingredients se'n treuen). No fa commit.
+    if codis is None:
+        conn.execute("DELETE FROM ingredients_cerca;")
+        rows = conn.execute("SELECT codi, ingredient, proveidor FROM ingredients;").fetchall()
+        eliminats = []
+    else:
+        codis = list(codis)
+        rows = []
+        for i in range(0, len(codis), 500):
+            tros = codis[i:i + 500]
+            marques = ", ".join("?" * len(tros))
+            rows.extend(conn.execute(
+                f"SELECT codi, ingredient, proveidor FROM ingredients WHERE codi IN ({marques});",
+                tros,
+            ).fetchall())
+        existents = {r[0] for r in rows}
+        eliminats = [(c,) for c in codis if c not in existents]
+
+    conn.executemany("DELETE FROM ingredients_cerca WHERE codi = ?;", eliminats)
+    conn.executemany(
+        """
+        INSERT INTO ingredients_cerca (codi, ingredient, proveidor, codi_n, nom_n, proveidor_n)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(codi) DO UPDATE SET
+            ingredient=excluded.ingredient,
+            proveidor=excluded.proveidor,
+            codi_n=excluded.codi_n,
+            nom_n=excluded.nom_n,
+            proveidor_n=excluded.proveidor_n
+        ;
+        """,
+        [
+            (r[0], r[1], r[2], normalitzar(r[0]), normalitzar(r[1]), normalitzar(r[2]))
+            for r in rows
+        ],
+    )
+
+
+# Índex invertit de trigrames en memòria, construït a partir de ingredients_cerca
+class IndexCerca:
+    def __init__(self, rows: list, versio: int = 0):
+        self.versio = versio
+        self.codis = [r[0] for r in rows]
+        self.noms = [r[1] for r in rows]
+        self.proveidors = [r[2] for r in rows]
+        self.noms_n = [r[4] for r in rows]
+
+        postings: dict[str, list[int]] = {}
+        paraules = []
+        for i, r in enumerate(rows):
+            for t in _trigrames(r[3]) | _trigrames(r[4]) | _trigrames(r[5]):
+                postings.setdefault(t, []).append(i)
+            for paraula in set(r[4].split()):
+                paraules.append((paraula, i))
+
+        self.postings = {t: np.array(ids, dtype=np.int32) for t, ids in postings.items()}
+        # Prefixos: paraules del nom i codis ordenats, consultats amb bisect
+        paraules.sort()
+        self.paraules = [p for p, _ in paraules]
+        self.paraules_docs = np.array([i for _, i in paraules], dtype=np.int32)
+        codis_n = sorted((r[3], i) for i, r in enumerate(rows))
+        self.codis_n = [c for c, _ in codis_n]
+        self.codis_n_docs = np.array([i for _, i in codis_n], dtype=np.int32)
+
+    @classmethod
+    def des_de_bd(cls) -> "IndexCerca":
+        # La versió es llegeix a la mateixa instantània que les files
+        conn = get_db_connection()
+        try:
+            with instantania(conn) as versio:
+                rows = conn.execute(
+                    """
+                    SELECT codi, ingredient, proveidor, codi_n, nom_n, proveidor_n
+                    FROM ingredients_cerca
+                    """
+                ).fetchall()
+        finally:
+            conn.close()
+        return cls([tuple(r) for r in rows], versio)
+
+    @staticmethod
+    def _amb_prefix(claus: list[str], docs: np.ndarray, prefix: str) -> np.ndarray:
+        inici = bisect.bisect_left(claus, prefix)
+        final = bisect.bisect_left(claus, prefix + "\uffff")
+        return docs[inici:final]
+
+    def cercar(self, q: str, limit: int = 20) -> list[dict]:
+        qn = normalitzar(q)
+        n = len(self.codis)
+        if not qn or n == 0:
+            return []
+
+        puntuacio = np.zeros(n)
+
+        # Similitud per trigrames: tolera errades de tecleig i accents
+        trigrames_q = _trigrames(qn)
+        if trigrames_q:
+            llistes = [self.postings[t] for t in trigrames_q if t in self.postings]
+            if llistes:
+                comptes = np.bincount(np.concatenate(llistes), minlength=n)
+                similitud = comptes / len(trigrames_q)
+                puntuacio += np.where(similitud >= MIN_SIMILITUD, similitud, 0.0)
+
+        # Prefix d'alguna paraula del nom i prefix de codi pesen més
+        primera = qn.split()[0]
+        puntuacio[self._amb_prefix(self.paraules, self.paraules_docs, primera)] += 2.0
+        puntuacio[self._amb_prefix(self.codis_n, self.codis_n_docs, qn)] += 5.0
+
+        candidats = np.flatnonzero(puntuacio)
+        if len(candidats) > 4 * limit:
+            millors = np.argpartition(-puntuacio[candidats], 4 * limit - 1)[:4 * limit]
+            candidats = candidats[millors]
+
+        # Afinem només els millors candidats: coincidència exacta de codi o de l'inici del nom
+        for i in candidats.tolist():
+            if self.codis[i].casefold() == qn:
+                puntuacio[i] += 5.0
+            nom_n = self.noms_n[i]
+            if nom_n.startswith(qn):
+                puntuacio[i] += 1.0
+            elif " " in qn and (" " + nom_n).find(" " + qn) < 0:
+                puntuacio[i] -= 1.0
+
+        ordenats = sorted(candidats.tolist(), key=lambda i: (-puntuacio[i], self.noms[i]))
+        return [
+            {"codi": self.codis[i], "ingredient": self.noms[i], "proveidor": self.proveidors[i]}
+            for i in ordenats[:limit]
+        ]
+
+
+_index: IndexCerca | None = None
+_index_lock = threading.Lock()
+
+
+def obtenir_index() -> IndexCerca:
+    global _index
+
+    conn = get_db_connection()
+    try:
+        versio = versio_ingredients(conn)
+    finally:
+        conn.close()
+
+    index = _index
+    if index is not None and index.versio == versio:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.versio != versio:
+            _index = IndexCerca.des_de_bd()
+        return _index
+
+
+def cercar(q: str, limit: int = 20) -> list[dict]:
+    return obtenir_index().cercar(q, limit)
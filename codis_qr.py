@@ -0,0 +1,86 @@
+# codis_qr.py
+import copy
+import hashlib
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from fpdf import FPDF
+from qrcode.image.svg import SvgPathImage
+
+from metriques import cronometrat
+
+
+# Mida de cada mòdul del QR en píxels (PNG) o en mm/10 (SVG)
+MIDES = {"s": 4, "m": 10, "l": 20}
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+MAX_QR_CACHE = 256
+
+# Full de QR per imprimir: graella A4
+COLUMNES_FULL = 3
+FILES_FULL = 4
+
+
+@lru_cache(maxsize=MAX_QR_CACHE)
+def _qr(url: str) -> qrcode.QRCode:
+    # El càlcul de la matriu (i la tria de màscara) és la part cara; només depèn de la URL
+    qr = qrcode.QRCode(
+        version=2,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        border=4,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    return qr
+
+
+@lru_cache(maxsize=MAX_QR_CACHE)
+@cronometrat("qr")
+def generar_qr(url: str, mida: str = "m", format_imatge: str = "png") -> bytes:
+    # make_image llegeix box_size de l'objecte: còpia superficial que comparteix la matriu
+    qr_mida = copy.copy(_qr(url))
+    qr_mida.box_size = MIDES[mida]
+
+    if format_imatge == "svg":
+        img = qr_mida.make_image(image_factory=SvgPathImage)
+    else:
+        img = qr_mida.make_image(fill_color="black", back_color="white")
+
+    output = BytesIO()
+    if format_imatge == "svg":
+        img.save(output)
+    else:
+        img.save(output, format="PNG")
+    return output.getvalue()
+
+
+def etag_qr(url: str, mida: str, format_imatge: str) -> str:
+    return hashlib.sha256(f"{url}|{mida}|{format_imatge}".encode("utf-8")).hexdigest()[:32]
+
+
+@cronometrat("qr")
+def generar_full_qr(entrades: list[tuple[str, str]]) -> bytes:
+    # entrades: (títol, url); 12 QR per pàgina amb el títol a sota
+    pdf = FPDF(orientation="P", unit="mm", format="A4")
+    pdf.set_auto_page_break(auto=False)
+
+    amplada = (pdf.w - 20) / COLUMNES_FULL
+    alcada = (pdf.h - 20) / FILES_FULL
+    costat = min(amplada, alcada) - 16
+
+    for n, (titol, url) in enumerate(entrades):
+        posicio = n % (COLUMNES_FULL * FILES_FULL)
+        if posicio == 0:
+            pdf.add_page()
+        x = 10 + (posicio % COLUMNES_FULL) * amplada
+        y = 10 + (posicio // COLUMNES_FULL) * alcada
+
+        pdf.image(BytesIO(generar_qr(url, "m", "png")), x=x + (amplada - costat) / 2, y=y + 2, w=costat)
+        pdf.set_xy(x, y + costat + 4)
+        pdf.set_font("Helvetica", "", 9)
+        pdf.multi_cell(amplada, 4, titol[:80], align="C")
+
+    pdf_data = pdf.output(dest="S")
+    if isinstance(pdf_data, str):
+        return pdf_data.encode("latin1")
+    return bytes(pdf_data)
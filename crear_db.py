@@ -1,6 +1,8 @@
 import sqlite3
 from pathlib import Path
 
+from bd import assegurar_esquema
+
 # Ruta base del projecte
 BASE_DIR = Path(__file__).resolve().parent
 
@@ -39,6 +41,7 @@ def crear_base_dades():
     """)
 
     conn.commit()
+    assegurar_esquema(conn)
     conn.close()
 
     print("✅ Base de dades creada correctament a:", DB_PATH)
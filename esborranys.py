@@ -0,0 +1,160 @@
+# esborranys.py
+import math
+import secrets
+import sqlite3
+import time
+
+
+# Els esborranys que no es toquen en aquest temps s'eliminen
+TTL_ESBORRANYS = 7 * 24 * 3600
+# Cada quant (com a molt) passem l'escombra d'esborranys caducats
+INTERVAL_NETEJA = 10 * 60
+
+_darrera_neteja = 0.0
+
+
+def assegurar_taules(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS esborranys (
+            id TEXT PRIMARY KEY,
+            racio_g TEXT NOT NULL DEFAULT '',
+            actualitzat_el REAL NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS esborrany_linies (
+            esborrany_id TEXT NOT NULL,
+            codi TEXT NOT NULL,
+            posicio INTEGER NOT NULL,
+            ingredient TEXT NOT NULL,
+            grams REAL NOT NULL,
+            PRIMARY KEY (esborrany_id, codi),
+            FOREIGN KEY (esborrany_id) REFERENCES esborranys(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_esborrany_linies_posicio
+        ON esborrany_linies(esborrany_id, posicio);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_esborranys_actualitzat
+        ON esborranys(actualitzat_el);
+    """)
+    conn.commit()
+
+
+def nou_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def obtenir(conn: sqlite3.Connection, esborrany_id: str) -> dict:
+    row = conn.execute(
+        "SELECT racio_g FROM esborranys WHERE id = ?", (esborrany_id,)
+    ).fetchone()
+    linies = conn.execute(
+        """
+        SELECT codi, ingredient, grams
+        FROM esborrany_linies
+        WHERE esborrany_id = ?
+        ORDER BY posicio
+        """,
+        (esborrany_id,),
+    ).fetchall()
+    return {
+        "linies": [{"codi": l["codi"], "ingredient": l["ingredient"], "grams": l["grams"]} for l in linies],
+        "racio_g": row["racio_g"] if row else "",
+    }
+
+
+def _tocar(conn: sqlite3.Connection, esborrany_id: str):
+    conn.execute(
+        """
+        INSERT INTO esborranys (id, actualitzat_el) VALUES (?, ?)
+        ON CONFLICT(id) DO UPDATE SET actualitzat_el = excluded.actualitzat_el
+        """,
+        (esborrany_id, time.time()),
+    )
+
+
+def _escombrar(conn: sqlite3.Connection):
+    global _darrera_neteja
+    ara = time.time()
+    if ara - _darrera_neteja < INTERVAL_NETEJA:
+        return
+    _darrera_neteja = ara
+    conn.execute("DELETE FROM esborranys WHERE actualitzat_el < ?", (ara - TTL_ESBORRANYS,))
+
+
+def afegir_grams(conn: sqlite3.Connection, esborrany_id: str, codi: str, ingredient: str, grams: float):
+    # Si el codi ja hi és, sumem els grams; si no, afegim la línia al final
+    if not math.isfinite(grams) or grams <= 0:
+        raise ValueError(f"Quantitat no vàlida: {grams!r}")
+    _tocar(conn, esborrany_id)
+    conn.execute(
+        """
+        INSERT INTO esborrany_linies (esborrany_id, codi, posicio, ingredient, grams)
+        VALUES (
+            ?, ?,
+            (SELECT COALESCE(MAX(posicio), -1) + 1 FROM esborrany_linies WHERE esborrany_id = ?),
+            ?, ?
+        )
+        ON CONFLICT(esborrany_id, codi) DO UPDATE SET
+            grams = ROUND(grams + excluded.grams, 2)
+        """,
+        (esborrany_id, codi, esborrany_id, ingredient, round(grams, 2)),
+    )
+    _escombrar(conn)
+    conn.commit()
+
+
+def eliminar_linia(conn: sqlite3.Connection, esborrany_id: str, index: int):
+    if index < 0:
+        return
+    _tocar(conn, esborrany_id)
+    conn.execute(
+        """
+        DELETE FROM esborrany_linies
+        WHERE esborrany_id = ? AND codi = (
+            SELECT codi FROM esborrany_linies
+            WHERE esborrany_id = ?
+            ORDER BY posicio
+            LIMIT 1 OFFSET ?
+        )
+        """,
+        (esborrany_id, esborrany_id, index),
+    )
+    conn.commit()
+
+
+def desar_racio(conn: sqlite3.Connection, esborrany_id: str, racio_g: str):
+    _tocar(conn, esborrany_id)
+    conn.execute(
+        "UPDATE esborranys SET racio_g = ? WHERE id = ? AND racio_g != ?",
+        (racio_g, esborrany_id, racio_g),
+    )
+    conn.commit()
+
+
+def substituir_linies(conn: sqlite3.Connection, esborrany_id: str, linies: list[dict]):
+    # Carrega una recepta sencera a l'esborrany (en lloc del que hi hagués) en un sol commit
+    _tocar(conn, esborrany_id)
+    conn.execute("DELETE FROM esborrany_linies WHERE esborrany_id = ?", (esborrany_id,))
+    conn.executemany(
+        """
+        INSERT INTO esborrany_linies (esborrany_id, codi, posicio, ingredient, grams)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(esborrany_id, codi) DO UPDATE SET
+            grams = ROUND(grams + excluded.grams, 2)
+        """,
+        [
+            (esborrany_id, l["codi"], i, l["ingredient"], round(float(l["grams"]), 2))
+            for i, l in enumerate(linies)
+        ],
+    )
+    conn.commit()
+
+
+def netejar(conn: sqlite3.Connection, esborrany_id: str):
+    conn.execute("DELETE FROM esborrany_linies WHERE esborrany_id = ?", (esborrany_id,))
+    conn.execute("UPDATE esborranys SET racio_g = '' WHERE id = ?", (esborrany_id,))
+    conn.commit()
@@ -0,0 +1,374 @@
+# etiquetes_pdf.py
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+
+from fpdf import FPDF
+from fpdf.image_parsing import preload_image
+
+from alergens import ETIQUETES
+from metriques import cronometrat
+from panell import Panell
+
+
+BASE_DIR = Path(__file__).resolve().parent
+LOGO_PATH = BASE_DIR / "static" / "img" / "logo_masgrau.png"
+
+log = logging.getLogger(__name__)
+
+# PDFs acabats que guardem en memòria per procés (els més antics surten primer)
+MAX_PDFS_CACHE = 128
+# Exportació en bloc: per sota d'aquestes etiquetes no val la pena repartir-les
+MIN_ETIQUETES_POOL = 8
+MAX_PROCESSOS = min(4, os.cpu_count() or 1)
+
+_logo = None
+_logo_carregat = False
+_logo_lock = threading.Lock()
+
+
+def _info_logo():
+    # El PNG es descodifica i es comprimeix un sol cop per procés
+    global _logo, _logo_carregat
+    if _logo_carregat:
+        return _logo
+
+    with _logo_lock:
+        if not _logo_carregat:
+            try:
+                if LOGO_PATH.exists():
+                    nom, _, info = preload_image(FPDF().image_cache, str(LOGO_PATH))
+                    _logo = (nom, info)
+                else:
+                    log.warning("No trobo el logo a %s", LOGO_PATH)
+            except Exception as e:
+                log.warning("Error carregant el logo: %s", e)
+            _logo_carregat = True
+    return _logo
+
+
+def _posar_logo(pdf: FPDF):
+    logo = _info_logo()
+    if logo is None:
+        return
+
+    nom, info = logo
+    # La imatge ja comprimida va directament a la memòria cau del document (estat
+    # intern de fpdf2, per això la versió queda fixada a requirements.txt). Passar-la
+    # per pdf.image() la tornaria a comprimir a cada document: de ~2 ms a ~250 ms.
+    imatges = getattr(pdf.image_cache, "images", None)
+    if not isinstance(imatges, dict):
+        pdf.image(str(LOGO_PATH), x=15, y=12, w=35)
+        return
+    if nom not in imatges:
+        # Cada document necessita la seva còpia: fpdf hi anota l'índex i els usos
+        info_doc = copy.copy(info)
+        info_doc["usages"] = 0
+        info_doc["i"] = len(imatges) + 1
+        imatges[nom] = info_doc
+    # Logo a dalt-esquerra (marges 15mm)
+    pdf.image(nom, x=15, y=12, w=35)
+
+
+def _nou_document() -> FPDF:
+    pdf = FPDF(orientation="P", unit="mm", format="A4")
+    pdf.set_auto_page_break(auto=True, margin=15)
+    return pdf
+
+
+def _pagina_recepta(
+    pdf: FPDF,
+    nom_recepta: str,
+    linies: list[dict],
+    resultat_100g: dict | None,
+    resultat_racio: dict | None
+):
+    nom_recepta = (nom_recepta or "").strip() or "Recepta sense nom"
+
+    pdf.add_page()
+    pdf.set_text_color(0, 0, 0)
+
+    # --- LOGO (a dalt a l'esquerra) ---
+    try:
+        _posar_logo(pdf)
+    except Exception:
+        # Si el logo falla, no trenquem el PDF
+        pass
+
+    # Deixem espai perquè el títol no es solapi amb el logo
+    pdf.set_y(32)
+
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(0, 10, f"Recepta: {nom_recepta}", ln=True)
+
+    pdf.set_font("Helvetica", "", 10)
+    # Només el dia: el PDF desat a la memòria cau (clau_pdf) val per a tot el dia
+    pdf.cell(0, 6, f"Generat: {datetime.now().strftime('%Y-%m-%d')}", ln=True)
+    pdf.ln(3)
+
+    pdf.set_font("Helvetica", "B", 12)
+    pdf.cell(0, 8, "Ingredients", ln=True)
+
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.cell(120, 7, "Ingredient", border=1)
+    pdf.cell(30, 7, "Codi", border=1)
+    pdf.cell(30, 7, "Grams", border=1, ln=True)
+
+    pdf.set_font("Helvetica", "", 10)
+
+    total_grams = 0.0
+    for l in linies or []:
+        ingredient = str(l.get("ingredient", "") or "")
+        codi = str(l.get("codi", "") or "")
+        grams = float(l.get("grams", 0) or 0)
+
+        total_grams += grams
+
+        if len(ingredient) > 60:
+            ingredient = ingredient[:57] + "..."
+
+        pdf.cell(120, 7, ingredient, border=1)
+        pdf.cell(30, 7, codi, border=1)
+        pdf.cell(30, 7, f"{grams:.2f}", border=1, ln=True)
+
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.cell(150, 7, "Pes total (g)", border=1)
+    pdf.cell(30, 7, f"{total_grams:.2f}", border=1, ln=True)
+    pdf.ln(6)
+
+    if resultat_100g and resultat_100g.get("alergens"):
+        pdf.set_font("Helvetica", "B", 11)
+        noms = ", ".join(ETIQUETES[c] for c in resultat_100g["alergens"])
+        pdf.multi_cell(0, 7, f"Al·lergens: {noms}")
+        pdf.ln(4)
+
+    if resultat_100g:
+        pdf.set_font("Helvetica", "B", 12)
+        pdf.cell(0, 8, "Informacio nutricional (per 100 g)", ln=True)
+
+        pdf.set_font("Helvetica", "", 10)
+
+        def fila(label, key):
+            pdf.cell(90, 7, label, border=1)
+            pdf.cell(0, 7, str(resultat_100g.get(key, "")), border=1, ln=True)
+
+        fila("Energia (kcal)", "energia_kcal_100g")
+        fila("Energia (kJ)", "energia_kj_100g")
+        fila("Greixos (g)", "greixos_100g")
+        fila("Greixos saturats (g)", "greixos_saturats_100g")
+        fila("Hidrats de carboni (g)", "hidrats_carboni_100g")
+        fila("Sucres (g)", "sucres_100g")
+        fila("Proteines (g)", "proteines_100g")
+        fila("Fibra (g)", "fibra_100g")
+        fila("Sal (g)", "sal_100g")
+        pdf.ln(6)
+
+    if resultat_racio:
+        pdf.set_font("Helvetica", "B", 12)
+        pdf.cell(0, 8, f"Informacio nutricional (per racio: {resultat_racio.get('racio_g', '')} g)", ln=True)
+
+        pdf.set_font("Helvetica", "", 10)
+
+        def fila_r(label, key):
+            pdf.cell(90, 7, label, border=1)
+            pdf.cell(0, 7, str(resultat_racio.get(key, "")), border=1, ln=True)
+
+        fila_r("Energia (kcal)", "energia_kcal")
+        fila_r("Energia (kJ)", "energia_kj")
+        fila_r("Greixos (g)", "greixos")
+        fila_r("Greixos saturats (g)", "greixos_saturats")
+        fila_r("Hidrats de carboni (g)", "hidrats_carboni")
+        fila_r("Sucres (g)", "sucres")
+        fila_r("Proteines (g)", "proteines")
+        fila_r("Fibra (g)", "fibra")
+        fila_r("Sal (g)", "sal")
+
+    # --- COPYRIGHT (peu de pàgina) ---
+    auto = pdf.auto_page_break
+    margin = pdf.b_margin
+
+    pdf.set_auto_page_break(auto=False)  # evita que creï una pàgina nova pel footer
+    pdf.set_y(-15)
+    pdf.set_font("Helvetica", "", 8)
+    pdf.set_text_color(120, 120, 120)
+    pdf.cell(0, 5, "by Lyu La Cruz", align="C")
+
+    pdf.set_auto_page_break(auto=auto, margin=margin)  # restaura
+
+
+def _bytes_pdf(pdf: FPDF) -> bytes:
+    pdf_data = pdf.output(dest="S")  # puede ser str o bytearray según versión
+    if isinstance(pdf_data, str):
+        return pdf_data.encode("latin1")
+    return bytes(pdf_data)  # bytearray -> bytes
+
+
+@cronometrat("pdf")
+def generar_pdf_recepta(
+    nom_recepta: str,
+    linies: list[dict],
+    resultat_100g: dict | None,
+    resultat_racio: dict | None
+) -> BytesIO:
+    pdf = _nou_document()
+    _pagina_recepta(pdf, nom_recepta, linies, resultat_100g, resultat_racio)
+    return BytesIO(_bytes_pdf(pdf))
+
+
+@cronometrat("pdf")
+def generar_pdf_receptes(etiquetes: list[dict]) -> bytes:
+    # Un sol document amb una pàgina (o més) per recepta; el logo s'incrusta un cop
+    pdf = _nou_document()
+    for e in etiquetes:
+        _pagina_recepta(pdf, e["nom"], e["linies"], e["resultat_100g"], e["resultat_racio"])
+    return _bytes_pdf(pdf)
+
+
+def _pdf_etiqueta(etiqueta: dict) -> bytes:
+    # Feina de cada procés del pool: no toca la BD, només pinta
+    return generar_pdf_recepta(
+        etiqueta["nom"], etiqueta["linies"], etiqueta["resultat_100g"], etiqueta["resultat_racio"]
+    ).getvalue()
+
+
+_processos: ProcessPoolExecutor | None = None
+_processos_lock = threading.Lock()
+
+
+def _pool_processos() -> ProcessPoolExecutor:
+    global _processos
+    with _processos_lock:
+        if _processos is None:
+            # No fem fork des d'aquí: som un fil d'un worker gthread, amb altres fils,
+            # connexions SQLite i locks a mig fer. Els fills surten d'un servidor
+            # forkserver net que ja té aquest mòdul importat; cadascun carrega el logo
+            # un sol cop (_info_logo).
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _processos = ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=context)
+        return _processos
+
+
+def pdf_receptes_en_pool(etiquetes: list[dict]) -> bytes:
+    # El document de moltes pàgines es pinta en un procés del pool: el fil que
+    # l'espera (un treball en segon pla) no fa servir la CPU del worker web
+    return _pool_processos().submit(generar_pdf_receptes, etiquetes).result()
+
+
+def pdfs_etiquetes(etiquetes: list[dict], sempre_pool: bool = False) -> Iterator[tuple[dict, bytes]]:
+    # Genera (etiqueta, bytes) en el mateix ordre a mesura que van sortint del pool
+    if not sempre_pool and (len(etiquetes) < MIN_ETIQUETES_POOL or MAX_PROCESSOS < 2):
+        for e in etiquetes:
+            yield e, _pdf_etiqueta(e)
+        return
+
+    pool = _pool_processos()
+    yield from zip(etiquetes, pool.map(_pdf_etiqueta, etiquetes, chunksize=4))
+
+
+class _SortidaZip:
+    # Fitxer només d'escriptura: zipfile hi escriu les capçaleres locals i
+    # nosaltres anem buidant el que s'hi acumula cap al client
+    def __init__(self):
+        self.trossos = []
+
+    def write(self, dades) -> int:
+        self.trossos.append(bytes(dades))
+        return len(dades)
+
+    def flush(self):
+        pass
+
+    def buidar(self) -> bytes:
+        dades = b"".join(self.trossos)
+        self.trossos.clear()
+        return dades
+
+
+def zip_etiquetes(etiquetes: list[dict], sempre_pool: bool = False) -> Iterator[bytes]:
+    sortida = _SortidaZip()
+    noms_usats = set()
+    with zipfile.ZipFile(sortida, "w", compression=zipfile.ZIP_STORED) as zf:
+        for e, pdf_bytes in pdfs_etiquetes(etiquetes, sempre_pool):
+            nom = f"{e.get('id', len(noms_usats) + 1)}_{nom_fitxer(e['nom'])}.pdf"
+            if nom in noms_usats:
+                continue
+            noms_usats.add(nom)
+            zf.writestr(nom, pdf_bytes)
+            yield sortida.buidar()
+    yield sortida.buidar()
+
+
+def nom_fitxer(nom_recepta: str) -> str:
+    safe_name = "".join(
+        c for c in (nom_recepta or "recepta")
+        if c.isalnum() or c in (" ", "_", "-")
+    ).strip().replace(" ", "_")
+    return safe_name or "recepta"
+
+
+def clau_pdf(
+    nom_recepta: str,
+    linies: list[dict],
+    resultat_100g: dict | None,
+    resultat_racio: dict | None
+) -> str:
+    # Empremta del contingut de l'etiqueta; el dia hi entra perquè el PDF porta la data
+    contingut = {
+        "nom": (nom_recepta or "").strip(),
+        "linies": [
+            [str(l.get("codi", "") or ""), str(l.get("ingredient", "") or ""), float(l.get("grams", 0) or 0)]
+            for l in linies or []
+        ],
+        "per_100g": resultat_100g.a_dict() if isinstance(resultat_100g, Panell) else resultat_100g,
+        "per_racio": resultat_racio,
+        "dia": datetime.now().strftime("%Y-%m-%d"),
+    }
+    text = json.dumps(contingut, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def clau_lot(etiquetes: list[dict]) -> str:
+    h = hashlib.sha256()
+    for e in etiquetes:
+        h.update(clau_pdf(e["nom"], e["linies"], e["resultat_100g"], e["resultat_racio"]).encode())
+    return h.hexdigest()
+
+
+_pdfs: OrderedDict[str, bytes] = OrderedDict()
+_pdfs_lock = threading.Lock()
+
+
+def pdf_recepta(
+    nom_recepta: str,
+    linies: list[dict],
+    resultat_100g: dict | None,
+    resultat_racio: dict | None
+) -> tuple[bytes, str]:
+    # Torna (bytes del PDF, clau); si ja l'havíem generat amb el mateix contingut no el refà
+    clau = clau_pdf(nom_recepta, linies, resultat_100g, resultat_racio)
+    with _pdfs_lock:
+        pdf_bytes = _pdfs.get(clau)
+        if pdf_bytes is not None:
+            _pdfs.move_to_end(clau)
+            return pdf_bytes, clau
+
+    pdf_bytes = generar_pdf_recepta(nom_recepta, linies, resultat_100g, resultat_racio).getvalue()
+
+    with _pdfs_lock:
+        _pdfs[clau] = pdf_bytes
+        _pdfs.move_to_end(clau)
+        while len(_pdfs) > MAX_PDFS_CACHE:
+            _pdfs.popitem(last=False)
+    return pdf_bytes, clau
@@ -0,0 +1,39 @@
+# gunicorn.conf.py
+import os
+
+
+def _enter(nom: str, per_defecte: int) -> int:
+    try:
+        return int(os.environ.get(nom, per_defecte))
+    except ValueError:
+        return per_defecte
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Processos independents (cadascun amb les seves connexions SQLite) i uns quants
+# fils per procés perquè una etiqueta PDF no bloquegi la resta de peticions
+workers = _enter("WEB_CONCURRENCY", min(4, (os.cpu_count() or 1) * 2 + 1))
+worker_class = "gthread"
+threads = _enter("GUNICORN_THREADS", 4)
+
+timeout = _enter("GUNICORN_TIMEOUT", 60)
+graceful_timeout = 30
+keepalive = 5
+
+# Carreguem l'app (esquema, matriu, índex de cerca) una sola vegada al pare
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+# Reciclem els workers de tant en tant per no acumular memòria
+max_requests = _enter("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = 100
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Els treballs en segon pla viuen a la cua del worker que els ha rebut: quan un
+    # worker es recicla o mor, el que el substitueix marca els seus com a interromputs
+    import treballs
+    treballs.en_iniciar_worker()
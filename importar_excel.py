@@ -1,9 +1,16 @@
 import sqlite3
+import sys
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Optional
 
 import pandas as pd
 
+from alergens import bits_alergens
+from bd import assegurar_esquema, existeix_taula, recepta_linies_ingredient_col
+from cerca import actualitzar_index
+from nutricio import invalidar_receptes_per_ingredients
+from versions_ingredients import publicar_versio
+
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = BASE_DIR / "dades" / "nutricio.db"
@@ -46,43 +53,39 @@ NUMERIC_COLS = [
 ]
 
 
-def _to_float_or_none(x: Any) -> Optional[float]:
-    if x is None:
-        return None
-    if isinstance(x, float) and pd.isna(x):
-        return None
-    if isinstance(x, str):
-        s = x.strip()
-        if s == "":
-            return None
-        # Permetem coma decimal
-        s = s.replace(",", ".")
-        # Treiem espais
-        s = s.replace(" ", "")
-        try:
-            return float(s)
-        except ValueError:
-            return None
-    try:
-        return float(x)
-    except Exception:
-        return None
+# Files per cada executemany (i per cada avís de progrés)
+MIDA_LOT = 5000
 
 
-def _clean_text(x: Any) -> Optional[str]:
-    if x is None:
-        return None
-    if isinstance(x, float) and pd.isna(x):
-        return None
-    s = str(x).strip()
-    return s if s != "" else None
+def _netejar_text(s: pd.Series) -> pd.Series:
+    # Espais fora; cadenes buides i NaN -> None
+    s = s.astype("string").str.strip()
+    s = s.mask(s == "")
+    return s.astype(object).where(s.notna(), None)
+
+
+def _a_float(s: pd.Series) -> pd.Series:
+    # Permetem coma decimal i espais de milers; el que no sigui número -> None
+    s = (
+        s.astype("string")
+        .str.strip()
+        .str.replace(",", ".", regex=False)
+        .str.replace(" ", "", regex=False)
+    )
+    valors = pd.to_numeric(s, errors="coerce")
+    return valors.astype(object).where(valors.notna(), None)
 
 
-def carregar_excel() -> pd.DataFrame:
-    if not EXCEL_PATH.exists():
-        raise FileNotFoundError(f"No s'ha trobat l'Excel: {EXCEL_PATH}")
+def _progres_consola(fets: int, total: int):
+    print(f"   ... {fets}/{total} files")
 
-    df = pd.read_excel(EXCEL_PATH, sheet_name=SHEET_NAME, dtype=str)
+
+def carregar_excel(path: Path | None = None) -> pd.DataFrame:
+    path = path or EXCEL_PATH
+    if not path.exists():
+        raise FileNotFoundError(f"No s'ha trobat l'Excel: {path}")
+
+    df = pd.read_excel(path, sheet_name=SHEET_NAME, dtype=str)
 
     # Normalitzem noms de columnes (per si Excel afegeix espais)
     df.columns = [c.strip() for c in df.columns]
@@ -97,11 +100,11 @@ def carregar_excel() -> pd.DataFrame:
     for c in df.columns:
         if c in NUMERIC_COLS:
             continue
-        df[c] = df[c].apply(_clean_text)
+        df[c] = _netejar_text(df[c])
 
     # Convertim numèrics
     for c in NUMERIC_COLS:
-        df[c] = df[c].apply(_to_float_or_none)
+        df[c] = _a_float(df[c])
 
     # Eliminem files sense codi o ingredient
     df = df[df["codi"].notna() & df["ingredient"].notna()].copy()
@@ -112,82 +115,190 @@ def carregar_excel() -> pd.DataFrame:
     return df
 
 
-def importar_a_sqlite(df: pd.DataFrame) -> tuple[int, int]:
-    if not DB_PATH.exists():
-        raise FileNotFoundError(f"No s'ha trobat la BD: {DB_PATH} (executa crear_db.py)")
+def hash_files(df: pd.DataFrame) -> pd.Series:
+    # Empremta del contingut de cada fila (només les columnes de la fitxa)
+    hashes = pd.util.hash_pandas_object(df[COLS_OBLIGATORIES], index=False)
+    return hashes.map("{:016x}".format)
+
+
+def bits_alergens_files(df: pd.DataFrame) -> pd.Series:
+    # El text d'al·lèrgens es repeteix molt: analitzem cada valor diferent un sol cop
+    unics = df["alergens"].dropna().unique()
+    mascares = {text: bits_alergens(text) for text in unics}
+    return df["alergens"].map(mascares).fillna(0).astype(int)
+
+
+@dataclass
+class ResultatImportacio:
+    inserits: int = 0
+    actualitzats: int = 0
+    sense_canvis: int = 0
+    eliminats: int = 0
+    # Codis inserits, actualitzats o eliminats: els que cal recalcular aigües avall
+    codis_canviats: set[str] = field(default_factory=set)
+    receptes_invalidades: int = 0
+    # Versió d'ingredients publicada (None si no hi ha hagut canvis)
+    versio: int | None = None
+    # Codis absents de l'Excel que no s'han eliminat: encara els fan servir receptes guardades
+    conservats: set[str] = field(default_factory=set)
+
+
+def _codis_en_us(conn: sqlite3.Connection, codis) -> set[str]:
+    # Codis d'ingredient que surten a alguna línia de recepta guardada (la FK no
+    # deixaria esborrar-los). Les subreceptes apunten a receptes, no a ingredients.
+    if not existeix_taula(conn, "recepta_linies"):
+        return set()
+    ing_col = recepta_linies_ingredient_col(conn)
+    codis = list(codis)
+    en_us = set()
+    for i in range(0, len(codis), 500):
+        tros = codis[i:i + 500]
+        en_us.update(
+            r[0] for r in conn.execute(
+                f"SELECT DISTINCT {ing_col} FROM recepta_linies WHERE {ing_col} IN ({', '.join('?' * len(tros))})",
+                tros,
+            )
+        )
+    return en_us
 
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
 
-    inserits = 0
-    actualitzats = 0
+def importar_a_sqlite(
+    df: pd.DataFrame,
+    progres=_progres_consola,
+    eliminar_absents: bool = False,
+    origen: str = "importacio",
+) -> ResultatImportacio:
+    if not DB_PATH.exists():
+        raise FileNotFoundError(f"No s'ha trobat la BD: {DB_PATH} (executa crear_db.py)")
 
-    sql_upsert = """
-    INSERT INTO ingredients (
-        codi, ingredient, proveidor, unitat_base, data_fitxa, font,
-        ingredient_compost, alergens, observacions,
-        energia_kcal_100g, energia_kj_100g, greixos_100g, greixos_saturats_100g,
-        hidrats_carboni_100g, sucres_100g, proteines_100g, fibra_100g, sal_100g
-    )
-    VALUES (
-        :codi, :ingredient, :proveidor, :unitat_base, :data_fitxa, :font,
-        :ingredient_compost, :alergens, :observacions,
-        :energia_kcal_100g, :energia_kj_100g, :greixos_100g, :greixos_saturats_100g,
-        :hidrats_carboni_100g, :sucres_100g, :proteines_100g, :fibra_100g, :sal_100g
-    )
+    # Si un codi surt repetit a l'Excel, mana l'última fila (com feia l'upsert fila a fila)
+    df = df.drop_duplicates(subset="codi", keep="last").copy()
+    df["hash_fitxa"] = hash_files(df)
+    df["alergens_bits"] = bits_alergens_files(df)
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    # Així no podem eliminar ingredients que encara fan servir receptes guardades
+    conn.execute("PRAGMA foreign_keys = ON;")
+    # La taula de staging és TEMP: omplir-la no bloqueja la BD ni la veu cap altra connexió
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    assegurar_esquema(conn)
+
+    cols = COLS_OBLIGATORIES + ["hash_fitxa", "alergens_bits"]
+    sql_publicar = f"""
+    INSERT INTO main.ingredients ({', '.join(cols)})
+    SELECT {', '.join(cols)} FROM temp.ingredients_staging WHERE true
     ON CONFLICT(codi) DO UPDATE SET
-        ingredient=excluded.ingredient,
-        proveidor=excluded.proveidor,
-        unitat_base=excluded.unitat_base,
-        data_fitxa=excluded.data_fitxa,
-        font=excluded.font,
-        ingredient_compost=excluded.ingredient_compost,
-        alergens=excluded.alergens,
-        observacions=excluded.observacions,
-        energia_kcal_100g=excluded.energia_kcal_100g,
-        energia_kj_100g=excluded.energia_kj_100g,
-        greixos_100g=excluded.greixos_100g,
-        greixos_saturats_100g=excluded.greixos_saturats_100g,
-        hidrats_carboni_100g=excluded.hidrats_carboni_100g,
-        sucres_100g=excluded.sucres_100g,
-        proteines_100g=excluded.proteines_100g,
-        fibra_100g=excluded.fibra_100g,
-        sal_100g=excluded.sal_100g
+        {', '.join(f"{c}=excluded.{c}" for c in cols if c != "codi")}
     ;
     """
 
-    # Comptem inserits vs actualitzats mirant si existeix abans
-    for _, row in df.iterrows():
-        params = row.to_dict()
+    resultat = ResultatImportacio()
+    try:
+        # 1) Staging, fora de cap transacció d'escriptura sobre la BD: comparem
+        # l'empremta de cada fila amb la publicada i només copiem el que canvia
+        existents = pd.Series(
+            dict(conn.execute("SELECT codi, hash_fitxa FROM ingredients")),
+            dtype=object,
+        )
+        hash_anterior = df["codi"].map(existents)
+        nous = hash_anterior.isna() & ~df["codi"].isin(existents.index)
+        canviats = ~nous & (hash_anterior != df["hash_fitxa"])
 
-        cur.execute("SELECT 1 FROM ingredients WHERE codi = ?", (params["codi"],))
-        exists = cur.fetchone() is not None
+        resultat.inserits = int(nous.sum())
+        resultat.actualitzats = int(canviats.sum())
+        resultat.sense_canvis = len(df) - resultat.inserits - resultat.actualitzats
 
-        cur.execute(sql_upsert, params)
+        a_escriure = df[nous | canviats]
+        files = a_escriure[cols].to_dict("records")
+        resultat.codis_canviats = set(a_escriure["codi"])
 
-        if exists:
-            actualitzats += 1
-        else:
-            inserits += 1
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS ingredients_staging AS "
+            "SELECT * FROM main.ingredients WHERE 0;"
+        )
+        conn.execute("DELETE FROM temp.ingredients_staging;")
+        sql_staging = f"""
+        INSERT INTO temp.ingredients_staging ({', '.join(cols)})
+        VALUES ({', '.join(':' + c for c in cols)});
+        """
+        total = len(files)
+        for i in range(0, total, MIDA_LOT):
+            conn.executemany(sql_staging, files[i:i + MIDA_LOT])
+            if progres:
+                progres(min(i + MIDA_LOT, total), total)
+        conn.commit()
+
+        absents = set(existents.index) - set(df["codi"])
+        eliminats = absents if eliminar_absents else set()
+        if not resultat.codis_canviats and not eliminats:
+            return resultat
+
+        # 2) Publicació: una sola transacció curta. Els lectors veuen la versió
+        # anterior sencera fins al commit i la nova sencera després.
+        conn.execute("BEGIN IMMEDIATE")
+        if eliminats:
+            # Dins la transacció, perquè ningú no en pugui afegir cap ús entremig
+            resultat.conservats = _codis_en_us(conn, eliminats)
+            eliminats = eliminats - resultat.conservats
+            if not resultat.codis_canviats and not eliminats:
+                conn.rollback()
+                return resultat
+        conn.execute(sql_publicar)
+        if eliminats:
+            conn.executemany("DELETE FROM ingredients WHERE codi = ?", [(c,) for c in eliminats])
+            resultat.eliminats = len(eliminats)
+            resultat.codis_canviats |= eliminats
+
+        # Només reindexem els codis que han canviat
+        actualitzar_index(conn, resultat.codis_canviats)
+
+        # Només les receptes que fan servir aquests codis perden la nutrició desada
+        resultat.receptes_invalidades = invalidar_receptes_per_ingredients(
+            conn, resultat.codis_canviats
+        )
 
-    conn.commit()
-    conn.close()
-    return inserits, actualitzats
+        # Nova versió d'ingredients: queda a l'historial i l'app invalida les seves memòries cau
+        resultat.versio = publicar_versio(
+            conn,
+            sorted(resultat.codis_canviats),
+            eliminats,
+            origen=origen,
+            inserits=resultat.inserits,
+            actualitzats=resultat.actualitzats,
+        )
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return resultat
 
 
-def main():
+def main(eliminar_absents: bool = False):
     print("📄 Llegint Excel:", EXCEL_PATH)
     df = carregar_excel()
     print(f"✅ Files vàlides a importar: {len(df)}")
 
     print("🗄️ Important a SQLite:", DB_PATH)
-    inserits, actualitzats = importar_a_sqlite(df)
+    resultat = importar_a_sqlite(df, eliminar_absents=eliminar_absents, origen=EXCEL_PATH.name)
 
     print("✅ Importació completada")
-    print(f"   - Inserits: {inserits}")
-    print(f"   - Actualitzats: {actualitzats}")
+    print(f"   - Inserits: {resultat.inserits}")
+    print(f"   - Actualitzats: {resultat.actualitzats}")
+    print(f"   - Sense canvis: {resultat.sense_canvis}")
+    print(f"   - Eliminats: {resultat.eliminats}")
+    if resultat.conservats:
+        print("   ⚠️ No eliminats (els fan servir receptes):", ", ".join(sorted(resultat.conservats)))
+    print(f"   - Receptes a recalcular: {resultat.receptes_invalidades}")
+    if resultat.versio is not None:
+        print(f"   - Versió d'ingredients publicada: {resultat.versio}")
+    if resultat.codis_canviats:
+        print("   - Codis canviats:", ", ".join(sorted(resultat.codis_canviats)))
 
 
 if __name__ == "__main__":
     # Requereix: pip install pandas openpyxl
-    main()
+    # Amb --eliminar-absents s'esborren de la BD els codis que ja no surten a l'Excel
+    main(eliminar_absents="--eliminar-absents" in sys.argv[1:])
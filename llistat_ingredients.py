@@ -0,0 +1,142 @@
+# llistat_ingredients.py
+import csv
+import io
+import json
+import sqlite3
+
+from alergens import mascara
+from bd import get_db_connection
+
+
+COLS_LLISTAT = ["codi", "ingredient", "proveidor", "energia_kcal_100g", "energia_kj_100g"]
+COLS_EXPORT = [
+    "codi", "ingredient", "proveidor", "unitat_base", "data_fitxa", "font",
+    "ingredient_compost", "alergens", "observacions",
+    "energia_kcal_100g", "energia_kj_100g", "greixos_100g", "greixos_saturats_100g",
+    "hidrats_carboni_100g", "sucres_100g", "proteines_100g", "fibra_100g", "sal_100g",
+]
+
+# Columna d'ordenació -> expressió SQL (la mateixa dels índexs de bd.assegurar_esquema)
+ORDRES = {
+    "codi": "codi",
+    "ingredient": "ingredient",
+    "proveidor": "COALESCE(proveidor, '')",
+}
+PER_PAGINA = 100
+MAX_PER_PAGINA = 500
+# Files que llegim del cursor cada cop mentre exportem
+MIDA_TROS = 500
+
+
+def _filtres_sql(proveidor: str = "", alergen: str = "") -> tuple[list[str], list]:
+    condicions, params = [], []
+    if proveidor:
+        condicions.append("proveidor = ?")
+        params.append(proveidor)
+    if alergen:
+        try:
+            bits = mascara(alergen)
+        except ValueError:
+            bits = 0
+        if bits:
+            condicions.append("alergens_bits & ? != 0")
+            params.append(bits)
+        else:
+            # No és cap dels 14 al·lèrgens: busquem el text tal qual
+            condicions.append("alergens LIKE ?")
+            params.append(f"%{alergen}%")
+    return condicions, params
+
+
+def pagina(
+    conn: sqlite3.Connection,
+    ordre: str = "codi",
+    despres: str = "",
+    despres_valor: str = "",
+    per_pagina: int = PER_PAGINA,
+    proveidor: str = "",
+    alergen: str = "",
+) -> tuple[list[sqlite3.Row], dict | None]:
+    # Paginació per clau (keyset): la pàgina següent comença just després de
+    # (valor d'ordenació, codi) de l'última fila; no cal OFFSET
+    expr = ORDRES.get(ordre, "codi")
+    condicions, params = _filtres_sql(proveidor, alergen)
+    if despres:
+        if expr == "codi":
+            condicions.append("codi > ?")
+            params.append(despres)
+        else:
+            # Equival a (expr, codi) > (?, ?), escrit perquè SQLite pugui saltar
+            # directament a la posició dins l'índex d'expressió
+            condicions.append(f"{expr} >= ? AND ({expr} > ? OR codi > ?)")
+            params.extend([despres_valor, despres_valor, despres])
+
+    where = f"WHERE {' AND '.join(condicions)}" if condicions else ""
+    rows = conn.execute(
+        f"""
+        SELECT {', '.join(COLS_LLISTAT)}, {expr} AS valor_ordre
+        FROM ingredients
+        {where}
+        ORDER BY {expr}, codi
+        LIMIT ?
+        """,
+        (*params, per_pagina + 1),
+    ).fetchall()
+
+    seguent = None
+    if len(rows) > per_pagina:
+        rows = rows[:per_pagina]
+        seguent = {"despres": rows[-1]["codi"], "despres_valor": rows[-1]["valor_ordre"]}
+    return rows, seguent
+
+
+def proveidors(conn: sqlite3.Connection) -> list[str]:
+    return [
+        r[0] for r in conn.execute(
+            "SELECT DISTINCT proveidor FROM ingredients WHERE proveidor IS NOT NULL ORDER BY proveidor"
+        )
+    ]
+
+
+def _files_export(ordre: str, proveidor: str, alergen: str):
+    # Llegim del cursor a trossos: la memòria no creix amb la mida de la taula
+    expr = ORDRES.get(ordre, "codi")
+    condicions, params = _filtres_sql(proveidor, alergen)
+    where = f"WHERE {' AND '.join(condicions)}" if condicions else ""
+
+    conn = get_db_connection()
+    try:
+        cur = conn.execute(
+            f"SELECT {', '.join(COLS_EXPORT)} FROM ingredients {where} ORDER BY {expr}, codi",
+            params,
+        )
+        while True:
+            tros = cur.fetchmany(MIDA_TROS)
+            if not tros:
+                break
+            yield tros
+    finally:
+        conn.close()
+
+
+def exportar_csv(ordre: str = "codi", proveidor: str = "", alergen: str = ""):
+    buffer = io.StringIO()
+    escriptor = csv.writer(buffer)
+    escriptor.writerow(COLS_EXPORT)
+    for tros in _files_export(ordre, proveidor, alergen):
+        escriptor.writerows(tros)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def exportar_json(ordre: str = "codi", proveidor: str = "", alergen: str = ""):
+    primer = True
+    yield "["
+    for tros in _files_export(ordre, proveidor, alergen):
+        parts = [json.dumps(dict(zip(COLS_EXPORT, r)), ensure_ascii=False) for r in tros]
+        yield ("" if primer else ",") + ",\n".join(parts)
+        primer = False
+    yield "]\n"
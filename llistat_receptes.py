@@ -0,0 +1,126 @@
+# llistat_receptes.py
+import sqlite3
+
+from alergens import claus_alergens
+from bd import existeix_taula, recepta_linies_ingredient_col
+from nutricio import COLS_100G, PREFIX_SUBRECEPTA
+from panell import DECIMALS
+
+
+# Ordre -> (expressió, direcció); "recents" primer les últimes guardades
+ORDRES = {
+    "recents": ("id", "DESC"),
+    "nom": ("nom", "ASC"),
+}
+PER_PAGINA = 50
+MAX_PER_PAGINA = 200
+
+
+def assegurar_index(conn: sqlite3.Connection):
+    # Paginació per clau ordenant per nom (vegeu ORDRES)
+    if not existeix_taula(conn, "receptes"):
+        return
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receptes_nom ON receptes(nom, id);")
+    conn.commit()
+
+
+def pagina(
+    conn: sqlite3.Connection,
+    ordre: str = "recents",
+    q: str = "",
+    despres: str = "",
+    despres_valor: str = "",
+    per_pagina: int = PER_PAGINA,
+) -> tuple[list[dict], dict | None]:
+    # Una sola consulta: capçalera, nombre de línies i el panell desat (si n'hi ha)
+    expr, direccio = ORDRES.get(ordre, ORDRES["recents"])
+    condicions, params = [], []
+    if q:
+        condicions.append("r.nom LIKE ? ESCAPE '\\'")
+        params.append("%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if despres:
+        if expr == "id":
+            condicions.append("r.id < ?" if direccio == "DESC" else "r.id > ?")
+            params.append(int(despres))
+        else:
+            condicions.append(f"r.{expr} >= ? AND (r.{expr} > ? OR r.id > ?)")
+            params.extend([despres_valor, despres_valor, int(despres)])
+
+    where = f"WHERE {' AND '.join(condicions)}" if condicions else ""
+    ordenacio = f"r.id {direccio}" if expr == "id" else f"r.{expr} {direccio}, r.id {direccio}"
+    rows = conn.execute(
+        f"""
+        SELECT
+            r.id, r.nom, r.creada_el, r.versio_ingredients, r.{expr} AS valor_ordre,
+            (SELECT COUNT(*) FROM recepta_linies l WHERE l.recepta_id = r.id)
+              + (SELECT COUNT(*) FROM recepta_subreceptes s WHERE s.recepta_id = r.id) AS n_linies,
+            n.pes_total_g, n.energia_kcal_100g, n.alergens_bits
+        FROM receptes r
+        LEFT JOIN recepta_nutricio n ON n.recepta_id = r.id
+        {where}
+        ORDER BY {ordenacio}
+        LIMIT ?
+        """,
+        (*params, per_pagina + 1),
+    ).fetchall()
+
+    seguent = None
+    if len(rows) > per_pagina:
+        rows = rows[:per_pagina]
+        seguent = {"despres": rows[-1]["id"], "despres_valor": rows[-1]["valor_ordre"]}
+
+    receptes = []
+    for r in rows:
+        recepta = {k: r[k] for k in ("id", "nom", "creada_el", "versio_ingredients", "n_linies")}
+        recepta["calculada"] = r["pes_total_g"] is not None
+        # recepta_nutricio desa els valors sense arrodonir
+        recepta["energia_kcal_100g"] = (
+            round(r["energia_kcal_100g"], DECIMALS) if r["energia_kcal_100g"] is not None else None
+        )
+        recepta["alergens"] = claus_alergens(r["alergens_bits"] or 0)
+        receptes.append(recepta)
+    return receptes, seguent
+
+
+def recepta_amb_linies(conn: sqlite3.Connection, recepta_id: int) -> dict | None:
+    # Capçalera + línies amb el nom i els nutrients per 100 g de cada ingredient o
+    # subrecepta, tot amb un JOIN (no una consulta per línia)
+    capcalera = conn.execute(
+        "SELECT id, nom, creada_el, versio_ingredients FROM receptes WHERE id = ?",
+        (recepta_id,),
+    ).fetchone()
+    if capcalera is None:
+        return None
+
+    ing_col = recepta_linies_ingredient_col(conn)
+    rows = conn.execute(
+        f"""
+        SELECT 0 AS es_sub, l.id AS ordre, l.{ing_col} AS codi, i.ingredient AS nom, l.grams,
+               COALESCE(i.alergens_bits, 0) AS alergens_bits,
+               {', '.join(f'i.{c}' for c in COLS_100G)}
+        FROM recepta_linies l
+        LEFT JOIN ingredients i ON i.codi = l.{ing_col}
+        WHERE l.recepta_id = ?
+        UNION ALL
+        SELECT 1, s.id, '{PREFIX_SUBRECEPTA}' || s.subrecepta_id, sr.nom || ' (recepta)', s.grams,
+               COALESCE(n.alergens_bits, 0),
+               {', '.join(f'n.{c}' for c in COLS_100G)}
+        FROM recepta_subreceptes s
+        LEFT JOIN receptes sr ON sr.id = s.subrecepta_id
+        LEFT JOIN recepta_nutricio n ON n.recepta_id = s.subrecepta_id
+        WHERE s.recepta_id = ?
+        ORDER BY es_sub, ordre
+        """,
+        (recepta_id, recepta_id),
+    ).fetchall()
+
+    linies = []
+    for r in rows:
+        linia = {"codi": r["codi"], "ingredient": r["nom"] or "", "grams": r["grams"]}
+        if r["es_sub"]:
+            linia.update({c: round(r[c], DECIMALS) if r[c] is not None else None for c in COLS_100G})
+        else:
+            linia.update({c: r[c] for c in COLS_100G})
+        linia["alergens"] = claus_alergens(r["alergens_bits"])
+        linies.append(linia)
+    return {**dict(capcalera), "linies": linies}
@@ -0,0 +1,166 @@
+# metriques.py
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Flask, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+from bd import registrar_observador_sql
+
+
+# Límits (s) dels histogrames, com els de Prometheus per defecte
+LIMITS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "masgrau"
+
+
+class Histograma:
+    def __init__(self):
+        self.comptes = [0] * len(LIMITS)
+        self.total = 0
+        self.suma = 0.0
+
+    def observar(self, valor: float):
+        for i, limit in enumerate(LIMITS):
+            if valor <= limit:
+                self.comptes[i] += 1
+                break
+        self.total += 1
+        self.suma += valor
+
+    def linies(self, nom: str, etiquetes: str) -> list[str]:
+        sep = "," if etiquetes else ""
+        linies = []
+        acumulat = 0
+        for limit, compte in zip(LIMITS, self.comptes):
+            acumulat += compte
+            linies.append(f'{nom}_bucket{{{etiquetes}{sep}le="{limit}"}} {acumulat}')
+        linies.append(f'{nom}_bucket{{{etiquetes}{sep}le="+Inf"}} {self.total}')
+        linies.append(f"{nom}_sum{{{etiquetes}}} {self.suma}")
+        linies.append(f"{nom}_count{{{etiquetes}}} {self.total}")
+        return linies
+
+
+# Tot és per procés: amb gunicorn cada worker exposa les seves pròpies sèries
+_lock = threading.Lock()
+_peticions: dict[tuple[str, str, str], Histograma] = {}
+_operacions: dict[str, Histograma] = {}
+_sql: dict[str, list] = {}  # ruta -> [consultes, segons]
+
+_fil = threading.local()
+
+
+def _etiqueta(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _observar_sql(durada: float):
+    if not has_request_context():
+        return
+    mesures = g.get("_metriques")
+    if mesures is not None:
+        mesures["sql_n"] += 1
+        mesures["sql_s"] += durada
+
+
+def _afegir_operacio(nom: str, durada: float):
+    with _lock:
+        _operacions.setdefault(nom, Histograma()).observar(durada)
+    if has_request_context():
+        mesures = g.get("_metriques")
+        if mesures is not None:
+            mesures["operacions"][nom] = mesures["operacions"].get(nom, 0.0) + durada
+
+
+@contextmanager
+def mesurar(nom: str):
+    # Les crides imbricades (p. ex. subreceptes) només compten la de més enfora
+    profunditat = getattr(_fil, nom, 0)
+    setattr(_fil, nom, profunditat + 1)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(_fil, nom, profunditat)
+        if profunditat == 0:
+            _afegir_operacio(nom, time.perf_counter() - t0)
+
+
+def cronometrat(nom: str):
+    def decorador(funcio):
+        @functools.wraps(funcio)
+        def embolcall(*args, **kwargs):
+            with mesurar(nom):
+                return funcio(*args, **kwargs)
+        return embolcall
+    return decorador
+
+
+def _inici_peticio():
+    g._metriques = {"t0": time.perf_counter(), "sql_n": 0, "sql_s": 0.0, "operacions": {}}
+
+
+def _fi_peticio(resposta):
+    mesures = g.pop("_metriques", None)
+    if mesures is None:
+        return resposta
+
+    durada = time.perf_counter() - mesures["t0"]
+    ruta = request.url_rule.rule if request.url_rule is not None else "(sense ruta)"
+    with _lock:
+        _peticions.setdefault((request.method, ruta, str(resposta.status_code)), Histograma()).observar(durada)
+        sql = _sql.setdefault(ruta, [0, 0.0])
+        sql[0] += mesures["sql_n"]
+        sql[1] += mesures["sql_s"]
+
+    parts = [f'sql;dur={mesures["sql_s"] * 1000:.2f};desc="{mesures["sql_n"]} consultes"']
+    parts.extend(f"{nom};dur={s * 1000:.2f}" for nom, s in mesures["operacions"].items())
+    parts.append(f"total;dur={durada * 1000:.2f}")
+    resposta.headers.add("Server-Timing", ", ".join(parts))
+    return resposta
+
+
+def _inici_plantilla(app, template, context, **extra):
+    if has_request_context():
+        g._t0_plantilla = time.perf_counter()
+
+
+def _fi_plantilla(app, template, context, **extra):
+    if has_request_context() and "_t0_plantilla" in g:
+        _afegir_operacio("plantilla", time.perf_counter() - g.pop("_t0_plantilla"))
+
+
+def text_prometheus() -> str:
+    linies = [
+        f"# HELP {PREFIX}_peticio_segons Durada de les peticions HTTP per ruta.",
+        f"# TYPE {PREFIX}_peticio_segons histogram",
+    ]
+    with _lock:
+        for (metode, ruta, estat), h in sorted(_peticions.items()):
+            etiquetes = f'metode="{metode}",ruta="{_etiqueta(ruta)}",estat="{estat}"'
+            linies.extend(h.linies(f"{PREFIX}_peticio_segons", etiquetes))
+
+        linies.append(f"# HELP {PREFIX}_sql_consultes_total Consultes SQL executades per ruta.")
+        linies.append(f"# TYPE {PREFIX}_sql_consultes_total counter")
+        for ruta, (n, _) in sorted(_sql.items()):
+            linies.append(f'{PREFIX}_sql_consultes_total{{ruta="{_etiqueta(ruta)}"}} {n}')
+
+        linies.append(f"# HELP {PREFIX}_sql_segons_total Temps total en consultes SQL per ruta.")
+        linies.append(f"# TYPE {PREFIX}_sql_segons_total counter")
+        for ruta, (_, s) in sorted(_sql.items()):
+            linies.append(f'{PREFIX}_sql_segons_total{{ruta="{_etiqueta(ruta)}"}} {s}')
+
+        linies.append(f"# HELP {PREFIX}_operacio_segons Durada de nutrició, PDF, QR i plantilles.")
+        linies.append(f"# TYPE {PREFIX}_operacio_segons histogram")
+        for nom, h in sorted(_operacions.items()):
+            linies.extend(h.linies(f"{PREFIX}_operacio_segons", f'operacio="{_etiqueta(nom)}"'))
+    return "\n".join(linies) + "\n"
+
+
+def instal_lar(app: Flask):
+    registrar_observador_sql(_observar_sql)
+    app.before_request(_inici_peticio)
+    app.after_request(_fi_peticio)
+    before_render_template.connect(_inici_plantilla, app, weak=False)
+    template_rendered.connect(_fi_plantilla, app, weak=False)
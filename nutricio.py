@@ -0,0 +1,608 @@
+# nutricio.py
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from bd import (
+    existeix_taula,
+    get_db_connection,
+    instantania,
+    recepta_linies_ingredient_col,
+    versio_ingredients,
+)
+from metriques import cronometrat
+from panell import COLS_100G, NUTRIENTS, LotPanells, Panell, racio_valida
+from versions_ingredients import files_versio
+
+
+# Les línies amb codi "R:<id>" són receptes guardades fent d'ingredient
+PREFIX_SUBRECEPTA = "R:"
+
+
+# Taula de nutrients en memòria: índex codi -> fila sobre una matriu (n, 9)
+class MatriuNutrients:
+    def __init__(self, codis: list[str], valors: np.ndarray, versio: int = 0, alergens=None):
+        self.codis = codis
+        self.index = {codi: i for i, codi in enumerate(codis)}
+        # Contigua i en float64: els NULL de la BD ja arriben com a 0.0
+        self.valors = np.ascontiguousarray(valors, dtype=np.float64)
+        # Màscara d'al·lèrgens de cada fila (alergens.BIT)
+        if alergens is None:
+            alergens = np.zeros(len(codis), dtype=np.int64)
+        self.alergens = np.asarray(alergens, dtype=np.int64)
+        self.versio = versio
+        # Les matrius d'una versió antiga també calculen les subreceptes amb aquesta versió
+        self.historica = False
+
+    @classmethod
+    def des_de_historic(cls, versio: int) -> "MatriuNutrients":
+        conn = get_db_connection()
+        try:
+            rows = [
+                (r["codi"], r["alergens_bits"] or 0, *(r[c] for c in COLS_100G))
+                for r in files_versio(conn, versio)
+            ]
+        finally:
+            conn.close()
+
+        matriu = cls._des_de_files(rows, versio)
+        matriu.historica = True
+        return matriu
+
+    @classmethod
+    def des_de_bd(cls) -> "MatriuNutrients":
+        # La versió es llegeix a la mateixa instantània que les files
+        conn = get_db_connection()
+        try:
+            with instantania(conn) as versio:
+                rows = conn.execute(
+                    f"""
+                    SELECT codi, COALESCE(alergens_bits, 0), {', '.join(COLS_100G)}
+                    FROM ingredients
+                    ORDER BY codi
+                    """
+                ).fetchall()
+        finally:
+            conn.close()
+
+        return cls._des_de_files(rows, versio)
+
+    @classmethod
+    def _des_de_files(cls, rows, versio: int) -> "MatriuNutrients":
+        codis = [r[0] for r in rows]
+        alergens = np.array([r[1] for r in rows], dtype=np.int64)
+        valors = np.array(
+            [[v if v is not None else 0.0 for v in r[2:]] for r in rows],
+            dtype=np.float64,
+        ).reshape(len(rows), len(NUTRIENTS))
+        return cls(codis, valors, versio, alergens)
+
+
+_matriu: MatriuNutrients | None = None
+_matriu_lock = threading.Lock()
+
+# Matrius de versions antigues (per refer etiquetes històriques); poques i petites
+MAX_MATRIUS_HISTORIQUES = 4
+_historiques: OrderedDict[int, MatriuNutrients] = OrderedDict()
+
+
+def obtenir_matriu() -> MatriuNutrients:
+    global _matriu
+
+    conn = get_db_connection()
+    try:
+        versio = versio_ingredients(conn)
+    finally:
+        conn.close()
+
+    matriu = _matriu
+    if matriu is not None and matriu.versio == versio:
+        return matriu
+
+    with _matriu_lock:
+        if _matriu is None or _matriu.versio != versio:
+            _matriu = MatriuNutrients.des_de_bd()
+        return _matriu
+
+
+def obtenir_matriu_versio(versio: int) -> MatriuNutrients:
+    actual = obtenir_matriu()
+    if actual.versio == versio:
+        return actual
+
+    with _matriu_lock:
+        matriu = _historiques.get(versio)
+        if matriu is not None:
+            _historiques.move_to_end(versio)
+            return matriu
+
+    matriu = MatriuNutrients.des_de_historic(versio)
+    with _matriu_lock:
+        _historiques[versio] = matriu
+        while len(_historiques) > MAX_MATRIUS_HISTORIQUES:
+            _historiques.popitem(last=False)
+    return matriu
+
+
+def id_subrecepta(codi: str) -> int | None:
+    # "R:12" -> 12; qualsevol altre codi -> None
+    if not codi.startswith(PREFIX_SUBRECEPTA):
+        return None
+    try:
+        return int(codi[len(PREFIX_SUBRECEPTA):])
+    except ValueError:
+        return None
+
+
+def _llegir_linies(linies, matriu: MatriuNutrients, subreceptes: dict[int, int]):
+    # Retorna (pes_total, files, grams) o None si la recepta no és calculable.
+    # Les subreceptes ocupen files virtuals a partir de len(matriu.codis); el seu
+    # ordre queda registrat a `subreceptes` (id -> posició).
+    if not linies:
+        return None
+
+    try:
+        total_grams = sum(float(l["grams"]) for l in linies)
+    except Exception:
+        return None
+
+    # Un sol "inf" o "nan" fa el total no finit: la recepta no és calculable
+    if not math.isfinite(total_grams) or total_grams <= 0:
+        return None
+
+    files = []
+    grams_valids = []
+    for l in linies:
+        codi = (l.get("codi") or "").strip()
+        try:
+            grams = float(l.get("grams", 0) or 0)
+        except ValueError:
+            grams = 0.0
+
+        if not codi or grams <= 0:
+            continue
+
+        fila = matriu.index.get(codi)
+        if fila is None:
+            sub_id = id_subrecepta(codi)
+            if sub_id is None:
+                continue
+            fila = len(matriu.codis) + subreceptes.setdefault(sub_id, len(subreceptes))
+
+        files.append(fila)
+        grams_valids.append(grams)
+
+    return total_grams, files, grams_valids
+
+
+def _panells_subreceptes(conn, subreceptes: dict[int, int], en_curs: frozenset, matriu=None):
+    # Panell per 100 g i màscara d'al·lèrgens de cada subrecepta, en l'ordre de `subreceptes`
+    if not subreceptes:
+        return np.zeros((0, len(NUTRIENTS))), np.zeros(0, dtype=np.int64)
+
+    propia = conn is None
+    if propia:
+        conn = get_db_connection()
+    try:
+        # subreceptes conserva l'ordre d'inserció, que és el de les posicions
+        if matriu is not None and matriu.historica:
+            panells = [_nutricio_historica(conn, sub_id, matriu, en_curs) for sub_id in subreceptes]
+        else:
+            panells = [_nutricio_recepta(conn, sub_id, en_curs) for sub_id in subreceptes]
+        if propia:
+            conn.commit()
+    finally:
+        if propia:
+            conn.close()
+    lot = LotPanells.apilar(panells)
+    return lot.valors, lot.bits
+
+
+def _valors_files(matriu: MatriuNutrients, valors_sub: np.ndarray, files) -> np.ndarray:
+    files = np.asarray(files, dtype=np.intp)
+    n = len(matriu.codis)
+    if not len(valors_sub):
+        return matriu.valors[files]
+
+    valors = np.empty((len(files), len(NUTRIENTS)))
+    son_sub = files >= n
+    valors[~son_sub] = matriu.valors[files[~son_sub]]
+    valors[son_sub] = valors_sub[files[son_sub] - n]
+    return valors
+
+
+def _alergens_files(matriu: MatriuNutrients, alergens_sub: np.ndarray, files) -> np.ndarray:
+    files = np.asarray(files, dtype=np.intp)
+    n = len(matriu.codis)
+    if not len(alergens_sub):
+        return matriu.alergens[files]
+
+    alergens = np.empty(len(files), dtype=np.int64)
+    son_sub = files >= n
+    alergens[~son_sub] = matriu.alergens[files[~son_sub]]
+    alergens[son_sub] = alergens_sub[files[son_sub] - n]
+    return alergens
+
+
+def calcular_nutricio_per_racio(resultat_100g: Panell | dict | None, racio_g) -> dict | None:
+    if not resultat_100g:
+        return None
+    if isinstance(resultat_100g, Panell):
+        # Des dels valors sense arrodonir
+        return resultat_100g.racio(racio_g)
+
+    racio_g = racio_valida(racio_g)
+    if racio_g <= 0:
+        return None
+
+    factor = racio_g / 100.0
+    resultat = {"racio_g": round(racio_g, 2)}
+    for nom, col in zip(NUTRIENTS, COLS_100G):
+        resultat[nom] = round(resultat_100g[col] * factor, 2)
+    return resultat
+
+
+@cronometrat("nutricio")
+def calcular_nutricio_per_100g(
+    linies,
+    matriu: MatriuNutrients | None = None,
+    conn: sqlite3.Connection | None = None,
+    en_curs: frozenset = frozenset(),
+) -> Panell | None:
+    # `conn` només cal si hi ha subreceptes i som dins d'una transacció;
+    # `en_curs` són les receptes que ja s'estan aplanant (detecció de cicles)
+    matriu = matriu or obtenir_matriu()
+    subreceptes: dict[int, int] = {}
+    llegides = _llegir_linies(linies, matriu, subreceptes)
+    if llegides is None:
+        return None
+
+    total_grams, files, grams = llegides
+    valors_sub, alergens_sub = _panells_subreceptes(conn, subreceptes, en_curs, matriu)
+
+    # Suma ponderada: (grams / 100) x matriu[files]; al·lèrgens: OR de les màscares
+    if files:
+        totals = np.asarray(grams) @ _valors_files(matriu, valors_sub, files) / 100.0
+        alergens = int(np.bitwise_or.reduce(_alergens_files(matriu, alergens_sub, files)))
+    else:
+        totals = np.zeros(len(NUTRIENTS))
+        alergens = 0
+
+    return Panell.des_de_totals(totals, total_grams, alergens)
+
+
+def valors_codis(codis: list[str], conn: sqlite3.Connection | None = None):
+    # Nutrients per 100 g (n, 9) i màscara d'al·lèrgens (n,) de cada codi, sigui
+    # ingredient o subrecepta. KeyError amb el codi si n'hi ha algun de desconegut.
+    matriu = obtenir_matriu()
+    subreceptes: dict[int, int] = {}
+    files = []
+    for codi in codis:
+        fila = matriu.index.get(codi)
+        if fila is None:
+            sub_id = id_subrecepta(codi)
+            if sub_id is None:
+                raise KeyError(codi)
+            fila = len(matriu.codis) + subreceptes.setdefault(sub_id, len(subreceptes))
+        files.append(fila)
+
+    valors_sub, alergens_sub = _panells_subreceptes(conn, subreceptes, frozenset())
+    if not files:
+        return np.zeros((0, len(NUTRIENTS))), np.zeros(0, dtype=np.int64)
+    return _valors_files(matriu, valors_sub, files), _alergens_files(matriu, alergens_sub, files)
+
+
+@cronometrat("formulacions")
+def avaluar_formulacions(valors: np.ndarray, alergens: np.ndarray, grams: np.ndarray) -> LotPanells:
+    # Moltes formulacions de les mateixes línies d'un cop: grams (k, n) x valors (n, 9)
+    grams = np.asarray(grams, dtype=np.float64)
+    presents = np.where(grams > 0, alergens[None, :], 0)
+    mascares = np.bitwise_or.reduce(presents, axis=1) if grams.shape[1] else np.zeros(len(grams), dtype=np.int64)
+    return LotPanells.des_de_totals(grams @ valors / 100.0, grams.sum(axis=1), mascares)
+
+
+@cronometrat("nutricio_lot")
+def calcular_nutricio_lot(receptes: list[dict]) -> list[dict]:
+    # Cada recepta: {"linies": [{"codi", "grams"}, ...], "racio_g": opcional}
+    matriu = obtenir_matriu()
+
+    pesos_totals = np.zeros(len(receptes))
+    files_recepta = []
+    files_matriu = []
+    grams = []
+    subreceptes: dict[int, int] = {}
+    for i, recepta in enumerate(receptes):
+        llegides = _llegir_linies(recepta.get("linies"), matriu, subreceptes)
+        if llegides is None:
+            continue
+
+        total_grams, files, grams_linies = llegides
+        pesos_totals[i] = total_grams
+        files_recepta.extend([i] * len(files))
+        files_matriu.extend(files)
+        grams.extend(grams_linies)
+
+    # Matriu dispersa receptes x ingredients (format COO) per la matriu de nutrients
+    n_receptes = len(receptes)
+    totals = np.zeros((n_receptes, len(NUTRIENTS)))
+    alergens = np.zeros(n_receptes, dtype=np.int64)
+    if files_matriu:
+        # Cada subrecepta es calcula un sol cop encara que surti a moltes receptes
+        valors_sub, alergens_sub = _panells_subreceptes(None, subreceptes, frozenset())
+        files_recepta = np.asarray(files_recepta, dtype=np.intp)
+        aportacions = (np.asarray(grams) / 100.0)[:, None] * _valors_files(
+            matriu, valors_sub, files_matriu
+        )
+        for j in range(len(NUTRIENTS)):
+            totals[:, j] = np.bincount(
+                files_recepta, weights=aportacions[:, j], minlength=n_receptes
+            )
+        np.bitwise_or.at(alergens, files_recepta, _alergens_files(matriu, alergens_sub, files_matriu))
+
+    lot = LotPanells.des_de_totals(totals, pesos_totals, alergens)
+    racions = lot.racions([recepta.get("racio_g") for recepta in receptes])
+    return [
+        {"resultat": panell, "resultat_racio": racio}
+        for panell, racio in zip(lot, racions)
+    ]
+
+
+def assegurar_taules(conn: sqlite3.Connection):
+    if not existeix_taula(conn, "receptes") or not existeix_taula(conn, "recepta_linies"):
+        return
+
+    cols = ",\n".join(f"            {c} REAL" for c in COLS_100G)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS recepta_nutricio (
+            recepta_id INTEGER PRIMARY KEY,
+            pes_total_g REAL NOT NULL,
+{cols},
+            alergens_bits INTEGER NOT NULL DEFAULT 0,
+            versio_ingredients INTEGER NOT NULL,
+            calculat_el TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+            FOREIGN KEY (recepta_id) REFERENCES receptes(id) ON DELETE CASCADE
+        );
+    """)
+    cols_nutricio = [r[1] for r in conn.execute("PRAGMA table_info(recepta_nutricio);").fetchall()]
+    if "alergens_bits" not in cols_nutricio:
+        # Els panells desats abans no tenen al·lèrgens: es recalcularan quan calgui
+        conn.execute("ALTER TABLE recepta_nutricio ADD COLUMN alergens_bits INTEGER NOT NULL DEFAULT 0;")
+        conn.execute("DELETE FROM recepta_nutricio;")
+    # Versió d'ingredients amb què es va calcular cada recepta en guardar-la
+    cols_receptes = [r[1] for r in conn.execute("PRAGMA table_info(receptes);").fetchall()]
+    if "versio_ingredients" not in cols_receptes:
+        conn.execute("ALTER TABLE receptes ADD COLUMN versio_ingredients INTEGER;")
+    # "Receptes sense X" es resol llegint només aquest índex
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_recepta_nutricio_alergens
+        ON recepta_nutricio(alergens_bits, recepta_id);
+    """)
+
+    # Receptes guardades usades com a línia d'una altra recepta (bases, cremes...)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recepta_subreceptes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recepta_id INTEGER NOT NULL,
+            subrecepta_id INTEGER NOT NULL,
+            grams REAL NOT NULL,
+            FOREIGN KEY (recepta_id) REFERENCES receptes(id) ON DELETE CASCADE,
+            FOREIGN KEY (subrecepta_id) REFERENCES receptes(id)
+        );
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_recepta_subreceptes_recepta_id
+        ON recepta_subreceptes(recepta_id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_recepta_subreceptes_subrecepta
+        ON recepta_subreceptes(subrecepta_id, recepta_id);
+    """)
+
+    # Índex invers ingredient -> receptes per invalidar només el que toca
+    ing_col = recepta_linies_ingredient_col(conn)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_recepta_linies_ingredient
+        ON recepta_linies({ing_col}, recepta_id);
+    """)
+    conn.commit()
+
+
+def linies_recepta(conn: sqlite3.Connection, recepta_id: int) -> list[dict]:
+    # Línies d'ingredient i de subrecepta ("R:<id>") d'una recepta guardada
+    ing_col = recepta_linies_ingredient_col(conn)
+    linies = [
+        {"codi": r[0], "grams": r[1]}
+        for r in conn.execute(
+            f"SELECT {ing_col}, grams FROM recepta_linies WHERE recepta_id = ? ORDER BY id",
+            (recepta_id,),
+        )
+    ]
+    linies.extend(
+        {"codi": f"{PREFIX_SUBRECEPTA}{r[0]}", "grams": r[1]}
+        for r in conn.execute(
+            "SELECT subrecepta_id, grams FROM recepta_subreceptes WHERE recepta_id = ? ORDER BY id",
+            (recepta_id,),
+        )
+    )
+    return linies
+
+
+def desar_nutricio_recepta(
+    conn: sqlite3.Connection,
+    recepta_id: int,
+    linies,
+    en_curs: frozenset = frozenset(),
+    matriu: MatriuNutrients | None = None,
+) -> Panell | None:
+    # No fa commit: s'ha de cridar dins la transacció que desa la recepta
+    matriu = matriu or obtenir_matriu()
+    resultat = calcular_nutricio_per_100g(linies, matriu, conn, en_curs | {recepta_id})
+    if resultat is None:
+        conn.execute("DELETE FROM recepta_nutricio WHERE recepta_id = ?", (recepta_id,))
+        return None
+
+    # Es desen els valors sense arrodonir: les subreceptes en parteixen
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO recepta_nutricio (
+            recepta_id, pes_total_g, {', '.join(COLS_100G)}, alergens_bits, versio_ingredients
+        )
+        VALUES (?, ?, {', '.join('?' * len(COLS_100G))}, ?, ?)
+        """,
+        (
+            recepta_id,
+            resultat.pes,
+            *resultat.valors.tolist(),
+            resultat.bits,
+            matriu.versio,
+        ),
+    )
+    return resultat
+
+
+def _nutricio_recepta(conn: sqlite3.Connection, recepta_id: int, en_curs: frozenset) -> Panell | None:
+    # El panell desat fa de memòria per a cada subrecepta; només recalculem el que falta
+    if recepta_id in en_curs:
+        raise ValueError(f"Cicle de subreceptes: la recepta {recepta_id} s'inclou a si mateixa.")
+
+    row = conn.execute(
+        f"""
+        SELECT pes_total_g, alergens_bits, {', '.join(COLS_100G)}
+        FROM recepta_nutricio
+        WHERE recepta_id = ?
+        """,
+        (recepta_id,),
+    ).fetchone()
+    if row is not None:
+        return Panell([v if v is not None else 0.0 for v in row[2:]], row[0], row[1])
+
+    return desar_nutricio_recepta(conn, recepta_id, linies_recepta(conn, recepta_id), en_curs)
+
+
+def nutricio_recepta(conn: sqlite3.Connection, recepta_id: int) -> Panell | None:
+    resultat = _nutricio_recepta(conn, recepta_id, frozenset())
+    if conn.in_transaction:
+        conn.commit()
+    return resultat
+
+
+def _nutricio_historica(
+    conn: sqlite3.Connection, recepta_id: int, matriu: MatriuNutrients, en_curs: frozenset
+) -> Panell | None:
+    # Sense passar per recepta_nutricio: el panell desat és el de la versió actual
+    if recepta_id in en_curs:
+        raise ValueError(f"Cicle de subreceptes: la recepta {recepta_id} s'inclou a si mateixa.")
+    return calcular_nutricio_per_100g(linies_recepta(conn, recepta_id), matriu, conn, en_curs | {recepta_id})
+
+
+def nutricio_recepta_original(conn: sqlite3.Connection, recepta_id: int) -> tuple[Panell | None, int | None]:
+    # Panell amb les fitxes d'ingredient de la versió amb què es va guardar la recepta.
+    # Les receptes anteriors a l'historial no tenen versió: es calculen amb l'actual.
+    row = conn.execute("SELECT versio_ingredients FROM receptes WHERE id = ?", (recepta_id,)).fetchone()
+    if row is None or row[0] is None:
+        return nutricio_recepta(conn, recepta_id), None
+    return _nutricio_historica(conn, recepta_id, obtenir_matriu_versio(row[0]), frozenset()), row[0]
+
+
+def recalcular_receptes(progres=None, mida_lot: int = 100) -> dict:
+    # Torna a calcular i desar la nutrició de totes les receptes guardades. Un commit
+    # per lot: la BD no queda bloquejada per escriptura durant tot el recàlcul.
+    conn = get_db_connection()
+    try:
+        ids = [r[0] for r in conn.execute("SELECT id FROM receptes ORDER BY id")]
+        amb_error = []
+        for i in range(0, len(ids), mida_lot):
+            for recepta_id in ids[i:i + mida_lot]:
+                try:
+                    desar_nutricio_recepta(conn, recepta_id, linies_recepta(conn, recepta_id))
+                except ValueError:
+                    amb_error.append(recepta_id)
+            conn.commit()
+            if progres:
+                progres(min(i + mida_lot, len(ids)), len(ids))
+    finally:
+        conn.close()
+    return {"receptes": len(ids), "amb_error": amb_error}
+
+
+def _invalidar(conn: sqlite3.Connection, origen_sql: str, params) -> int:
+    # Esborra la nutrició de les receptes d'origen i de totes les que les fan servir
+    # com a subrecepta (a qualsevol nivell). UNION evita voltes infinites si hi ha cicles.
+    abans = conn.total_changes
+    conn.execute(
+        f"""
+        WITH RECURSIVE afectades(id) AS (
+            {origen_sql}
+            UNION
+            SELECT s.recepta_id
+            FROM recepta_subreceptes s
+            JOIN afectades a ON s.subrecepta_id = a.id
+        )
+        DELETE FROM recepta_nutricio
+        WHERE recepta_id IN (SELECT id FROM afectades)
+        """,
+        params,
+    )
+    return conn.total_changes - abans
+
+
+def invalidar_receptes_per_ingredients(conn: sqlite3.Connection, codis) -> int:
+    # Esborra la nutrició desada de les receptes que fan servir algun d'aquests codis,
+    # directament o a través d'una subrecepta. No fa commit: l'importador ho fa dins
+    # la seva transacció.
+    if not existeix_taula(conn, "recepta_nutricio"):
+        return 0
+
+    ing_col = recepta_linies_ingredient_col(conn)
+    codis = list(codis)
+    invalidades = 0
+    for i in range(0, len(codis), 500):
+        tros = codis[i:i + 500]
+        marques = ", ".join("?" * len(tros))
+        invalidades += _invalidar(
+            conn,
+            f"SELECT recepta_id FROM recepta_linies WHERE {ing_col} IN ({marques})",
+            tros,
+        )
+    return invalidades
+
+
+def invalidar_dependents(conn: sqlite3.Connection, recepta_ids) -> int:
+    # Per quan canvia una base: ella i les receptes que la contenen. No fa commit.
+    recepta_ids = list(recepta_ids)
+    if not recepta_ids:
+        return 0
+    marques = ", ".join("?" * len(recepta_ids))
+    return _invalidar(conn, f"SELECT id FROM receptes WHERE id IN ({marques})", recepta_ids)
+
+
+def receptes_sense_alergens(conn: sqlite3.Connection, mascara: int) -> list[sqlite3.Row]:
+    # Receptes que no contenen cap dels al·lèrgens de `mascara`. Abans materialitzem
+    # les que no tenen panell desat; després només es llegeix idx_recepta_nutricio_alergens.
+    pendents = conn.execute(
+        """
+        SELECT id FROM receptes
+        WHERE id NOT IN (SELECT recepta_id FROM recepta_nutricio)
+        """
+    ).fetchall()
+    for r in pendents:
+        try:
+            _nutricio_recepta(conn, r[0], frozenset())
+        except ValueError:
+            pass  # una recepta amb cicle no es pot declarar lliure de res
+    if conn.in_transaction:
+        conn.commit()
+
+    return conn.execute(
+        """
+        SELECT r.id, r.nom, n.alergens_bits
+        FROM recepta_nutricio n
+        JOIN receptes r ON r.id = n.recepta_id
+        WHERE n.alergens_bits & ? = 0
+        ORDER BY r.nom
+        """,
+        (mascara,),
+    ).fetchall()
@@ -0,0 +1,182 @@
+# panell.py
+import math
+from collections.abc import Mapping
+
+import numpy as np
+
+from alergens import claus_alergens
+
+
+# Ordre fix de les columnes de la matriu (mateix ordre que a la taula ingredients)
+NUTRIENTS = [
+    "energia_kcal",
+    "energia_kj",
+    "greixos",
+    "greixos_saturats",
+    "hidrats_carboni",
+    "sucres",
+    "proteines",
+    "fibra",
+    "sal",
+]
+
+COLS_100G = [f"{n}_100g" for n in NUTRIENTS]
+
+_COLUMNA = {col: j for j, col in enumerate(COLS_100G)}
+_CLAUS = ["pes_total_g", *COLS_100G, "alergens_bits", "alergens"]
+
+# Decimals amb què es presenten els valors (plantilles, JSON, PDF)
+DECIMALS = 2
+
+
+def _arrodonits(valors: np.ndarray) -> list[float]:
+    return [round(v, DECIMALS) for v in valors.tolist()]
+
+
+def racio_valida(racio_g) -> float:
+    # Grams de la ració, o 0.0 si no n'hi ha cap de vàlida ("inf" i "nan" tampoc:
+    # donarien Infinity/NaN al JSON, que no és JSON vàlid)
+    try:
+        racio_g = float(racio_g or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    if not math.isfinite(racio_g) or racio_g <= 0:
+        return 0.0
+    return racio_g
+
+
+# Panell nutricional per 100 g d'una recepta: els 9 nutrients en un vector float64
+# sense arrodonir, el pes total i la màscara d'al·lèrgens. Es llegeix com el dict
+# d'abans (panell["sucres_100g"], dict(panell)), ja arrodonit: l'arrodoniment només
+# es fa en presentar-lo.
+class Panell(Mapping):
+    __slots__ = ("valors", "pes", "bits")
+
+    def __init__(self, valors, pes: float, bits: int = 0):
+        self.valors = np.asarray(valors, dtype=np.float64)
+        self.pes = float(pes)
+        self.bits = int(bits)
+
+    @classmethod
+    def des_de_totals(cls, totals, pes: float, bits: int = 0) -> "Panell":
+        # `totals`: grams (o kcal, kJ) de cada nutrient a tota la recepta
+        return cls(np.asarray(totals, dtype=np.float64) * (100.0 / pes), pes, bits)
+
+    @property
+    def totals(self) -> np.ndarray:
+        return self.valors * (self.pes / 100.0)
+
+    def __add__(self, altre: "Panell") -> "Panell":
+        # Barrejar dues receptes senceres: es sumen els totals i els pesos
+        if not isinstance(altre, Panell):
+            return NotImplemented
+        pes = self.pes + altre.pes
+        if pes <= 0:
+            return Panell(np.zeros(len(NUTRIENTS)), 0.0, self.bits | altre.bits)
+        return Panell.des_de_totals(self.totals + altre.totals, pes, self.bits | altre.bits)
+
+    def escalat(self, factor: float) -> "Panell":
+        # La mateixa recepta multiplicada: canvia el pes, no els valors per 100 g
+        return Panell(self.valors, self.pes * factor, self.bits)
+
+    __mul__ = __rmul__ = escalat
+
+    def per_racio(self, racio_g: float) -> np.ndarray:
+        return self.valors * (racio_g / 100.0)
+
+    def racio(self, racio_g) -> dict | None:
+        racio_g = racio_valida(racio_g)
+        if racio_g <= 0:
+            return None
+        resultat = {"racio_g": round(racio_g, DECIMALS)}
+        resultat.update(zip(NUTRIENTS, _arrodonits(self.per_racio(racio_g))))
+        return resultat
+
+    def a_dict(self) -> dict:
+        # El mateix que dict(panell), d'una passada (JSON, claus de memòria cau)
+        resultat = {"pes_total_g": round(self.pes, DECIMALS)}
+        resultat.update(zip(COLS_100G, _arrodonits(self.valors)))
+        resultat["alergens_bits"] = self.bits
+        resultat["alergens"] = claus_alergens(self.bits)
+        return resultat
+
+    def __getitem__(self, clau):
+        j = _COLUMNA.get(clau)
+        if j is not None:
+            return round(float(self.valors[j]), DECIMALS)
+        if clau == "pes_total_g":
+            return round(self.pes, DECIMALS)
+        if clau == "alergens_bits":
+            return self.bits
+        if clau == "alergens":
+            return claus_alergens(self.bits)
+        raise KeyError(clau)
+
+    def __iter__(self):
+        return iter(_CLAUS)
+
+    def __len__(self) -> int:
+        return len(_CLAUS)
+
+    def __repr__(self) -> str:
+        return f"Panell({self.a_dict()!r})"
+
+
+# Molts panells apilats: valors (k, 9), pesos (k,) i màscares (k,). Les receptes
+# sense pes (no calculables) tenen pes 0 i surten com a None.
+class LotPanells:
+    __slots__ = ("valors", "pesos", "bits")
+
+    def __init__(self, valors, pesos, bits=None):
+        self.pesos = np.asarray(pesos, dtype=np.float64)
+        self.valors = np.asarray(valors, dtype=np.float64).reshape(len(self.pesos), len(NUTRIENTS))
+        self.bits = (
+            np.zeros(len(self.pesos), dtype=np.int64) if bits is None
+            else np.asarray(bits, dtype=np.int64)
+        )
+
+    @classmethod
+    def des_de_totals(cls, totals, pesos, bits=None) -> "LotPanells":
+        totals = np.asarray(totals, dtype=np.float64)
+        pesos = np.asarray(pesos, dtype=np.float64)
+        valors = np.divide(
+            totals * 100.0, pesos[:, None],
+            out=np.zeros_like(totals), where=pesos[:, None] > 0,
+        )
+        return cls(valors, pesos, bits)
+
+    @classmethod
+    def apilar(cls, panells) -> "LotPanells":
+        panells = list(panells)
+        if not panells:
+            return cls(np.zeros((0, len(NUTRIENTS))), [])
+        return cls(
+            np.stack([p.valors if p is not None else np.zeros(len(NUTRIENTS)) for p in panells]),
+            [p.pes if p is not None else 0.0 for p in panells],
+            [p.bits if p is not None else 0 for p in panells],
+        )
+
+    def __len__(self) -> int:
+        return len(self.pesos)
+
+    def __getitem__(self, i: int) -> Panell | None:
+        if self.pesos[i] <= 0:
+            return None
+        return Panell(self.valors[i], self.pesos[i], self.bits[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def per_racio(self, racions) -> np.ndarray:
+        # racions (k,) en grams -> valors per ració (k, 9)
+        return self.valors * (np.asarray(racions, dtype=np.float64)[:, None] / 100.0)
+
+    def racions(self, racions) -> list[dict | None]:
+        # Dicts per ració de tot el lot, a partir d'una sola multiplicació (k, 9)
+        racions = np.array([racio_valida(r) for r in racions], dtype=np.float64)
+        per_racio = self.per_racio(racions)
+        return [
+            {"racio_g": round(float(r), DECIMALS), **dict(zip(NUTRIENTS, _arrodonits(fila)))}
+            if r > 0 and pes > 0 else None
+            for r, pes, fila in zip(racions, self.pesos, per_racio)
+        ]
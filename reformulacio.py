@@ -0,0 +1,149 @@
+# reformulacio.py
+import numpy as np
+from scipy.optimize import linprog
+
+from metriques import cronometrat
+from nutricio import COLS_100G, avaluar_formulacions, calcular_nutricio_per_100g, valors_codis
+
+
+# Marge per decidir si un candidat compleix un objectiu (errors d'arrodoniment)
+TOLERANCIA = 1e-6
+MAX_CANDIDATS = 10_000
+
+
+def _columna(nutrient: str) -> int:
+    # "sucres" o "sucres_100g" -> índex de columna; ValueError si no existeix
+    col = nutrient if nutrient.endswith("_100g") else f"{nutrient}_100g"
+    if col not in COLS_100G:
+        raise ValueError(f"Nutrient desconegut: '{nutrient}'. Valors possibles: {', '.join(COLS_100G)}")
+    return COLS_100G.index(col)
+
+
+def llegir_objectius(objectius) -> list[tuple[int, str, float]]:
+    # {"sucres": {"max": 5}, "sal": {"max": 0.3}, "proteines": {"min": 8}}
+    # -> [(columna, "max" | "min", valor per 100 g), ...]
+    if not isinstance(objectius, dict):
+        raise ValueError("'objectius' ha de ser un objecte {nutrient: {max, min}}.")
+    resultat = []
+    for nutrient, limits in objectius.items():
+        j = _columna(str(nutrient))
+        if not isinstance(limits, dict) or not ({"max", "min"} & limits.keys()):
+            raise ValueError(f"L'objectiu de '{nutrient}' ha de tenir 'max' o 'min'.")
+        for tipus in ("max", "min"):
+            if limits.get(tipus) is not None:
+                try:
+                    resultat.append((j, tipus, float(limits[tipus])))
+                except (TypeError, ValueError):
+                    raise ValueError(f"Valor no numèric a l'objectiu '{nutrient}.{tipus}'.")
+    return resultat
+
+
+def _limits_linia(linia: dict, grams: float) -> tuple[float, float | None]:
+    if linia.get("fixe"):
+        return grams, grams
+    try:
+        minim = float(linia.get("min") or 0)
+        maxim = float(linia["max"]) if linia.get("max") is not None else None
+    except (TypeError, ValueError):
+        raise ValueError(f"Límits no numèrics a la línia '{linia.get('codi')}'.")
+    if minim < 0 or (maxim is not None and maxim < minim):
+        raise ValueError(f"Límits incoherents a la línia '{linia.get('codi')}'.")
+    return minim, maxim
+
+
+@cronometrat("reformulacio")
+def reformular(linies: list[dict], objectius, pes_total=None) -> dict:
+    # Programa lineal: variables g_i (grams de cada línia) i d_i >= |g_i - g0_i|.
+    # Minimitzem sum(d_i), és a dir, la recepta que compleix els objectius tocant
+    # el mínim de grams respecte de l'original.
+    #
+    # Un objectiu per 100 g és lineal si el multipliquem pel pes total:
+    #   sum(g_i v_ij) / sum(g_i) <= t_j   <=>   sum(g_i (v_ij - t_j)) <= 0
+    codis = [l["codi"].strip() for l in linies]
+    try:
+        originals = np.array([float(l.get("grams") or 0) for l in linies])
+    except (TypeError, ValueError):
+        raise ValueError("Hi ha línies amb grams no numèrics.")
+    if not len(codis) or (originals < 0).any():
+        raise ValueError("Cal almenys una línia i cap amb grams negatius.")
+
+    valors, _ = valors_codis(codis)  # KeyError si algun codi no existeix
+    restriccions = llegir_objectius(objectius)
+    n = len(codis)
+
+    files_ub, b_ub = [], []
+    for i in range(n):
+        # g_i - d_i <= g0_i  i  -g_i - d_i <= -g0_i
+        fila = np.zeros(2 * n)
+        fila[i], fila[n + i] = 1.0, -1.0
+        files_ub.append(fila)
+        b_ub.append(originals[i])
+        fila = np.zeros(2 * n)
+        fila[i], fila[n + i] = -1.0, -1.0
+        files_ub.append(fila)
+        b_ub.append(-originals[i])
+    for j, tipus, objectiu in restriccions:
+        signe = 1.0 if tipus == "max" else -1.0
+        files_ub.append(np.concatenate([signe * (valors[:, j] - objectiu), np.zeros(n)]))
+        b_ub.append(0.0)
+
+    pes = float(pes_total) if pes_total is not None else float(originals.sum())
+    if pes <= 0:
+        raise ValueError("El pes total ha de ser positiu.")
+
+    limits = [_limits_linia(l, g) for l, g in zip(linies, originals)] + [(0, None)] * n
+    solucio = linprog(
+        c=np.concatenate([np.zeros(n), np.ones(n)]),
+        A_ub=np.vstack(files_ub), b_ub=b_ub,
+        A_eq=np.concatenate([np.ones(n), np.zeros(n)])[None, :], b_eq=[pes],
+        bounds=limits,
+        method="highs",
+    )
+
+    if solucio.status != 0:
+        return {
+            "estat": "infactible" if solucio.status == 2 else "error",
+            "missatge": solucio.message,
+            "linies": None,
+            "resultat": None,
+        }
+
+    grams = np.round(solucio.x[:n], 2)
+    noves = [
+        {**l, "grams_original": round(float(g0), 2), "grams": float(g)}
+        for l, g0, g in zip(linies, originals, grams)
+    ]
+    return {
+        "estat": "optim",
+        "canvi_total_g": round(float(np.abs(grams - originals).sum()), 2),
+        "linies": noves,
+        "resultat": calcular_nutricio_per_100g(noves),
+    }
+
+
+def avaluar_candidats(codis: list[str], candidats, objectius=None) -> list[dict]:
+    # Totes les formulacions alternatives (mateixes línies, grams diferents) en una
+    # sola multiplicació de matrius, amb la indicació de si compleixen els objectius
+    grams = np.asarray(candidats, dtype=np.float64)
+    if grams.ndim != 2 or grams.shape[1] != len(codis):
+        raise ValueError(f"Cada candidat ha de tenir {len(codis)} valors de grams, un per codi.")
+    if len(grams) > MAX_CANDIDATS:
+        raise ValueError(f"Com a màxim es poden avaluar {MAX_CANDIDATS} candidats d'un cop.")
+    if (grams < 0).any():
+        raise ValueError("Hi ha candidats amb grams negatius.")
+
+    valors, alergens = valors_codis(codis)
+    restriccions = llegir_objectius(objectius or {})
+    lot = avaluar_formulacions(valors, alergens, grams)
+
+    compleix = lot.pesos > 0
+    for j, tipus, objectiu in restriccions:
+        if tipus == "max":
+            compleix &= lot.valors[:, j] <= objectiu + TOLERANCIA
+        else:
+            compleix &= lot.valors[:, j] >= objectiu - TOLERANCIA
+
+    return [
+        {"resultat": panell, "compleix": bool(ok)}
+        for panell, ok in zip(lot, compleix)
+    ]
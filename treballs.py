@@ -0,0 +1,266 @@
+# treballs.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bd import get_db_connection
+from metriques import mesurar
+
+
+BASE_DIR = Path(__file__).resolve().parent
+# Fitxers pujats i resultats (PDF, ZIP) dels treballs
+DIR_TREBALLS = BASE_DIR / "dades" / "treballs"
+
+
+def _enter(nom: str, per_defecte: int) -> int:
+    try:
+        return int(os.environ.get(nom, per_defecte))
+    except ValueError:
+        return per_defecte
+
+
+# Treballs que corren alhora en cada procés; la resta esperen a la cua
+MAX_TREBALLS = max(1, _enter("MASGRAU_TREBALLS", 1))
+# Com a molt un cop cada tants segons desem el progrés a la BD
+INTERVAL_PROGRES = 0.5
+# Els treballs acabats (i els seus fitxers) s'eliminen passat aquest temps
+TTL_TREBALLS = 24 * 3600
+# Cada quant (com a molt) passem l'escombra de treballs caducats
+INTERVAL_NETEJA = 10 * 60
+
+_darrera_neteja = 0.0
+
+# tipus -> funció(treball_id, parametres, progres) -> dict amb el resultat
+_tipus: dict = {}
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid = os.getpid()
+_executor_lock = threading.Lock()
+
+
+def registrar(tipus: str):
+    def decorador(funcio):
+        _tipus[tipus] = funcio
+        return funcio
+    return decorador
+
+
+def assegurar_taules(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS treballs (
+            id TEXT PRIMARY KEY,
+            tipus TEXT NOT NULL,
+            estat TEXT NOT NULL DEFAULT 'pendent',
+            parametres TEXT NOT NULL DEFAULT '{}',
+            fets INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            resultat TEXT,
+            error TEXT,
+            pid INTEGER,
+            proces TEXT,
+            creat_el TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+            iniciat_el TEXT,
+            acabat_el TEXT
+        );
+    """)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(treballs);").fetchall()]
+    if "proces" not in cols:
+        conn.execute("ALTER TABLE treballs ADD COLUMN proces TEXT;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_treballs_creat ON treballs(creat_el);")
+    conn.commit()
+
+
+def _inici_proces(pid: int) -> str:
+    # Moment d'arrencada del procés (camp 22 de /proc/<pid>/stat, en tics des de
+    # l'engegada). On no hi ha /proc, cadena buida: només comptarà el pid.
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii", errors="replace") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+
+
+def identitat_proces(pid: int | None = None) -> str:
+    # pid + moment d'arrencada: un pid reutilitzat per un altre procés no hi coincideix
+    pid = pid or os.getpid()
+    return f"{pid}:{_inici_proces(pid)}"
+
+
+def _proces_viu(pid, proces) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # Els treballs d'abans de desar la identitat només tenen el pid
+    return not proces or proces == identitat_proces(pid)
+
+
+def marcar_interromputs(conn: sqlite3.Connection) -> int:
+    # Treballs d'un procés que ja no existeix (reinici, worker reciclat): no acabaran mai
+    pendents = conn.execute(
+        "SELECT id, pid, proces FROM treballs WHERE estat IN ('pendent', 'en_curs');"
+    ).fetchall()
+    morts = [(r[0],) for r in pendents if not _proces_viu(r[1], r[2])]
+    if morts:
+        conn.executemany(
+            """
+            UPDATE treballs
+            SET estat = 'error', error = 'Interromput: el procés que el portava s''ha aturat.',
+                acabat_el = datetime('now','localtime')
+            WHERE id = ?;
+            """,
+            morts,
+        )
+    conn.commit()
+    return len(morts)
+
+
+def en_iniciar_worker():
+    # Des del post_fork de gunicorn: cada worker nou (també el que substitueix un de
+    # reciclat per max_requests) marca els treballs que s'han quedat sense procés
+    conn = get_db_connection()
+    try:
+        marcar_interromputs(conn)
+    finally:
+        conn.close()
+
+
+def _escombrar(conn: sqlite3.Connection):
+    # Treballs acabats fa més de TTL_TREBALLS i fitxers vells de dades/treballs
+    # (resultats, i Excels pujats d'un treball que no va arribar a córrer)
+    global _darrera_neteja
+    ara = time.time()
+    if ara - _darrera_neteja < INTERVAL_NETEJA:
+        return
+    _darrera_neteja = ara
+
+    conn.execute(
+        """
+        DELETE FROM treballs
+        WHERE estat IN ('fet', 'error') AND acabat_el < datetime('now', 'localtime', ?);
+        """,
+        (f"-{TTL_TREBALLS} seconds",),
+    )
+    conn.commit()
+    if DIR_TREBALLS.exists():
+        for path in DIR_TREBALLS.iterdir():
+            try:
+                if path.is_file() and path.stat().st_mtime < ara - TTL_TREBALLS:
+                    path.unlink()
+            except OSError:
+                pass  # un altre procés l'ha esborrat abans
+
+
+def _executor_del_proces() -> ThreadPoolExecutor:
+    # Cada procés (worker de gunicorn) té la seva cua; no es comparteix després d'un fork
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=MAX_TREBALLS, thread_name_prefix="treball")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _actualitzar(treball_id: str, **camps):
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            f"UPDATE treballs SET {', '.join(f'{c} = ?' for c in camps)} WHERE id = ?;",
+            (*camps.values(), treball_id),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class _Progres:
+    def __init__(self, treball_id: str):
+        self.treball_id = treball_id
+        self.darrer = 0.0
+
+    def __call__(self, fets: int, total: int):
+        ara = time.monotonic()
+        if fets < total and ara - self.darrer < INTERVAL_PROGRES:
+            return
+        self.darrer = ara
+        _actualitzar(self.treball_id, fets=int(fets), total=int(total))
+
+
+def _executar(treball_id: str, tipus: str, parametres: dict):
+    _actualitzar(treball_id, estat="en_curs", iniciat_el=time.strftime("%Y-%m-%d %H:%M:%S"))
+    try:
+        with mesurar(f"treball_{tipus}"):
+            resultat = _tipus[tipus](treball_id, parametres, _Progres(treball_id))
+    except Exception as e:
+        _actualitzar(
+            treball_id, estat="error", error=f"{type(e).__name__}: {e}",
+            acabat_el=time.strftime("%Y-%m-%d %H:%M:%S"),
+        )
+        return
+    _actualitzar(
+        treball_id, estat="fet", resultat=json.dumps(resultat or {}, ensure_ascii=False, default=str),
+        acabat_el=time.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def nou_id() -> str:
+    return uuid.uuid4().hex
+
+
+def encuar(tipus: str, parametres: dict, treball_id: str | None = None) -> str:
+    # `treball_id` permet desar abans els fitxers del treball (vegeu fitxer())
+    if tipus not in _tipus:
+        raise ValueError(f"Tipus de treball desconegut: '{tipus}'.")
+
+    treball_id = treball_id or nou_id()
+    conn = get_db_connection()
+    try:
+        _escombrar(conn)
+        conn.execute(
+            "INSERT INTO treballs (id, tipus, parametres, pid, proces) VALUES (?, ?, ?, ?, ?);",
+            (treball_id, tipus, json.dumps(parametres, ensure_ascii=False), os.getpid(), identitat_proces()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    _executor_del_proces().submit(_executar, treball_id, tipus, parametres)
+    return treball_id
+
+
+def _a_dict(row: sqlite3.Row) -> dict:
+    treball = dict(row)
+    treball["parametres"] = json.loads(treball["parametres"] or "{}")
+    treball["resultat"] = json.loads(treball["resultat"]) if treball["resultat"] else None
+    treball["percentatge"] = (
+        100.0 if treball["estat"] == "fet"
+        else round(100.0 * treball["fets"] / treball["total"], 1) if treball["total"] else 0.0
+    )
+    return treball
+
+
+def obtenir(conn: sqlite3.Connection, treball_id: str) -> dict | None:
+    row = conn.execute("SELECT * FROM treballs WHERE id = ?;", (treball_id,)).fetchone()
+    return _a_dict(row) if row is not None else None
+
+
+def llistar(conn: sqlite3.Connection, limit: int = 50) -> list[dict]:
+    return [
+        _a_dict(r) for r in conn.execute(
+            "SELECT * FROM treballs ORDER BY creat_el DESC, rowid DESC LIMIT ?;", (limit,)
+        )
+    ]
+
+
+def fitxer(treball_id: str, extensio: str) -> Path:
+    DIR_TREBALLS.mkdir(parents=True, exist_ok=True)
+    return DIR_TREBALLS / f"{treball_id}.{extensio}"
@@ -0,0 +1,137 @@
+# versions_ingredients.py
+import sqlite3
+
+from bd import incrementar_versio_ingredients, versio_ingredients
+
+
+# Columnes de la fitxa que guardem a cada versió: les que fan falta per refer
+# la nutrició i les etiquetes d'una recepta tal com es va calcular
+COLS_HISTORIC = [
+    "ingredient",
+    "alergens_bits",
+    "energia_kcal_100g",
+    "energia_kj_100g",
+    "greixos_100g",
+    "greixos_saturats_100g",
+    "hidrats_carboni_100g",
+    "sucres_100g",
+    "proteines_100g",
+    "fibra_100g",
+    "sal_100g",
+]
+
+
+def assegurar_taules(conn: sqlite3.Connection):
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(ingredients);").fetchall()]
+    if not cols:
+        return
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS versions_ingredients (
+            versio INTEGER PRIMARY KEY,
+            origen TEXT NOT NULL,
+            inserits INTEGER NOT NULL DEFAULT 0,
+            actualitzats INTEGER NOT NULL DEFAULT 0,
+            eliminats INTEGER NOT NULL DEFAULT 0,
+            publicada_el TEXT NOT NULL DEFAULT (datetime('now','localtime'))
+        );
+    """)
+    # Còpia en escriptura: cada versió només desa les fitxes que han canviat. La fitxa
+    # d'un codi a la versió V és la fila amb la versió més alta que no passi de V.
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS ingredients_historic (
+            codi TEXT NOT NULL,
+            versio INTEGER NOT NULL,
+            eliminat INTEGER NOT NULL DEFAULT 0,
+            {', '.join(f'{c} {"TEXT" if c == "ingredient" else "REAL"}' for c in COLS_HISTORIC)},
+            PRIMARY KEY (codi, versio)
+        ) WITHOUT ROWID;
+    """)
+
+    # Primer cop: la taula actual fa de versió inicial
+    if conn.execute("SELECT 1 FROM versions_ingredients LIMIT 1;").fetchone() is None:
+        versio = versio_ingredients(conn)
+        conn.execute(
+            "INSERT INTO versions_ingredients (versio, origen, inserits) "
+            "SELECT ?, 'inicial', COUNT(*) FROM ingredients;",
+            (versio,),
+        )
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO ingredients_historic (codi, versio, {', '.join(COLS_HISTORIC)})
+            SELECT codi, ?, {', '.join(COLS_HISTORIC)} FROM ingredients;
+            """,
+            (versio,),
+        )
+    conn.commit()
+
+
+def publicar_versio(
+    conn: sqlite3.Connection,
+    codis_canviats,
+    codis_eliminats,
+    origen: str,
+    inserits: int = 0,
+    actualitzats: int = 0,
+) -> int:
+    # S'ha de cridar dins la transacció que ha escrit els canvis a ingredients,
+    # just abans del commit: nova versió + còpia de les fitxes que han canviat
+    versio = incrementar_versio_ingredients(conn)
+    conn.execute(
+        """
+        INSERT INTO versions_ingredients (versio, origen, inserits, actualitzats, eliminats)
+        VALUES (?, ?, ?, ?, ?);
+        """,
+        (versio, origen, inserits, actualitzats, len(codis_eliminats)),
+    )
+
+    vius = [c for c in codis_canviats if c not in codis_eliminats]
+    for i in range(0, len(vius), 500):
+        tros = vius[i:i + 500]
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO ingredients_historic (codi, versio, {', '.join(COLS_HISTORIC)})
+            SELECT codi, ?, {', '.join(COLS_HISTORIC)}
+            FROM ingredients
+            WHERE codi IN ({', '.join('?' * len(tros))});
+            """,
+            (versio, *tros),
+        )
+    conn.executemany(
+        "INSERT OR REPLACE INTO ingredients_historic (codi, versio, eliminat) VALUES (?, ?, 1);",
+        [(c, versio) for c in codis_eliminats],
+    )
+    return versio
+
+
+def files_versio(conn: sqlite3.Connection, versio: int) -> list[sqlite3.Row]:
+    # Fitxes vigents a la versió indicada (codi + COLS_HISTORIC), ordenades per codi
+    return conn.execute(
+        f"""
+        SELECT h.codi, {', '.join(f'h.{c}' for c in COLS_HISTORIC)}
+        FROM ingredients_historic h
+        JOIN (
+            SELECT codi, MAX(versio) AS versio
+            FROM ingredients_historic
+            WHERE versio <= ?
+            GROUP BY codi
+        ) darrera ON darrera.codi = h.codi AND darrera.versio = h.versio
+        WHERE h.eliminat = 0
+        ORDER BY h.codi;
+        """,
+        (versio,),
+    ).fetchall()
+
+
+def llistar_versions(conn: sqlite3.Connection, limit: int = 50) -> list[dict]:
+    return [
+        dict(r) for r in conn.execute(
+            """
+            SELECT versio, origen, inserits, actualitzats, eliminats, publicada_el
+            FROM versions_ingredients
+            ORDER BY versio DESC
+            LIMIT ?;
+            """,
+            (limit,),
+        )
+    ]
@@ -0,0 +1,360 @@
+# versions_receptes.py
+import sqlite3
+
+from bd import existeix_taula, recepta_linies_ingredient_col
+from nutricio import (
+    COLS_100G,
+    PREFIX_SUBRECEPTA,
+    calcular_nutricio_lot,
+    desar_nutricio_recepta,
+    id_subrecepta,
+    invalidar_dependents,
+    linies_recepta,
+    obtenir_matriu,
+)
+
+
+# Cada tantes versions, com a molt, una es desa sencera (snapshot): refer qualsevol
+# versió és llegir un snapshot i com a molt SNAPSHOT_CADA - 1 deltes.
+SNAPSHOT_CADA = 8
+
+
+class CodisDesconeguts(ValueError):
+    # Línies amb un codi d'ingredient o una subrecepta ("R:<id>") que no existeix
+    def __init__(self, codis: list[str]):
+        super().__init__(f"Codis desconeguts: {', '.join(codis)}")
+        self.codis = codis
+
+
+def assegurar_taules(conn: sqlite3.Connection):
+    if not existeix_taula(conn, "receptes"):
+        return
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recepta_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recepta_id INTEGER NOT NULL,
+            numero INTEGER NOT NULL,
+            pare_id INTEGER,
+            es_snapshot INTEGER NOT NULL DEFAULT 0,
+            versio_ingredients INTEGER,
+            nota TEXT NOT NULL DEFAULT '',
+            creada_el TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+            UNIQUE (recepta_id, numero),
+            FOREIGN KEY (recepta_id) REFERENCES receptes(id) ON DELETE CASCADE,
+            FOREIGN KEY (pare_id) REFERENCES recepta_versions(id)
+        );
+    """)
+    # Snapshot: totes les línies. Delta: només les que canvien respecte del pare;
+    # grams NULL vol dir que la línia s'ha tret.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recepta_versio_linies (
+            versio_id INTEGER NOT NULL,
+            codi TEXT NOT NULL,
+            posicio INTEGER NOT NULL,
+            grams REAL,
+            PRIMARY KEY (versio_id, codi),
+            FOREIGN KEY (versio_id) REFERENCES recepta_versions(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+    """)
+    _registrar_inicials(conn)
+    conn.commit()
+
+
+def _registrar_inicials(conn: sqlite3.Connection):
+    # Les receptes sense cap versió (guardades abans de tenir versions, o fora de
+    # l'app) reben la 1: un snapshot de les seves línies actuals. Així les consultes
+    # de versions només llegeixen.
+    abans = conn.execute("SELECT COALESCE(MAX(id), 0) FROM recepta_versions").fetchone()[0]
+    conn.execute(
+        """
+        INSERT INTO recepta_versions (recepta_id, numero, pare_id, es_snapshot, versio_ingredients, nota)
+        SELECT r.id, 1, NULL, 1, r.versio_ingredients, ''
+        FROM receptes r
+        WHERE NOT EXISTS (SELECT 1 FROM recepta_versions v WHERE v.recepta_id = r.id)
+        ORDER BY r.id
+        """
+    )
+    # Com _linies_dict: codis repetits sumats, sense línies buides ni de 0 g
+    ing_col = recepta_linies_ingredient_col(conn)
+    conn.execute(
+        f"""
+        WITH linies(recepta_id, codi, grams, es_sub, ordre) AS (
+            SELECT recepta_id, TRIM({ing_col}), grams, 0, id FROM recepta_linies
+            UNION ALL
+            SELECT recepta_id, '{PREFIX_SUBRECEPTA}' || subrecepta_id, grams, 1, id FROM recepta_subreceptes
+        )
+        INSERT INTO recepta_versio_linies (versio_id, codi, posicio, grams)
+        SELECT v.id, l.codi,
+               ROW_NUMBER() OVER (PARTITION BY v.id ORDER BY MIN(l.es_sub), MIN(l.ordre)) - 1,
+               ROUND(SUM(l.grams), 2)
+        FROM recepta_versions v
+        JOIN linies l ON l.recepta_id = v.recepta_id
+        WHERE v.id > ? AND l.codi IS NOT NULL AND l.codi <> '' AND l.grams > 0
+        GROUP BY v.id, l.codi
+        """,
+        (abans,),
+    )
+
+
+def _linies_dict(linies) -> dict[str, float]:
+    # codi -> grams, en l'ordre de les línies (els codis repetits se sumen)
+    resultat: dict[str, float] = {}
+    for l in linies:
+        codi = l.get("codi")
+        if codi is not None and not isinstance(codi, str):
+            raise ValueError(f"El codi de cada línia ha de ser text (rebut: {codi!r}).")
+        codi = (codi or "").strip()
+        try:
+            grams = float(l.get("grams", 0) or 0)
+        except (TypeError, ValueError):
+            grams = 0.0
+        if codi and grams > 0:
+            resultat[codi] = round(resultat.get(codi, 0.0) + grams, 2)
+    return resultat
+
+
+def _codis_desconeguts(conn: sqlite3.Connection, codis) -> list[str]:
+    # Ingredients que no són a la matriu i subreceptes que no són a receptes
+    matriu = obtenir_matriu()
+    desconeguts, subreceptes = [], {}
+    for codi in codis:
+        if codi in matriu.index:
+            continue
+        sub_id = id_subrecepta(codi)
+        if sub_id is None:
+            desconeguts.append(codi)
+        else:
+            subreceptes[sub_id] = codi
+    if subreceptes:
+        existents = {
+            r[0] for r in conn.execute(
+                f"SELECT id FROM receptes WHERE id IN ({', '.join('?' * len(subreceptes))})",
+                list(subreceptes),
+            )
+        }
+        desconeguts.extend(c for i, c in subreceptes.items() if i not in existents)
+    return desconeguts
+
+
+def _darrera(conn: sqlite3.Connection, recepta_id: int) -> sqlite3.Row | None:
+    return conn.execute(
+        """
+        SELECT id, numero, es_snapshot
+        FROM recepta_versions
+        WHERE recepta_id = ?
+        ORDER BY numero DESC
+        LIMIT 1
+        """,
+        (recepta_id,),
+    ).fetchone()
+
+
+def _id_versio(conn: sqlite3.Connection, recepta_id: int, numero: int) -> int | None:
+    row = conn.execute(
+        "SELECT id FROM recepta_versions WHERE recepta_id = ? AND numero = ?",
+        (recepta_id, numero),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _refer(conn: sqlite3.Connection, versio_id: int) -> dict[str, float]:
+    # Una consulta: la cadena de pares fins al snapshot més proper i les seves línies;
+    # després apliquem els deltes del més antic al més nou
+    rows = conn.execute(
+        """
+        WITH RECURSIVE cadena(id, pare_id, es_snapshot, profunditat) AS (
+            SELECT id, pare_id, es_snapshot, 0 FROM recepta_versions WHERE id = ?
+            UNION ALL
+            SELECT v.id, v.pare_id, v.es_snapshot, c.profunditat + 1
+            FROM recepta_versions v
+            JOIN cadena c ON v.id = c.pare_id
+            WHERE c.es_snapshot = 0
+        )
+        SELECT l.codi, l.grams
+        FROM cadena c
+        JOIN recepta_versio_linies l ON l.versio_id = c.id
+        ORDER BY c.profunditat DESC, l.posicio
+        """,
+        (versio_id,),
+    ).fetchall()
+
+    linies: dict[str, float] = {}
+    for codi, grams in rows:
+        if grams is None:
+            linies.pop(codi, None)
+        else:
+            linies[codi] = grams
+    return linies
+
+
+def _escriure_versio(
+    conn: sqlite3.Connection,
+    recepta_id: int,
+    numero: int,
+    pare_id: int | None,
+    es_snapshot: bool,
+    files: list[tuple[str, int, float | None]],
+    nota: str,
+    versio_ingredients: int,
+) -> int:
+    cur = conn.execute(
+        """
+        INSERT INTO recepta_versions (recepta_id, numero, pare_id, es_snapshot, versio_ingredients, nota)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (recepta_id, numero, pare_id, int(es_snapshot), versio_ingredients, nota),
+    )
+    versio_id = cur.lastrowid
+    conn.executemany(
+        "INSERT INTO recepta_versio_linies (versio_id, codi, posicio, grams) VALUES (?, ?, ?, ?)",
+        [(versio_id, codi, posicio, grams) for codi, posicio, grams in files],
+    )
+    return versio_id
+
+
+def _assegurar_inicial(conn: sqlite3.Connection, recepta_id: int) -> sqlite3.Row:
+    # Les receptes guardades abans de tenir versions: la 1 és un snapshot de les línies actuals
+    darrera = _darrera(conn, recepta_id)
+    if darrera is not None:
+        return darrera
+
+    versio = conn.execute(
+        "SELECT versio_ingredients FROM receptes WHERE id = ?", (recepta_id,)
+    ).fetchone()
+    linies = _linies_dict(linies_recepta(conn, recepta_id))
+    _escriure_versio(
+        conn, recepta_id, 1, None, True,
+        [(codi, i, grams) for i, (codi, grams) in enumerate(linies.items())],
+        "", versio[0] if versio else None,
+    )
+    return _darrera(conn, recepta_id)
+
+
+def registrar_inicial(conn: sqlite3.Connection, recepta_id: int):
+    # En guardar una recepta nova. No fa commit.
+    _assegurar_inicial(conn, recepta_id)
+
+
+def _substituir_linies_actives(conn: sqlite3.Connection, recepta_id: int, linies: dict[str, float]):
+    # recepta_linies i recepta_subreceptes guarden sempre la darrera versió sencera:
+    # la resta de l'app (nutrició, etiquetes, subreceptes) no sap res de versions
+    ing_col = recepta_linies_ingredient_col(conn)
+    conn.execute("DELETE FROM recepta_linies WHERE recepta_id = ?", (recepta_id,))
+    conn.execute("DELETE FROM recepta_subreceptes WHERE recepta_id = ?", (recepta_id,))
+    for codi, grams in linies.items():
+        sub_id = id_subrecepta(codi)
+        if sub_id is not None:
+            conn.execute(
+                "INSERT INTO recepta_subreceptes (recepta_id, subrecepta_id, grams) VALUES (?, ?, ?)",
+                (recepta_id, sub_id, grams),
+            )
+        else:
+            conn.execute(
+                f"INSERT INTO recepta_linies (recepta_id, {ing_col}, grams) VALUES (?, ?, ?)",
+                (recepta_id, codi, grams),
+            )
+
+
+def desar_versio(conn: sqlite3.Connection, recepta_id: int, linies, nota: str = "") -> dict:
+    # Nova versió de la recepta a partir de `linies`. Només desa les línies que canvien
+    # respecte de la darrera versió (o totes, si toca snapshot). No fa commit.
+    noves = _linies_dict(linies)
+    if not noves:
+        raise ValueError("No hi ha línies vàlides (grams > 0) per guardar.")
+    desconeguts = _codis_desconeguts(conn, noves)
+    if desconeguts:
+        raise CodisDesconeguts(desconeguts)
+
+    darrera = _assegurar_inicial(conn, recepta_id)
+    anteriors = _refer(conn, darrera["id"])
+    delta = [(codi, i, grams) for i, (codi, grams) in enumerate(noves.items()) if anteriors.get(codi) != grams]
+    delta.extend((codi, len(noves) + i, None) for i, codi in enumerate(c for c in anteriors if c not in noves))
+    if not delta:
+        return {"numero": darrera["numero"], "canvis": 0, "snapshot": bool(darrera["es_snapshot"])}
+
+    # Deltes seguits des de l'últim snapshot
+    deltes = conn.execute(
+        """
+        SELECT COUNT(*) FROM recepta_versions
+        WHERE recepta_id = ? AND es_snapshot = 0
+          AND numero > (SELECT MAX(numero) FROM recepta_versions WHERE recepta_id = ? AND es_snapshot = 1)
+        """,
+        (recepta_id, recepta_id),
+    ).fetchone()[0]
+    es_snapshot = deltes + 1 >= SNAPSHOT_CADA or len(delta) >= len(noves)
+    files = [(codi, i, grams) for i, (codi, grams) in enumerate(noves.items())] if es_snapshot else delta
+
+    matriu = obtenir_matriu()
+    numero = darrera["numero"] + 1
+    _escriure_versio(conn, recepta_id, numero, darrera["id"], es_snapshot, files, nota, matriu.versio)
+
+    _substituir_linies_actives(conn, recepta_id, noves)
+    conn.execute(
+        "UPDATE receptes SET versio_ingredients = ? WHERE id = ?", (matriu.versio, recepta_id)
+    )
+    # Les receptes que la fan servir com a subrecepta també canvien
+    invalidar_dependents(conn, [recepta_id])
+    desar_nutricio_recepta(
+        conn, recepta_id, [{"codi": c, "grams": g} for c, g in noves.items()], matriu=matriu
+    )
+    return {"numero": numero, "canvis": len(delta), "snapshot": es_snapshot}
+
+
+def llistar(conn: sqlite3.Connection, recepta_id: int) -> list[dict]:
+    # Només llegeix: la versió 1 es crea en guardar (o a assegurar_taules)
+    return [
+        dict(r) for r in conn.execute(
+            """
+            SELECT v.numero, v.es_snapshot, v.versio_ingredients, v.nota, v.creada_el,
+                   COUNT(l.codi) AS linies_desades
+            FROM recepta_versions v
+            LEFT JOIN recepta_versio_linies l ON l.versio_id = v.id
+            WHERE v.recepta_id = ?
+            GROUP BY v.id
+            ORDER BY v.numero DESC
+            """,
+            (recepta_id,),
+        )
+    ]
+
+
+def linies_versio(conn: sqlite3.Connection, recepta_id: int, numero: int) -> list[dict] | None:
+    versio_id = _id_versio(conn, recepta_id, numero)
+    if versio_id is None:
+        return None
+    return [{"codi": c, "grams": g} for c, g in _refer(conn, versio_id).items()]
+
+
+def diferencia(conn: sqlite3.Connection, recepta_id: int, de: int, a: int) -> dict | None:
+    # Línies que canvien entre dues versions i diferència dels panells per 100 g
+    linies_de = linies_versio(conn, recepta_id, de)
+    linies_a = linies_versio(conn, recepta_id, a)
+    if linies_de is None or linies_a is None:
+        return None
+
+    grams_de = {l["codi"]: l["grams"] for l in linies_de}
+    grams_a = {l["codi"]: l["grams"] for l in linies_a}
+    linies = [
+        {"codi": codi, "grams_de": grams_de.get(codi), "grams_a": grams_a.get(codi)}
+        for codi in list(grams_de) + [c for c in grams_a if c not in grams_de]
+        if grams_de.get(codi) != grams_a.get(codi)
+    ]
+
+    # Els dos panells d'un sol cop, amb la mateixa versió d'ingredients
+    panell_de, panell_a = (r["resultat"] for r in calcular_nutricio_lot([
+        {"linies": linies_de}, {"linies": linies_a},
+    ]))
+    canvi = None
+    if panell_de and panell_a:
+        diferencies = [panell_a.pes - panell_de.pes, *(panell_a.valors - panell_de.valors).tolist()]
+        # + 0.0: round(-0.001, 2) dona -0.0, que es mostraria com a "-0.0"
+        canvi = {c: round(d, 2) + 0.0 for c, d in zip(["pes_total_g", *COLS_100G], diferencies)}
+    return {
+        "de": de,
+        "a": a,
+        "linies": linies,
+        "resultat_de": panell_de,
+        "resultat_a": panell_a,
+        "canvi_100g": canvi,
+    }
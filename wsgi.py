@@ -0,0 +1,5 @@
+# wsgi.py
+from app import crear_app
+
+
+app = crear_app()